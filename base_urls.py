@@ -1,5 +1,7 @@
 from django.urls import include, path
 
+from todo.api.urls import api_urlpatterns
+
 """
 This urlconf exists so we can run tests without an actual Django project
 (Django expects ROOT_URLCONF to exist.) This helps the tests remain isolated.
@@ -7,7 +9,12 @@ For your project, ignore this file and add
 
 `path('lists/', include('todo.urls')),`
 
+(and `path('api/', include(api_urlpatterns)),` for the REST API)
+
 to your site's urlconf.
 """
 
-urlpatterns = [path("lists/", include("todo.urls"))]
+urlpatterns = [
+    path("lists/", include("todo.urls")),
+    path("api/", include(api_urlpatterns)),
+]
@@ -26,6 +26,7 @@ INSTALLED_APPS = (
     "todo",
     "dal",
     "dal_select2",
+    "rest_framework",
     # pai
     # django-filer
     "easy_thumbnails",
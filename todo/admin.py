@@ -1,38 +1,23 @@
-import csv
-import datetime
-
 from django.contrib import admin
-from django.http import HttpResponse
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _  # pai
 
 from todo.models import Attachment, Comment, Task, TaskList
+from todo.operations.task_exporter import TaskExporter
+
+
+def export_tasks_to_csv(modeladmin, request, queryset):
+    return TaskExporter(queryset, export_format="csv").response(gzip=TaskExporter.accepts_gzip(request))
+
+
+export_tasks_to_csv.short_description = _("Export to CSV")
+
+
+def export_tasks_to_ndjson(modeladmin, request, queryset):
+    return TaskExporter(queryset, export_format="ndjson").response(gzip=TaskExporter.accepts_gzip(request))
 
 
-def export_to_csv(modeladmin, request, queryset):
-    opts = modeladmin.model._meta
-    content_disposition = f"attachment; filename={opts.verbose_name}.csv"
-    response = HttpResponse(content_type="text/csv")
-    response["Content-Disposition"] = content_disposition
-    writer = csv.writer(response)
-    fields = [
-        field for field in opts.get_fields() if not (field.many_to_many and not field.one_to_many)
-    ]
-    # Write a first row with header information
-    writer.writerow([field.verbose_name for field in fields])
-    # Write data rows
-    for obj in queryset:
-        data_row = []
-        for field in fields:
-            value = getattr(obj, field.name)
-            if isinstance(value, datetime.datetime):
-                value = value.strftime("%d/%m/%Y")
-            data_row.append(value)
-        writer.writerow(data_row)
-    return response
-
-
-export_to_csv.short_description = _("Export to CSV")
+export_tasks_to_ndjson.short_description = _("Export to NDJSON")
 
 
 class TaskListAdmin(admin.ModelAdmin):
@@ -44,7 +29,7 @@ class TaskAdmin(admin.ModelAdmin):
     list_filter = ("task_list",)
     ordering = ("priority",)
     search_fields = ("title", "procedure_uuid")
-    actions = [export_to_csv]
+    actions = [export_tasks_to_csv, export_tasks_to_ndjson]
 
 
 class CommentAdmin(admin.ModelAdmin):
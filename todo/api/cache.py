@@ -0,0 +1,41 @@
+import hashlib
+
+from rest_framework.response import Response
+
+from ..cache import get_response_cache, get_versions
+from ..defaults import defaults
+from ..utils import get_permission_context
+
+
+class CachedResponseMixin:
+    """
+    Caches the views' successful responses data (TODO_API_CACHE), keyed by path and query, Accept header,
+    the user's permission fingerprint and the versions of the get_cache_version_keys() the response depends on.
+    """
+
+    def get_cache_version_keys(self):
+        raise NotImplementedError
+
+    def get_response_cache_key(self, cache):
+        request = self.request
+        key = '|'.join([get_permission_context(request.user).fingerprint,
+                        request.get_full_path(),
+                        request.META.get('HTTP_ACCEPT', '')] + get_versions(cache, self.get_cache_version_keys()))
+
+        return 'todo:api:response:' + hashlib.sha1(key.encode()).hexdigest()
+
+    def cached_response(self, view_method, request, *args, **kwargs):
+        cache = get_response_cache()
+        if cache is None:
+            return view_method(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(cache)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = view_method(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, defaults('TODO_API_CACHE_TIMEOUT'))
+
+        return response
@@ -0,0 +1,51 @@
+import calendar
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from ..utils import get_permission_context
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag and Last-Modified to the views' GET responses and answers matching If-None-Match
+    requests with 304, before any serialization. If-Modified-Since is not answered: deletes and
+    visibility changes (tasks, groups) change the ETag but not the last modification date.
+
+    Views implement get_change_stamp(), a cheap (last_modified, values) pair whose values change
+    whenever the representation does. None means no stamp, the request is served as usual.
+    """
+
+    def get_change_stamp(self):
+        raise NotImplementedError
+
+    def get_etag(self, values):
+        request = self.request
+        key = '|'.join([get_permission_context(request.user).fingerprint,
+                        request.get_full_path(),
+                        request.META.get('HTTP_ACCEPT', '')] + [str(value) for value in values])
+
+        return quote_etag(hashlib.sha1(key.encode()).hexdigest())
+
+    def conditional_get(self, view_method, request, *args, **kwargs):
+        stamp = self.get_change_stamp()
+        if stamp is None:
+            return view_method(request, *args, **kwargs)
+
+        last_modified, values = stamp
+        etag = self.get_etag(values)
+        last_modified = last_modified and calendar.timegm(last_modified.utctimetuple())
+
+        # the ETag only, If-Modified-Since could get a stale 304
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            response = view_method(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Accept', 'Authorization', 'Cookie'))
+
+        return response
@@ -0,0 +1,43 @@
+from collections import OrderedDict
+
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from ..pagination import KeysetPaginator
+
+
+class TaskKeysetPagination(BasePagination):
+    """
+    Keyset pagination over (priority, created_at, id), see todo.pagination.KeysetPaginator
+    """
+    page_size = 20
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get('limit', self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page = KeysetPaginator(queryset, self.get_page_size(request)) \
+            .get_page(after=request.query_params.get('after'), before=request.query_params.get('before'))
+
+        return list(self.page)
+
+    def _get_link(self, param, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'before' if param == 'after' else 'after')
+        return replace_query_param(url, param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self._get_link('after', self.page.next_cursor)),
+            ('previous', self._get_link('before', self.page.previous_cursor)),
+            ('results', data),
+        ]))
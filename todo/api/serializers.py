@@ -1,25 +1,65 @@
 import base64
 import mimetypes
 import binascii
+import tempfile
 import uuid
 
-from django.core.files.base import ContentFile
+from django.core.files.base import File
 from django.utils.translation import ugettext as _
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.utils import timezone
-from django.db.models import Q
+from django.db.models import Count, Q
 
 from rest_framework import serializers
 from rest_framework.fields import Field
+from rest_framework.permissions import SAFE_METHODS
 
-from ..models import Task, TaskList, Comment, now
+from ..models import AttachmentUpload, Task, TaskList, Comment, now
+from ..pagination import KeysetPaginator
+from .url_builder import get_url_builder
 from ..utils import add_attachment_file, staff_check
 
 User = get_user_model()
 
 
+def get_requested_fields(request):
+    """
+    Returns the (fields, expand) name sets of ?fields= and ?expand=, fields being None when not restricted
+    """
+    def names(param):
+        return {name.strip() for name in request.query_params.get(param, '').split(',') if name.strip()}
+
+    # ?embed= predates ?expand=
+    return names('fields') or None, names('expand') | names('embed')
+
+
+class DynamicFieldsMixin:
+    """
+    Keeps the fields named in ?fields= (all when absent), Meta.expandable_fields are left out unless
+    named in ?expand=. Only applies to the serializer of the response of reads, not to nested ones,
+    writes get all their input fields.
+    """
+
+    def get_fields(self):
+        fields = super(DynamicFieldsMixin, self).get_fields()
+
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS or self.context.get('nested'):
+            return fields
+
+        requested, expand = get_requested_fields(request)
+        for name in getattr(self.Meta, 'expandable_fields', ()):
+            if name not in expand:
+                fields.pop(name, None)
+        if requested is not None:
+            for name in set(fields) - requested:
+                fields.pop(name)
+
+        return fields
+
+
 class PartialObjectSerializer(serializers.Serializer):
     _partial = serializers.SerializerMethodField(method_name='get_partial')
 
@@ -33,7 +73,30 @@ class UrlObjectSerializer(serializers.Serializer):
     def get_url(self, instance):
         request = self.context['request']
 
-        return request.build_absolute_uri(instance.get_relative_rest_url())
+        return get_url_builder(request).build(instance.rest_url_name, instance.pk)
+
+
+def decode_base64_file(data, chunk_size=64 * 1024):
+    """
+    Decodes a "data:<mime>;base64,<data>" string into a file, chunk by chunk, spooled to disk
+    when large. Raises ValueError or binascii.Error on malformed data.
+    """
+    mime, encoded_data = data.replace('data:', '', 1).split(';base64,')
+    extension = mimetypes.guess_extension(mime)
+
+    chunk_size -= chunk_size % 4
+    spooled = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    try:
+        for start in range(0, len(encoded_data), chunk_size):
+            spooled.write(base64.b64decode(encoded_data[start:start + chunk_size], validate=True))
+    except binascii.Error:
+        # whitespace breaks chunk alignment, decode in one go
+        spooled.seek(0)
+        spooled.truncate()
+        spooled.write(base64.b64decode(encoded_data))
+    spooled.seek(0)
+
+    return File(spooled, name='{name}{extension}'.format(name=str(uuid.uuid4()), extension=extension))
 
 
 class Base64FileField(Field):
@@ -44,10 +107,7 @@ class Base64FileField(Field):
             raise serializers.ValidationError(self._ERROR_MESSAGE)
 
         try:
-            mime, encoded_data = data.replace('data:', '', 1).split(';base64,')
-            extension = mimetypes.guess_extension(mime)
-            file = ContentFile(base64.b64decode(encoded_data), name='{name}{extension}'.format(name=str(uuid.uuid4()),
-                                                                                               extension=extension))
+            file = decode_base64_file(data)
         except (ValueError, binascii.Error):
             raise serializers.ValidationError(self._ERROR_MESSAGE)
 
@@ -72,13 +132,12 @@ class CommentSerializer(serializers.ModelSerializer):
     def get_author(self, instance):
         if 'django_sso_app' in settings.INSTALLED_APPS:
             request = self.context['request']
-            return request.build_absolute_uri(reverse('django_sso_app_user:rest-detail',
-                                                      args=[instance.author.sso_id]))
+            return get_url_builder(request).build('django_sso_app_user:rest-detail', instance.author.sso_id)
         else:
             return instance.author.username
 
 
-class TaskSerializer(serializers.ModelSerializer, UrlObjectSerializer):
+class TaskSerializer(DynamicFieldsMixin, serializers.ModelSerializer, UrlObjectSerializer):
     created_by = serializers.SerializerMethodField()
     assigned_to = serializers.SerializerMethodField(required=False)
 
@@ -115,8 +174,7 @@ class TaskSerializer(serializers.ModelSerializer, UrlObjectSerializer):
         if instance.created_by is not None:
             if 'django_sso_app' in settings.INSTALLED_APPS:
                 request = self.context['request']
-                return request.build_absolute_uri(reverse('django_sso_app_user:rest-detail',
-                                                          args=[instance.created_by.sso_id]))
+                return get_url_builder(request).build('django_sso_app_user:rest-detail', instance.created_by.sso_id)
             else:
                 return instance.created_by.username
 
@@ -124,10 +182,10 @@ class TaskSerializer(serializers.ModelSerializer, UrlObjectSerializer):
         if instance.assigned_to is not None:
             if 'django_sso_app' in settings.INSTALLED_APPS:
                 request = self.context['request']
-                return request.build_absolute_uri(reverse('django_sso_app_user:rest-detail',
-                                                          args=[instance.assigned_to.sso_id]))
+                return get_url_builder(request).build('django_sso_app_user:rest-detail',
+                                                      instance.assigned_to.sso_id)
             else:
-                return instance.created_by.username
+                return instance.assigned_to.username
         else:
             if instance.task_list is not None:
                 return instance.task_list.group.name
@@ -146,19 +204,17 @@ class TaskSerializer(serializers.ModelSerializer, UrlObjectSerializer):
     def get_task_list(self, instance):
         request = self.context['request']
 
-        return request.build_absolute_uri(instance.task_list.get_relative_rest_url())
+        return get_url_builder(request).build(TaskList.rest_url_name, instance.task_list_id)
 
     def get_mark_done(self, instance):
         request = self.context['request']
 
-        return request.build_absolute_uri(reverse('todo_api:task_mark_done',
-                                                  args=[instance.id]))
+        return get_url_builder(request).build('todo_api:task_mark_done', instance.id)
 
     def get_mark_pending(self, instance):
         request = self.context['request']
 
-        return request.build_absolute_uri(reverse('todo_api:task_mark_pending',
-                                                  args=[instance.id]))
+        return get_url_builder(request).build('todo_api:task_mark_pending', instance.id)
 
 
 class PartialTaskSerializer(TaskSerializer, PartialObjectSerializer):
@@ -206,7 +262,50 @@ class TicketSerializer(TaskSerializer, PartialObjectSerializer):
         return task
 
 
-class TaskListSerializer(serializers.ModelSerializer, UrlObjectSerializer, PartialObjectSerializer):
+class TaskFilterSerializer(serializers.Serializer):
+    list = serializers.IntegerField(required=False)
+    assigned_to = serializers.IntegerField(required=False)
+    completed = serializers.BooleanField(required=False, allow_null=True, default=None)
+    procedure_uuid = serializers.CharField(required=False, max_length=36)
+    due_after = serializers.DateTimeField(required=False)
+    due_before = serializers.DateTimeField(required=False)
+
+    def filter_queryset(self, queryset):
+        data = self.validated_data
+        lookups = (('list', 'task_list_id'), ('assigned_to', 'assigned_to_id'), ('completed', 'completed'),
+                   ('procedure_uuid', 'procedure_uuid'), ('due_after', 'due_date__gte'),
+                   ('due_before', 'due_date__lt'))
+        return queryset.filter(**{lookup: data[name] for name, lookup in lookups if data.get(name) is not None})
+
+
+class BulkTicketSerializer(serializers.Serializer):
+    """
+    One ticket of a bulk ticket request, the attachment is decoded once the tickets are created
+    """
+    title = serializers.CharField(max_length=255)
+    note = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    attachment = serializers.RegexField(r'^data:[\w.+-]+/[\w.+-]+;base64,', required=False, trim_whitespace=False)
+
+
+class BulkMarkSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+    completed = serializers.BooleanField()
+
+
+class AttachmentUploadSerializer(serializers.ModelSerializer):
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AttachmentUpload
+        fields = ('id', 'url', 'filename', 'size', 'offset', 'created_at')
+        read_only_fields = ('id', 'offset', 'created_at')
+
+    def get_url(self, instance):
+        return get_url_builder(self.context['request']).build('todo_api:attachment_upload_detail', instance.pk)
+
+
+class TaskListSerializer(DynamicFieldsMixin, serializers.ModelSerializer, UrlObjectSerializer,
+                         PartialObjectSerializer):
     class Meta:
         model = TaskList
         fields = ('name',
@@ -214,22 +313,61 @@ class TaskListSerializer(serializers.ModelSerializer, UrlObjectSerializer, Parti
                   '_partial')
 
 
-class TaskListDetailSerializer(serializers.ModelSerializer, UrlObjectSerializer):
+def get_task_list_api_tasks(task_list, user):
+    """
+    Active tasks of task_list visible to user through the API, creator or assignee unless staff
+    """
+    tasks = Task.objects.filter(is_active=True).filter(task_list=task_list)
+    if not staff_check(user):
+        tasks = tasks.filter(Q(created_by=user) | Q(assigned_to=user))
+
+    return tasks
+
+
+class TaskListDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer, UrlObjectSerializer):
+    counts = serializers.SerializerMethodField()
+    tasks_url = serializers.SerializerMethodField()
     tasks = serializers.SerializerMethodField(required=False)
 
+    EMBED_DEFAULT_LIMIT = 20
+    EMBED_MAX_LIMIT = 100
+
     class Meta:
         model = TaskList
         fields = ('name',
                   'url',
+                  'counts',
+                  'tasks_url',
                   'tasks')
+        expandable_fields = ('tasks', )
+
+    def get_counts(self, instance):
+        tasks = get_task_list_api_tasks(instance, self.context['request'].user)
+
+        # aggregate names must not clash with Task fields
+        counts = tasks.aggregate(total_count=Count('pk'),
+                                 completed_count=Count('pk', filter=Q(completed=True)))
+
+        return {'total': counts['total_count'],
+                'completed': counts['completed_count'],
+                'open': counts['total_count'] - counts['completed_count']}
+
+    def get_tasks_url(self, instance):
+        request = self.context['request']
+
+        return get_url_builder(request).build('todo_api:list_tasks', instance.pk)
 
     def get_tasks(self, instance):
         request = self.context['request']
-        user = request.user
 
-        if not staff_check(user):
-            tasks = Task.objects.filter(is_active=True).filter(Q(created_by=user) | Q(assigned_to=user)).filter(task_list=instance)
-        else:
-            tasks = Task.objects.filter(is_active=True).filter(task_list=instance.id)
+        try:
+            limit = int(request.query_params.get('limit', self.EMBED_DEFAULT_LIMIT))
+        except ValueError:
+            limit = self.EMBED_DEFAULT_LIMIT
+        limit = max(1, min(limit, self.EMBED_MAX_LIMIT))
+
+        tasks = get_task_list_api_tasks(instance, request.user) \
+            .select_related('created_by', 'assigned_to', 'task_list__group')
+        page = KeysetPaginator(tasks, limit).get_page()
 
-        return PartialTaskSerializer(tasks, many=True, context=self.context).data
+        return PartialTaskSerializer(page.object_list, many=True, context=dict(self.context, nested=True)).data
@@ -0,0 +1,65 @@
+import re
+
+from django.urls import NoReverseMatch, reverse
+
+
+# reversed in place of the argument, then split out of the absolute url. A template is only used
+# for args like one of the sentinels the route accepted: digits (ids), lowercase letters and digits,
+# and UUIDs (SSO user ids).
+_SENTINELS = (
+    ('8130957624', re.compile(r'^[0-9]+$')),
+    ('todosentinel8130957624', re.compile(r'^[a-z0-9]+$')),
+    ('81309576-2481-4309-8576-248130957624',
+     re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')),
+)
+
+
+class UrlBuilder:
+    """
+    Builds absolute urls of single argument routes for one request. Each route is reversed once
+    into a (prefix, suffix) pair and the args it fits, urls are then built with string concatenation and match
+    `request.build_absolute_uri(reverse(name, args=[arg]))`. None args have no url.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self._templates = {}
+
+    def _get_template(self, name):
+        if name not in self._templates:
+            self._templates[name] = None
+            patterns = []
+            for sentinel, pattern in _SENTINELS:
+                try:
+                    url = self.request.build_absolute_uri(reverse(name, args=[sentinel]))
+                except NoReverseMatch:
+                    continue
+                if url.count(sentinel) == 1:
+                    patterns.append(pattern)
+                    self._templates[name] = tuple(url.split(sentinel)) + (patterns,)
+
+        return self._templates[name]
+
+    def build(self, name, arg):
+        if arg is None:
+            return None
+
+        arg = str(arg)
+        template = self._get_template(name)
+
+        # args needing quoting, or not fitting the route's converter, and routes the sentinels
+        # don't fit, take the slow path
+        if template is None or not any(pattern.match(arg) for pattern in template[2]):
+            return self.request.build_absolute_uri(reverse(name, args=[arg]))
+
+        return template[0] + arg + template[1]
+
+
+def get_url_builder(request):
+    """
+    Returns the url builder cached on request
+    """
+    builder = getattr(request, '_todo_url_builder', None)
+    if builder is None:
+        builder = request._todo_url_builder = UrlBuilder(request)
+    return builder
@@ -2,21 +2,38 @@ from django.conf.urls import url
 
 from rest_framework.urlpatterns import format_suffix_patterns
 
-from .views import ExternalAddApiView, TaskListsApiView, TaskListDetailApiView, TaskDetailApiView
+from .views import (ExternalAddApiView, BulkTicketApiView, TaskListsApiView, TaskListDetailApiView, TaskDetailApiView,
+                    AttachmentUploadApiView, ChangesApiView)
 
 
 _api_urlpatterns = [
     url(r'^ticket/add/$', ExternalAddApiView.as_view({'post': 'create'}), name='external_add'),
+    url(r'^ticket/bulk-add/$', BulkTicketApiView.as_view({'post': 'create'}), name='external_bulk_add'),
 
     url(r'^list/$', TaskListsApiView.as_view({'get': 'list'}), name='lists'),
     url(r'^list/(?P<pk>\w+)/$', TaskListDetailApiView.as_view({'get': 'retrieve'}), name='list_detail'),
+    url(r'^list/(?P<pk>\w+)/tasks/$', TaskListDetailApiView.as_view({'get': 'tasks'}), name='list_tasks'),
+
+    url(r'^task/$', TaskDetailApiView.as_view({'get': 'list'}), name='tasks'),
+    url(r'^task/export/$', TaskDetailApiView.as_view({'get': 'export'}), name='task_export'),
+    url(r'^task/bulk-mark/$', TaskDetailApiView.as_view({'post': 'bulk_mark'}), name='task_bulk_mark'),
 
     url(r'^task/(?P<pk>\d+)/mark-done/$', TaskDetailApiView.as_view({'post': 'mark_done'}),
         name='task_mark_done'),
     url(r'^task/(?P<pk>\d+)/mark-pending/$', TaskDetailApiView.as_view({'post': 'mark_pending'}),
         name='task_mark_pending'),
 
-    url(r'^task/(?P<pk>\d+)/$', TaskDetailApiView.as_view({'get': 'retrieve'}), name='task_detail')
+    url(r'^task/(?P<pk>\d+)/$', TaskDetailApiView.as_view({'get': 'retrieve'}), name='task_detail'),
+
+    url(r'^task/(?P<pk>\d+)/attachment-upload/$', AttachmentUploadApiView.as_view({'post': 'create'}),
+        name='attachment_upload'),
+    url(r'^attachment-upload/(?P<pk>[0-9a-f-]+)/$',
+        AttachmentUploadApiView.as_view({'get': 'retrieve', 'put': 'update', 'delete': 'destroy'}),
+        name='attachment_upload_detail'),
+    url(r'^attachment-upload/(?P<pk>[0-9a-f-]+)/finalize/$', AttachmentUploadApiView.as_view({'post': 'finalize'}),
+        name='attachment_upload_finalize'),
+
+    url(r'^changes/$', ChangesApiView.as_view({'get': 'list'}), name='changes'),
 ]
 
 api_urlpatterns = (format_suffix_patterns(_api_urlpatterns), 'todo_api')
@@ -1,7 +1,12 @@
-from django.db.models import Q
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Max, Prefetch, Q
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404, redirect
 from django.utils.translation import gettext_lazy as _
 
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.viewsets import GenericViewSet, ReadOnlyModelViewSet
 from rest_framework.mixins import CreateModelMixin, ListModelMixin, RetrieveModelMixin
@@ -9,10 +14,43 @@ from rest_framework.response import Response
 from rest_framework.serializers import Serializer
 from rest_framework import status
 
-from ..utils import staff_check, get_user_groups, user_can_toggle_task_done, toggle_task_completed
-from ..models import Task, TaskList
-from .serializers import (TicketSerializer, TaskSerializer,
-                          TaskListSerializer, TaskListDetailSerializer)
+from ..utils import (staff_check, get_permission_context, user_can_toggle_task_done, toggle_task_completed,
+                     set_tasks_completed, add_attachment_file, finalize_attachment_upload, validate_attachment_file)
+from ..models import Attachment, AttachmentUpload, ChangeLog, Comment, Task, TaskList, now
+from ..operations.task_exporter import TaskExporter
+from ..cache import lists_version_key, task_list_version_key
+from .cache import CachedResponseMixin
+from .conditional import ConditionalGetMixin
+from .parsers import NDJSONParser
+from .pagination import TaskKeysetPagination
+from .serializers import (AttachmentUploadSerializer, CommentSerializer, TicketSerializer, TaskSerializer,
+                          PartialTaskSerializer, BulkMarkSerializer, BulkTicketSerializer, TaskFilterSerializer, TaskListSerializer,
+                          TaskListDetailSerializer,
+                          decode_base64_file, get_requested_fields, get_task_list_api_tasks)
+from .url_builder import get_url_builder
+
+
+# relations read by each TaskSerializer field
+_TASK_FIELD_RELATIONS = {
+    'created_by': (('created_by', ), ()),
+    'assigned_to': (('assigned_to', 'task_list__group'), ()),
+    'comments': ((), (Prefetch('comment_set', queryset=Comment.objects.select_related('author')), )),
+    'attachments': ((), (Prefetch('attachment_set', queryset=Attachment.objects.select_related('filer_file')), )),
+}
+
+
+def prefetch_task_relations(tasks, fields=None):
+    """
+    Loads the relations TaskSerializer reads for fields (all when None), in a fixed number of queries
+    """
+    for name, (select, prefetch) in _TASK_FIELD_RELATIONS.items():
+        if fields is None or name in fields:
+            # select_related() without arguments would follow every foreign key
+            if select:
+                tasks = tasks.select_related(*select)
+            tasks = tasks.prefetch_related(*prefetch)
+
+    return tasks
 
 
 class ExternalAddApiView(CreateModelMixin, GenericViewSet):
@@ -22,7 +60,76 @@ class ExternalAddApiView(CreateModelMixin, GenericViewSet):
     queryset = Task.objects.none()
 
 
-class TaskListsApiView(ListModelMixin, GenericViewSet):
+class BulkTicketApiView(GenericViewSet):
+    """
+    Files many tickets in one request, as a JSON array or NDJSON body. Tasks are inserted in bulk,
+    then attachments are decoded and added one ticket at a time. The body is parsed whole, attachments
+    included, its size is bounded by max_tickets.
+    """
+    serializer_class = BulkTicketSerializer
+    permission_classes = (IsAuthenticated, )
+    parser_classes = (JSONParser, NDJSONParser)
+    queryset = Task.objects.none()
+
+    max_tickets = 1000
+
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list) or not 0 < len(request.data) <= self.max_tickets:
+            return Response(_("Expected a list of 1 to {} tickets.").format(self.max_tickets),
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = [{'index': index, 'url': None, 'error': None} for index in range(len(request.data))]
+        valid = []
+        for index, item in enumerate(request.data):
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index]['error'] = serializer.errors
+
+        if len(valid) == 0:
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+
+        # resolved once for the whole request
+        task_list = TaskList.objects.get(slug=settings.TODO_DEFAULT_LIST_SLUG)
+        assignee = get_user_model().objects.get(username=settings.TODO_DEFAULT_ASSIGNEE)
+        created_at = now()
+
+        tasks = Task.objects.bulk_create([
+            Task(title=data['title'], note=data.get('note'), task_list=task_list, created_by=request.user,
+                 created_at=created_at, assigned_to=assignee)
+            for _index, data in valid
+        ])
+
+        url_builder = get_url_builder(request)
+        for (index, data), task in zip(valid, tasks):
+            results[index]['url'] = url_builder.build(Task.rest_url_name, task.pk)
+
+            if data.get('attachment') is not None:
+                try:
+                    add_attachment_file(request, decode_base64_file(data['attachment']), task)
+                except Exception as e:
+                    results[index]['error'] = {'attachment': [str(e)]}
+
+        return Response({'results': results}, status=status.HTTP_201_CREATED)
+
+
+def get_api_tasks(user):
+    """
+    Tasks user can see through the API, created or assigned ones when not staff
+    """
+    if not staff_check(user):
+        return Task.objects.filter(Q(created_by=user) | Q(assigned_to=user))
+    else:
+        return Task.objects.filter(is_active=True)
+
+
+def _last_change(*dates):
+    dates = [date for date in dates if date is not None]
+    return max(dates) if dates else None
+
+
+class TaskListsApiView(CachedResponseMixin, ConditionalGetMixin, ListModelMixin, GenericViewSet):
     serializer_class = TaskListSerializer
     lookup_field = 'pk'
     permission_classes = (IsAuthenticated, )
@@ -32,14 +139,27 @@ class TaskListsApiView(ListModelMixin, GenericViewSet):
         if staff_check(user):
             return TaskList.objects.all()
         else:
-            return TaskList.objects.filter(group__in=get_user_groups(user))
+            return TaskList.objects.filter(group__in=get_permission_context(user).group_ids)
+
+    def get_change_stamp(self):
+        stamp = self.get_queryset().aggregate(list_count=Count('pk'),
+                                              last_change=Max(Coalesce('updated_at', 'created_at')))
+
+        return stamp['last_change'], (stamp['list_count'], stamp['last_change'])
+
+    def get_cache_version_keys(self):
+        return [lists_version_key()]
+
+    def _list(self, request, *args, **kwargs):
+        return self.cached_response(super(TaskListsApiView, self).list, request, *args, **kwargs)
 
     def list(self, request, *args, **kwargs):
-        return super(TaskListsApiView, self).list(request, *args, **kwargs)
+        return self.conditional_get(self._list, request, *args, **kwargs)
 
 
-class TaskListDetailApiView(RetrieveModelMixin, GenericViewSet):
+class TaskListDetailApiView(CachedResponseMixin, ConditionalGetMixin, RetrieveModelMixin, GenericViewSet):
     serializer_class = TaskListDetailSerializer
+    pagination_class = TaskKeysetPagination
     lookup_field = 'pk'
     permission_classes = (IsAuthenticated, )
 
@@ -48,32 +168,99 @@ class TaskListDetailApiView(RetrieveModelMixin, GenericViewSet):
         if staff_check(user):
             return TaskList.objects.all()
         else:
-            return TaskList.objects.filter(group__in=get_user_groups(user))
+            return TaskList.objects.filter(group__in=get_permission_context(user).group_ids)
+
+    def get_change_stamp(self):
+        task_list = self.get_queryset().filter(pk=self.kwargs['pk']).first()
+        if task_list is None:
+            return None
+
+        # counts and embedded tasks
+        tasks = get_task_list_api_tasks(task_list, self.request.user) \
+            .aggregate(task_count=Count('pk'), last_change=Max(Coalesce('updated_at', 'created_at')))
+
+        last_change = _last_change(task_list.updated_at or task_list.created_at, tasks['last_change'])
+        return last_change, (task_list.pk, task_list.updated_at, tasks['task_count'], tasks['last_change'])
+
+    def get_cache_version_keys(self):
+        return [task_list_version_key(self.kwargs['pk'])]
+
+    def _retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super(TaskListDetailApiView, self).retrieve, request, *args, **kwargs)
 
     def retrieve(self, request, *args, **kwargs):
-        return super(TaskListDetailApiView, self).retrieve(request, *args, **kwargs)
+        return self.conditional_get(self._retrieve, request, *args, **kwargs)
+
+    def tasks(self, request, *args, **kwargs):
+        return self.cached_response(self._tasks, request, *args, **kwargs)
+
+    def _tasks(self, request, *args, **kwargs):
+        task_list = self.get_object()
+        fields = get_requested_fields(request)[0] or set(PartialTaskSerializer.Meta.fields)
+        tasks = prefetch_task_relations(get_task_list_api_tasks(task_list, request.user), fields)
+
+        page = self.paginate_queryset(tasks)
+        serializer = PartialTaskSerializer(page, many=True, context=self.get_serializer_context())
 
+        return self.get_paginated_response(serializer.data)
 
-class TaskDetailApiView(ReadOnlyModelViewSet):
+
+class TaskDetailApiView(ConditionalGetMixin, ReadOnlyModelViewSet):
     lookup_field = 'pk'
+    pagination_class = TaskKeysetPagination
     permission_classes = (IsAuthenticated, )
 
     def get_queryset(self):
-        user = self.request.user
+        tasks = get_api_tasks(self.request.user)
 
-        if not staff_check(user):
-            return Task.objects.filter(Q(created_by=user) | Q(assigned_to=user))
-        else:
-            return Task.objects.filter(is_active=True)
+        if self.action in ('list', 'retrieve'):
+            tasks = prefetch_task_relations(tasks, get_requested_fields(self.request)[0])
+
+        return tasks
 
     def get_serializer_class(self):
         if self.action in ('mark_done', 'mark_pending'):
             return Serializer
+        elif self.action == 'bulk_mark':
+            return BulkMarkSerializer
         else:
             return TaskSerializer
 
+    def filter_queryset(self, queryset):
+        if self.action in ('list', 'export'):
+            filters = TaskFilterSerializer(data=self.request.query_params)
+            filters.is_valid(raise_exception=True)
+            queryset = filters.filter_queryset(queryset)
+
+        return queryset
+
+    def get_change_stamp(self):
+        stamp = self.get_queryset().filter(pk=self.kwargs['pk']).aggregate(
+            task_count=Count('pk', distinct=True),
+            last_change=Max(Coalesce('updated_at', 'created_at')),
+            comment_count=Count('comment', distinct=True),
+            last_comment=Max('comment__created_at'),
+            attachment_count=Count('attachment', distinct=True),
+            last_attachment=Max('attachment__created_at'))
+        if not stamp['task_count']:
+            return None
+
+        last_change = _last_change(stamp['last_change'], stamp['last_comment'], stamp['last_attachment'])
+        return last_change, tuple(value for name, value in sorted(stamp.items()))
+
     def retrieve(self, request, pk=None, *args, **kwargs):
-        return super(TaskDetailApiView, self).retrieve(request, pk, *args, **kwargs)
+        return self.conditional_get(super(TaskDetailApiView, self).retrieve, request, pk, *args, **kwargs)
+
+    def export(self, request, *args, **kwargs):
+        # not ?format=, DRF reserves it for renderer selection
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in TaskExporter.FORMATS:
+            return Response(_("Unknown export format."), status=status.HTTP_400_BAD_REQUEST)
+
+        tasks = self.filter_queryset(get_api_tasks(request.user))
+
+        return TaskExporter(tasks, export_format=export_format) \
+            .response(gzip=TaskExporter.accepts_gzip(request))
 
     def _toggle_done(self, request, task):
         if not user_can_toggle_task_done(request.user, task):
@@ -104,3 +291,175 @@ class TaskDetailApiView(ReadOnlyModelViewSet):
             return Response(_("Task not done."), status=status.HTTP_400_BAD_REQUEST)
 
         return self._toggle_done(request, task)
+
+    def bulk_mark(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        task_ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        completed = serializer.validated_data['completed']
+
+        results = set_tasks_completed(task_ids, completed, user=request.user)
+
+        return Response({
+            'completed': completed,
+            'results': [
+                {
+                    'id': task_id,
+                    'changed': results[task_id] is None,
+                    'error': None if results[task_id] is None else str(results[task_id]),
+                }
+                for task_id in task_ids
+            ]
+        })
+
+
+class AttachmentUploadApiView(GenericViewSet):
+    """
+    Resumable attachment uploads: POST filename and size to a task to start one, PUT the file
+    in chunks with ?offset= set to the bytes received so far, then POST to finalize.
+    """
+    serializer_class = AttachmentUploadSerializer
+    permission_classes = (IsAuthenticated, )
+
+    def get_queryset(self):
+        return AttachmentUpload.objects.filter(user=self.request.user)
+
+    def create(self, request, pk=None, *args, **kwargs):
+        task = get_object_or_404(get_api_tasks(request.user), pk=pk)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            validate_attachment_file(serializer.validated_data['filename'], serializer.validated_data['size'])
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        serializer.save(task=task, user=request.user)
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    def update(self, request, *args, **kwargs):
+        try:
+            offset = int(request.query_params['offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response(_("Expected an ?offset= and a Content-Length."), status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            upload = get_object_or_404(self.get_queryset().select_for_update(), pk=kwargs['pk'])
+
+            if offset != upload.offset:
+                # the client resumes from the returned offset
+                return Response(self.get_serializer(upload).data, status=status.HTTP_409_CONFLICT)
+
+            if length > 0:
+                try:
+                    upload.write_chunk(request.stream, length)
+                except ValueError as e:
+                    return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(self.get_serializer(upload).data)
+
+    def finalize(self, request, *args, **kwargs):
+        with transaction.atomic():
+            upload = get_object_or_404(self.get_queryset().select_for_update(), pk=kwargs['pk'])
+
+            try:
+                attachment = finalize_attachment_upload(upload)
+            except Exception as e:
+                return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'task': get_url_builder(request).build(Task.rest_url_name, attachment.task_id),
+            'filename': attachment.filename(),
+            'url': request.build_absolute_uri(attachment.filer_file.url),
+        }, status=status.HTTP_201_CREATED)
+
+    def destroy(self, request, *args, **kwargs):
+        self.get_object().delete()
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ChangesApiView(GenericViewSet):
+    """
+    Tasks, comments and attachments changed after the ?since= cursor, oldest first.
+    Without a cursor only the current one is returned, to start syncing from.
+    """
+    permission_classes = (IsAuthenticated, )
+    queryset = ChangeLog.objects.none()
+
+    default_limit = 100
+    max_limit = 1000
+
+    def _get_changed_objects(self, entries):
+        user = self.request.user
+        ids = {kind: [entry.object_id for entry in entries if entry.kind == kind and not entry.deleted]
+               for kind, _label in ChangeLog.KIND_CHOICES}
+        visible_tasks = get_api_tasks(user)
+        context = self.get_serializer_context()
+
+        tasks = prefetch_task_relations(visible_tasks.filter(pk__in=ids[ChangeLog.TASK]),
+                                        get_requested_fields(self.request)[0])
+        comments = Comment.objects.filter(pk__in=ids[ChangeLog.COMMENT], task__in=visible_tasks) \
+            .select_related('author')
+        attachments = Attachment.objects.filter(pk__in=ids[ChangeLog.ATTACHMENT], task__in=visible_tasks) \
+            .select_related('filer_file')
+
+        changed = {}
+        for task in tasks:
+            changed[ChangeLog.TASK, task.pk] = TaskSerializer(task, context=context).data
+        for comment in comments:
+            changed[ChangeLog.COMMENT, comment.pk] = dict(CommentSerializer(comment, context=context).data,
+                                                          task=comment.task_id)
+        for attachment in attachments:
+            changed[ChangeLog.ATTACHMENT, attachment.pk] = {
+                'task': attachment.task_id,
+                'filename': attachment.filename(),
+                'url': None if attachment.filer_file is None else
+                self.request.build_absolute_uri(attachment.filer_file.url),
+            }
+
+        return changed
+
+    def list(self, request, *args, **kwargs):
+        since = request.query_params.get('since')
+        if since is None:
+            cursor = ChangeLog.objects.aggregate(cursor=Max('pk'))['cursor'] or 0
+            return Response({'cursor': str(cursor), 'has_more': False, 'changes': []})
+
+        try:
+            since = int(since)
+            limit = max(1, min(int(request.query_params.get('limit', self.default_limit)), self.max_limit))
+        except ValueError:
+            return Response(_("Invalid cursor or limit."), status=status.HTTP_400_BAD_REQUEST)
+
+        entries = list(ChangeLog.objects.visible_to(request.user, staff_check(request.user))
+                       .filter(pk__gt=since).order_by('pk')[:limit + 1])
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        changed = self._get_changed_objects(entries)
+
+        # an object has several entries until the log is compacted, its state is given once
+        changes = {}
+        for entry in entries:
+            # objects no longer visible are gone as far as the client is concerned
+            data = changed.get((entry.kind, entry.object_id))
+            changes.pop((entry.kind, entry.object_id), None)
+            changes[entry.kind, entry.object_id] = {
+                'kind': entry.kind,
+                'id': entry.object_id,
+                'deleted': data is None,
+                'data': data,
+            }
+
+        return Response({
+            'cursor': str(entries[-1].pk if entries else since),
+            'has_more': has_more,
+            'changes': list(changes.values()),
+        })
@@ -10,3 +10,5 @@ class TodoConfig(AppConfig):
 
         except ImportError:
             pass
+
+        from . import receivers  # noqa F401
@@ -0,0 +1,77 @@
+import uuid
+
+from django.core.cache import cache as default_cache, caches
+from django.db import transaction
+
+from .defaults import defaults
+
+
+_LISTS_VERSION_KEY = 'todo:version:lists'
+_LIST_VERSION_KEY = 'todo:version:list:{}'
+_AUTOCOMPLETE_VERSION_KEY = 'todo:version:task_autocomplete:{}'
+
+
+def get_response_cache():
+    """
+    Returns the cache named by TODO_API_CACHE, None when API responses are not cached
+    """
+    alias = defaults('TODO_API_CACHE')
+    return None if alias is None else caches[alias]
+
+
+def task_list_version_key(task_list_id):
+    return _LIST_VERSION_KEY.format(task_list_id)
+
+
+def lists_version_key():
+    return _LISTS_VERSION_KEY
+
+
+def invalidate_task_lists(task_list_ids=(), lists=False):
+    """
+    Renews the versions of task_list_ids (and of the lists collection), once the current transaction
+    commits: responses cached under the previous versions are no longer read.
+    Versions are plain keys, no pattern deletes, so any cache backend works.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return
+
+    keys = [task_list_version_key(task_list_id) for task_list_id in set(task_list_ids) if task_list_id is not None]
+    if lists:
+        keys.append(lists_version_key())
+
+    _renew_versions(cache, keys)
+
+
+def task_autocomplete_version_key(task_list_id):
+    return _AUTOCOMPLETE_VERSION_KEY.format(task_list_id)
+
+
+def invalidate_task_autocomplete(task_list_ids):
+    """
+    Renews the versions of the task autocomplete matches of task_list_ids (default cache), once the current
+    transaction commits
+    """
+    _renew_versions(default_cache, [task_autocomplete_version_key(task_list_id)
+                                    for task_list_id in set(task_list_ids) if task_list_id is not None])
+
+
+def _renew_versions(cache, keys):
+    if keys:
+        transaction.on_commit(lambda: cache.set_many({key: uuid.uuid4().hex for key in keys}, None))
+
+
+def get_versions(cache, keys):
+    """
+    Returns the versions of keys, setting new ones for keys never set or evicted
+    """
+    versions = cache.get_many(keys)
+
+    # never set or evicted, a new version leaves nothing stale behind
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+
+    return [versions[key] for key in keys]
@@ -1,14 +1,15 @@
 from django.conf import settings
 
 from .models import TaskList
-from .utils import staff_check, get_user_groups
+from .utils import get_permission_context
 
 
 def todo_context(request):
-    if staff_check(request.user):
+    context = get_permission_context(request.user)
+    if context.is_staff:
         task_lists = TaskList.objects.all()
     else:
-        task_lists = TaskList.objects.filter(group__in=get_user_groups(request.user))
+        task_lists = TaskList.objects.filter(group__in=context.group_ids)
 
     return {
         "TASK_LISTS": task_lists,
@@ -3,11 +3,15 @@ from django.conf import settings
 
 hash = {
     "TODO_ALLOW_FILE_ATTACHMENTS": True,
+    "TODO_API_CACHE": None,
+    "TODO_API_CACHE_TIMEOUT": 300,
     "TODO_COMMENT_CLASSES": [],
     "TODO_DEFAULT_ASSIGNEE": None,
+    "TODO_ESTIMATED_COUNT_THRESHOLD": None,
     "TODO_LIMIT_FILE_ATTACHMENTS": [".jpg", ".gif", ".png", ".csv", ".pdf", ".zip"],
     "TODO_MAXIMUM_ATTACHMENT_SIZE": 5000000,
     "TODO_PUBLIC_SUBMIT_REDIRECT": "/",
+    "TODO_SEARCH_BACKEND": None,
     "TODO_STAFF_ONLY": True,
 }
 
@@ -0,0 +1,15 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from todo.models import ChangeLog
+
+
+class Command(BaseCommand):
+    help = """Delete the change log entries superseded by later changes of the same objects.
+    Changes are appended on write, run this periodically (e.g. daily from cron).
+    """
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        count = ChangeLog.objects.compact()
+        print(f"Deleted {count} superseded change log entries")
@@ -18,6 +18,13 @@ class Command(BaseCommand):
         parser.add_argument(
             "-f", "--file", dest="file", default=None, help="File to to inbound CSV file."
         )
+        parser.add_argument(
+            "--bulk", action="store_true", default=False,
+            help="Import in chunks, with bulk lookups and writes (for large files).",
+        )
+        parser.add_argument(
+            "--batch-size", dest="batch_size", type=int, default=1000, help="Rows per chunk in bulk mode."
+        )
 
     def handle(self, *args: Any, **options: Any) -> None:
         # Need a file to proceed
@@ -33,7 +40,7 @@ class Command(BaseCommand):
 
         # Encoding "utf-8-sig" means "ignore byte order mark (BOM), which Excel inserts when saving CSVs."
         with filepath.open(mode="r", encoding="utf-8-sig") as fileobj:
-            importer = CSVImporter()
+            importer = CSVImporter(bulk=options["bulk"], batch_size=options["batch_size"])
             results = importer.upsert(fileobj, as_string_obj=True)
 
         # Report successes, failures and summaries
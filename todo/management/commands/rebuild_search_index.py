@@ -0,0 +1,26 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from todo.models import TaskSearchDocument
+from todo.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = """Rebuild the task search documents and the full-text index of the search backend
+    (TODO_SEARCH_BACKEND), installing it first if needed.
+    """
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        connection = connections[DEFAULT_DB_ALIAS]
+        backend = get_search_backend(DEFAULT_DB_ALIAS)
+
+        with connection.cursor() as cursor:
+            backend.install(cursor)
+
+        with transaction.atomic():
+            count = TaskSearchDocument.objects.rebuild()
+            backend.rebuild(connection)
+
+        print(f"Indexed {count} tasks with {backend.__class__.__name__}")
@@ -0,0 +1,35 @@
+import sys
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from todo.models import TaskListCounter
+
+
+class Command(BaseCommand):
+    help = """Rebuild the denormalized per task list and procedure task counters.
+    With --verify, only report counters out of sync with tasks (exits with status 1 if any).
+    """
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--verify", action="store_true", default=False, help="Only check counters, don't rebuild them."
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options["verify"]:
+            mismatches = TaskListCounter.objects.verify()
+
+            for task_list_id, procedure_uuid, stored, expected in mismatches:
+                print(
+                    f"Task list {task_list_id}, procedure {procedure_uuid}: "
+                    f"stored (total, completed, active, last completed) {stored}, expected {expected}"
+                )
+
+            print(f"{len(mismatches)} counters out of sync")
+            if mismatches:
+                sys.exit(1)
+
+        else:
+            TaskListCounter.objects.rebuild()
+            print(f"Rebuilt {TaskListCounter.objects.count()} counters")
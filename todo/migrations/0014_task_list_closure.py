@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_task_list_closure(apps, schema_editor):
+    TaskList = apps.get_model('todo', 'TaskList')
+    TaskListClosure = apps.get_model('todo', 'TaskListClosure')
+
+    previous = dict(TaskList.objects.values_list('pk', 'previous_task_list_id'))
+
+    links = []
+    for descendant_id in previous:
+        ancestor_id, depth = descendant_id, 0
+        seen = set()
+        while ancestor_id is not None and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            links.append(TaskListClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth))
+            ancestor_id, depth = previous.get(ancestor_id), depth + 1
+
+    TaskListClosure.objects.bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0013_auto_20210203_1230'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskListClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(verbose_name='depth')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='todo.tasklist', verbose_name='ancestor')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='todo.tasklist', verbose_name='descendant')),
+            ],
+            options={
+                'unique_together': {('ancestor', 'descendant')},
+                'index_together': {('descendant', 'depth')},
+            },
+        ),
+        migrations.RunPython(build_task_list_closure, migrations.RunPython.noop),
+    ]
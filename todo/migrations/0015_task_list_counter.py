@@ -0,0 +1,55 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:20
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+import django.db.models.deletion
+
+
+def build_task_list_counters(apps, schema_editor):
+    Task = apps.get_model('todo', 'Task')
+    TaskListCounter = apps.get_model('todo', 'TaskListCounter')
+
+    rows = Task.objects.filter(task_list__isnull=False) \
+        .values_list('task_list_id', 'procedure_uuid') \
+        .annotate(total_count=Count('pk'),
+                  completed_count=Count('pk', filter=Q(completed=True)),
+                  active_count=Count('pk', filter=Q(is_active=True)),
+                  last_completed=Max('completed_date', filter=Q(completed=True))) \
+        .order_by()
+
+    TaskListCounter.objects.bulk_create([
+        TaskListCounter(task_list_id=task_list_id, procedure_uuid=procedure_uuid,
+                        total=total, completed=completed, active=active, last_completed_at=last_completed_at)
+        for task_list_id, procedure_uuid, total, completed, active, last_completed_at in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0014_task_list_closure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskListCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('procedure_uuid', models.CharField(blank=True, max_length=36, null=True)),
+                ('total', models.IntegerField(default=0, verbose_name='total')),
+                ('completed', models.IntegerField(default=0, verbose_name='completed')),
+                ('active', models.IntegerField(default=0, verbose_name='active')),
+                ('last_completed_at', models.DateTimeField(blank=True, null=True, verbose_name='last completed at')),
+                ('task_list', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to='todo.tasklist', verbose_name='task list')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='tasklistcounter',
+            constraint=models.UniqueConstraint(fields=('task_list', 'procedure_uuid'), name='todo_tasklistcounter_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='tasklistcounter',
+            constraint=models.UniqueConstraint(condition=models.Q(('procedure_uuid__isnull', True)), fields=('task_list',), name='todo_tasklistcounter_unique_no_procedure'),
+        ),
+        migrations.RunPython(build_task_list_counters, migrations.RunPython.noop),
+    ]
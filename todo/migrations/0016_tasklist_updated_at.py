@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0015_task_list_counter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tasklist',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='updated at'),
+        ),
+    ]
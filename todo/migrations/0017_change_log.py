@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:43
+
+from django.db import migrations, models
+import todo.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0016_tasklist_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='task',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True, verbose_name='updated at'),
+        ),
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('task', 'task'), ('comment', 'comment'), ('attachment', 'attachment')], max_length=10, verbose_name='kind')),
+                ('object_id', models.PositiveIntegerField(verbose_name='object id')),
+                ('deleted', models.BooleanField(default=False, verbose_name='deleted')),
+                ('changed_at', models.DateTimeField(default=todo.models.now, editable=False, verbose_name='changed at')),
+                ('task_id', models.IntegerField(blank=True, null=True, verbose_name='task id')),
+                ('task_list_id', models.IntegerField(blank=True, null=True, verbose_name='task list id')),
+                ('created_by_id', models.IntegerField(blank=True, null=True, verbose_name='created by id')),
+                ('assigned_to_id', models.IntegerField(blank=True, null=True, verbose_name='assigned to id')),
+            ],
+            options={
+                'index_together': {('kind', 'object_id')},
+            },
+        ),
+    ]
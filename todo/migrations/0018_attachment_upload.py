@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import todo.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('todo', '0017_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='filename')),
+                ('size', models.PositiveBigIntegerField(verbose_name='size')),
+                ('offset', models.PositiveBigIntegerField(default=0, verbose_name='offset')),
+                ('staged_file', models.CharField(editable=False, max_length=255, verbose_name='staged file')),
+                ('created_at', models.DateTimeField(default=todo.models.now, editable=False, verbose_name='created at')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='todo.task', verbose_name='task')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# the full-text index of the database vendor's search backend (todo.search.backends) as it was
+# when this migration was written, other backends are installed by rebuild_search_index
+FTS = 'todo_tasksearchdocument_fts'
+
+INSTALL_SQL = {
+    'postgresql': [
+        f"CREATE INDEX IF NOT EXISTS {FTS} ON todo_tasksearchdocument USING gin (to_tsvector('simple', document))",
+    ],
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS} "
+        f"USING fts5(document, content='todo_tasksearchdocument', content_rowid='task_id')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS}_insert AFTER INSERT ON todo_tasksearchdocument BEGIN "
+        f"INSERT INTO {FTS} (rowid, document) VALUES (new.task_id, new.document); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS}_delete AFTER DELETE ON todo_tasksearchdocument BEGIN "
+        f"INSERT INTO {FTS} ({FTS}, rowid, document) VALUES ('delete', old.task_id, old.document); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS}_update AFTER UPDATE ON todo_tasksearchdocument BEGIN "
+        f"INSERT INTO {FTS} ({FTS}, rowid, document) VALUES ('delete', old.task_id, old.document); "
+        f"INSERT INTO {FTS} (rowid, document) VALUES (new.task_id, new.document); END",
+    ],
+}
+
+UNINSTALL_SQL = {
+    'postgresql': [
+        f"DROP INDEX IF EXISTS {FTS}",
+    ],
+    'sqlite': [
+        f"DROP TRIGGER IF EXISTS {FTS}_insert",
+        f"DROP TRIGGER IF EXISTS {FTS}_delete",
+        f"DROP TRIGGER IF EXISTS {FTS}_update",
+        f"DROP TABLE IF EXISTS {FTS}",
+    ],
+}
+
+
+def install_search_index(apps, schema_editor):
+    for sql in INSTALL_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def uninstall_search_index(apps, schema_editor):
+    for sql in UNINSTALL_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def build_task_search_documents(apps, schema_editor):
+    Task = apps.get_model('todo', 'Task')
+    Comment = apps.get_model('todo', 'Comment')
+    TaskSearchDocument = apps.get_model('todo', 'TaskSearchDocument')
+
+    last_pk = 0
+    while True:
+        documents = {pk: [title, note or ''] for pk, title, note in
+                     Task.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'title', 'note')[:1000]}
+        if len(documents) == 0:
+            return
+
+        for task_id, body in Comment.objects.filter(task_id__in=documents).order_by('pk') \
+                .values_list('task_id', 'body'):
+            documents[task_id].append(body)
+
+        TaskSearchDocument.objects.bulk_create([TaskSearchDocument(task_id=pk, document='\n'.join(parts))
+                                                for pk, parts in documents.items()])
+        last_pk = max(documents)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0018_attachment_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskSearchDocument',
+            fields=[
+                ('task', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='todo.task', verbose_name='task')),
+                ('document', models.TextField(verbose_name='document')),
+            ],
+        ),
+        migrations.RunPython(install_search_index, uninstall_search_index),
+        migrations.RunPython(build_task_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 16:00
+
+import re
+
+from django.db import migrations, models
+from unidecode import unidecode
+
+
+def normalize_title(title):
+    # todo.models.normalize_title as it was when this migration was written
+    return re.sub(r'\s+', ' ', unidecode(title).lower()).lstrip()[:255]
+
+
+def build_title_index(apps, schema_editor):
+    Task = apps.get_model('todo', 'Task')
+
+    last_pk = 0
+    while True:
+        tasks = list(Task.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'title')[:1000])
+        if len(tasks) == 0:
+            return
+
+        for task in tasks:
+            task.title_index = normalize_title(task.title)
+        Task.objects.bulk_update(tasks, ['title_index'])
+        last_pk = tasks[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0019_task_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='title_index',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='title index'),
+        ),
+        migrations.RunPython(build_title_index, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['task_list', 'title_index'], name='todo_task_title_index', opclasses=['int4_ops', 'varchar_pattern_ops']),
+        ),
+    ]
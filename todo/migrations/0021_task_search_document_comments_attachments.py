@@ -0,0 +1,41 @@
+import os
+
+from django.db import migrations
+
+
+def rebuild_task_search_documents(apps, schema_editor):
+    Task = apps.get_model('todo', 'Task')
+    Comment = apps.get_model('todo', 'Comment')
+    Attachment = apps.get_model('todo', 'Attachment')
+    TaskSearchDocument = apps.get_model('todo', 'TaskSearchDocument')
+
+    last_pk = 0
+    while True:
+        documents = {pk: [title, note or ''] for pk, title, note in
+                     Task.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'title', 'note')[:1000]}
+        if len(documents) == 0:
+            return
+
+        for task_id, email_from, body in Comment.objects.filter(task_id__in=documents).order_by('pk') \
+                .values_list('task_id', 'email_from', 'body'):
+            documents[task_id].extend([email_from or '', body])
+        for task_id, file_name in Attachment.objects.filter(task_id__in=documents).order_by('pk') \
+                .values_list('task_id', 'file'):
+            documents[task_id].append(os.path.basename(file_name))
+
+        # delete and insert, the index is maintained by triggers on some backends
+        TaskSearchDocument.objects.filter(task_id__in=documents).delete()
+        TaskSearchDocument.objects.bulk_create([TaskSearchDocument(task_id=pk, document='\n'.join(parts))
+                                                for pk, parts in documents.items()])
+        last_pk = max(documents)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0020_task_title_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_task_search_documents, migrations.RunPython.noop),
+    ]
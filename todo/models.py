@@ -2,18 +2,24 @@ from __future__ import unicode_literals
 
 # import datetime  # pai
 import os
+import re
 import textwrap
+import uuid
 
 from django.conf import settings
 from django.contrib.auth.models import Group
-from django.db import DEFAULT_DB_ALIAS, models
-from django.db.transaction import Atomic, get_connection
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile, File
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, Count, F, Max, Q, Value, When
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _  # pai
 from django.utils import timezone
 
 from filer.fields.file import FilerFileField  # pai
+from unidecode import unidecode
 
+from .signals import task_lists_changed, tasks_completion_toggled
 from .storage import custom_fs  # pai
 
 
@@ -24,6 +30,13 @@ def now():
     return timezone.now()
 
 
+def normalize_title(title):
+    """
+    Returns title transliterated to ASCII, lower-cased, with whitespace runs collapsed, as stored in Task.title_index
+    """
+    return re.sub(r'\s+', ' ', unidecode(title).lower()).lstrip()[:255]
+
+
 def get_attachment_upload_dir(instance, filename):
     """Determine upload dir for task attachment files.
     """
@@ -50,39 +63,6 @@ def get_attachment_upload_dir(instance, filename):
                              filename])
 
 
-class LockedAtomicTransaction(Atomic):
-    """
-    modified from https://stackoverflow.com/a/41831049
-    this is needed for safely merging
-
-    Does a atomic transaction, but also locks the entire table for any transactions, for the duration of this
-    transaction. Although this is the only way to avoid concurrency issues in certain situations, it should be used with
-    caution, since it has impacts on performance, for obvious reasons...
-    """
-
-    def __init__(self, *models, using=None, savepoint=None):
-        if using is None:
-            using = DEFAULT_DB_ALIAS
-        super().__init__(using, savepoint)
-        self.models = models
-
-    def __enter__(self):
-        super(LockedAtomicTransaction, self).__enter__()
-
-        # Make sure not to lock, when sqlite is used, or you'll run into problems while running tests!!!
-        if settings.DATABASES[self.using]["ENGINE"] != "django.db.backends.sqlite3":
-            cursor = None
-            try:
-                cursor = get_connection(self.using).cursor()
-                for model in self.models:
-                    cursor.execute(
-                        "LOCK TABLE {table_name}".format(table_name=model._meta.db_table)
-                    )
-            finally:
-                if cursor and not cursor.closed:
-                    cursor.close()
-
-
 class TaskList(models.Model):
     name = models.CharField(max_length=255, verbose_name=_('name'))  # pai
     slug = models.SlugField(default="", verbose_name=_('slug'), max_length=255)
@@ -94,6 +74,7 @@ class TaskList(models.Model):
                                            on_delete=models.SET_NULL, null=True, blank=True)  # pai
 
     created_at = models.DateTimeField(verbose_name=_('created at'), default=now, editable=False)  # pai
+    updated_at = models.DateTimeField(verbose_name=_('updated at'), null=True, blank=True, editable=False)
 
     def __str__(self):
         ret = self.name
@@ -110,46 +91,513 @@ class TaskList(models.Model):
         # Prevents (at the database level) creation of two lists with the same slug in the same group
         unique_together = ("group", "slug")
 
+    def clean(self):
+        if self.previous_task_list_id is not None and not TaskListClosure.objects.can_link(self):
+            raise ValidationError({
+                'previous_task_list': _("A task list can't follow itself or one of its next task lists.")
+            })
+
+    def save(self, *args, **kwargs):
+        if self.previous_task_list_id is not None and not TaskListClosure.objects.can_link(self):
+            raise ValueError("can't make a task list follow itself or one of its next task lists")
+
+        if not self._state.adding:
+            self.updated_at = now()
+
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'updated_at'}
+
+        with transaction.atomic(using=kwargs.get('using')):
+            super(TaskList, self).save(*args, **kwargs)
+            TaskListClosure.objects.link(self)
+
     # pai
+    rest_url_name = "todo_api:list_detail"
+
     def get_relative_rest_url(self):
-        return reverse("todo_api:list_detail", args=[self.pk])
+        return reverse(self.rest_url_name, args=[self.pk])
 
     # pai
-    def set_all_tasks_completed(self, procedure_uuid=None):
+    def set_all_tasks_completed(self, procedure_uuid=None, user=None):
         """
-        Set completion status to True for all tasks
+        Set completion status to True for all tasks, returns affected task ids
         """
-        for t in self.task_set.filter(completed=False, procedure_uuid=procedure_uuid):
-            t.completed = True
-            t.save()
+        return self.task_set.filter(procedure_uuid=procedure_uuid).set_completed(True, user=user)
 
     def set_all_tasks_not_completed(self, procedure_uuid=None):
         """
-        Set completion status to False for all tasks
+        Set completion status to False for all tasks, returns affected task ids
+        """
+        return self.task_set.filter(procedure_uuid=procedure_uuid).set_completed(False)
+
+    def get_counter(self, procedure_uuid=None):
+        """
+        Returns task counts for procedure (None if the list has no such tasks)
         """
-        for t in self.task_set.filter(completed=True, procedure_uuid=procedure_uuid):
-            t.completed = False
-            t.save()
+        return TaskListCounter.objects.filter(task_list=self).for_procedure(procedure_uuid).first()
 
     def all_tasks_completed(self, procedure_uuid=None):
         """
         Tells if all tasks are completed
         """
-        return self.task_set.filter(completed=True, procedure_uuid=procedure_uuid).count() == \
-               self.task_set.filter(procedure_uuid=procedure_uuid).count()
+        counter = self.get_counter(procedure_uuid)
+
+        return counter is None or counter.completed == counter.total
 
     def get_last_completed_task(self, procedure_uuid=None):
         """
         Returns last completed task
         """
+        counter = self.get_counter(procedure_uuid)
+
+        if counter is None or counter.completed == 0:
+            return None
+
         return self.task_set.filter(completed=True, procedure_uuid=procedure_uuid).order_by('-completed_date').first()
 
 
+class TaskListClosureManager(models.Manager):
+    def can_link(self, task_list):
+        """
+        Tells if task_list can follow its previous_task_list without creating a cycle
+        """
+        if task_list.pk is None or task_list.previous_task_list_id is None:
+            return True
+
+        return not self.filter(ancestor_id=task_list.pk, descendant_id=task_list.previous_task_list_id).exists()
+
+    def link(self, task_list):
+        """
+        Updates the closure after task_list has been saved, moving its whole subtree when
+        previous_task_list changed
+        """
+        current = self.filter(descendant_id=task_list.pk, depth__lte=1).values_list('ancestor_id', 'depth')
+        current = {depth: ancestor_id for ancestor_id, depth in current}
+
+        if 0 not in current:
+            self.create(ancestor_id=task_list.pk, descendant_id=task_list.pk, depth=0)
+        elif current.get(1) == task_list.previous_task_list_id:
+            return
+
+        subtree = list(self.filter(ancestor_id=task_list.pk).values_list('descendant_id', 'depth'))
+        subtree_ids = [descendant_id for descendant_id, _depth in subtree]
+
+        # detach the subtree from its former ancestors
+        self.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+
+        if task_list.previous_task_list_id is not None:
+            ancestors = self.filter(descendant_id=task_list.previous_task_list_id).values_list('ancestor_id', 'depth')
+            self.bulk_create([
+                self.model(ancestor_id=ancestor_id, descendant_id=descendant_id,
+                           depth=ancestor_depth + descendant_depth + 1)
+                for ancestor_id, ancestor_depth in ancestors
+                for descendant_id, descendant_depth in subtree
+            ])
+
+    def unlink(self, task_list):
+        """
+        Detaches next task lists from the ancestors of task_list, before it gets deleted
+        (its own rows are removed by cascade)
+        """
+        ancestor_ids = list(self.filter(descendant_id=task_list.pk, depth__gt=0).values_list('ancestor_id', flat=True))
+        descendant_ids = list(self.filter(ancestor_id=task_list.pk, depth__gt=0).values_list('descendant_id', flat=True))
+
+        if len(ancestor_ids) > 0 and len(descendant_ids) > 0:
+            self.filter(ancestor_id__in=ancestor_ids, descendant_id__in=descendant_ids).delete()
+
+    @transaction.atomic
+    def rebuild(self):
+        """
+        Recomputes the whole closure from task list links
+        """
+        previous = dict(TaskList.objects.values_list('pk', 'previous_task_list_id'))
+
+        links = []
+        for descendant_id in previous:
+            ancestor_id, depth = descendant_id, 0
+            seen = set()
+            while ancestor_id is not None and ancestor_id not in seen:
+                seen.add(ancestor_id)
+                links.append(self.model(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth))
+                ancestor_id, depth = previous.get(ancestor_id), depth + 1
+
+        self.all().delete()
+        self.bulk_create(links, batch_size=1000)
+
+
+class TaskListClosure(models.Model):
+    """
+    Ancestor / descendant pairs of the `TaskList.previous_task_list` chains, including each
+    list with itself at depth 0. Kept up to date when task lists are saved or deleted.
+    """
+
+    ancestor = models.ForeignKey(TaskList, verbose_name=_('ancestor'), related_name='descendant_links',
+                                 on_delete=models.CASCADE)
+    descendant = models.ForeignKey(TaskList, verbose_name=_('descendant'), related_name='ancestor_links',
+                                   on_delete=models.CASCADE)
+    depth = models.PositiveIntegerField(verbose_name=_('depth'))
+
+    objects = TaskListClosureManager()
+
+    class Meta:
+        unique_together = ("ancestor", "descendant")
+        index_together = ("descendant", "depth")
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
+
+
+class TaskListCounterQuerySet(models.QuerySet):
+    def for_procedure(self, procedure_uuid):
+        if procedure_uuid is None:
+            return self.filter(procedure_uuid__isnull=True)
+        else:
+            return self.filter(procedure_uuid=procedure_uuid)
+
+    def add(self, task_list_id, procedure_uuid, total=0, completed=0, active=0, completed_at=None):
+        """
+        Adds deltas to the (task_list, procedure_uuid) counter, creating it when tasks get added.
+        A completed_at timestamp moves last_completed_at forward.
+        """
+        if task_list_id is None:
+            return
+
+        values = {
+            'total': F('total') + total,
+            'completed': F('completed') + completed,
+            'active': F('active') + active,
+        }
+        if completed_at is not None:
+            values['last_completed_at'] = Case(
+                When(Q(last_completed_at__isnull=True) | Q(last_completed_at__lt=completed_at),
+                     then=Value(completed_at)),
+                default=F('last_completed_at'),
+            )
+
+        counters = self.filter(task_list_id=task_list_id).for_procedure(procedure_uuid)
+
+        if counters.update(**values) == 0 and total > 0:
+            try:
+                with transaction.atomic():
+                    self.create(task_list_id=task_list_id, procedure_uuid=procedure_uuid,
+                                total=total, completed=completed, active=active,
+                                last_completed_at=completed_at)
+            except IntegrityError:
+                # created concurrently
+                counters.update(**values)
+
+    def refresh_last_completed(self, keys):
+        """
+        Recomputes last_completed_at for (task_list_id, procedure_uuid) keys, after tasks got reopened
+        """
+        for task_list_id, procedure_uuid in set(keys):
+            last_completed_at = Task.objects.filter(task_list_id=task_list_id, procedure_uuid=procedure_uuid,
+                                                    completed=True) \
+                .aggregate(last_completed_at=Max('completed_date'))['last_completed_at']
+
+            self.filter(task_list_id=task_list_id).for_procedure(procedure_uuid) \
+                .update(last_completed_at=last_completed_at)
+
+    def task_changed(self, previous, current):
+        """
+        Applies a task change, previous and current being `Task.get_counted_state()` tuples
+        (None when the task has been created or deleted)
+        """
+        reopened = []
+
+        for state, sign in ((previous, -1), (current, 1)):
+            if state is None:
+                continue
+
+            task_list_id, procedure_uuid, completed, is_active, completed_date = state
+            unchanged = previous is not None and current is not None and previous[:2] == current[:2]
+
+            if unchanged and sign < 0:
+                # same counter, only apply differences
+                self.add(task_list_id, procedure_uuid,
+                         completed=int(current[2]) - int(completed),
+                         active=int(current[3]) - int(is_active),
+                         completed_at=current[4] if current[2] and not completed else None)
+                if completed and not current[2]:
+                    reopened.append((task_list_id, procedure_uuid))
+                break
+
+            self.add(task_list_id, procedure_uuid, total=sign,
+                     completed=sign * int(completed), active=sign * int(is_active),
+                     completed_at=completed_date if completed and sign > 0 else None)
+            if completed and sign < 0:
+                reopened.append((task_list_id, procedure_uuid))
+
+        self.refresh_last_completed(reopened)
+
+    def tasks_completion_changed(self, task_ids, completed, completed_at=None):
+        """
+        Applies a bulk completion status change of task_ids
+        """
+        groups = Task.objects.filter(pk__in=task_ids) \
+            .values_list('task_list_id', 'procedure_uuid') \
+            .annotate(count=Count('pk')) \
+            .order_by()
+
+        sign = 1 if completed else -1
+        for task_list_id, procedure_uuid, count in groups:
+            self.add(task_list_id, procedure_uuid, completed=sign * count, completed_at=completed_at)
+
+        if not completed:
+            self.refresh_last_completed((task_list_id, procedure_uuid) for task_list_id, procedure_uuid, _count in groups)
+
+    def compute(self):
+        """
+        Returns counters computed from tasks, keyed by (task_list_id, procedure_uuid)
+        """
+        rows = Task.objects.filter(task_list__isnull=False) \
+            .values_list('task_list_id', 'procedure_uuid') \
+            .annotate(total_count=Count('pk'),
+                      completed_count=Count('pk', filter=Q(completed=True)),
+                      active_count=Count('pk', filter=Q(is_active=True)),
+                      last_completed=Max('completed_date', filter=Q(completed=True))) \
+            .order_by()
+
+        return {(row[0], row[1]): row[2:] for row in rows}
+
+    @transaction.atomic
+    def rebuild(self):
+        """
+        Recomputes all counters from tasks
+        """
+        self.all().delete()
+        self.bulk_create([
+            self.model(task_list_id=task_list_id, procedure_uuid=procedure_uuid,
+                       total=total, completed=completed, active=active, last_completed_at=last_completed_at)
+            for (task_list_id, procedure_uuid), (total, completed, active, last_completed_at) in self.compute().items()
+        ], batch_size=1000)
+
+    def verify(self):
+        """
+        Returns a list of (task_list_id, procedure_uuid, stored, expected) for counters out of sync
+        """
+        expected = self.compute()
+        stored = {
+            (row[0], row[1]): row[2:]
+            for row in self.values_list('task_list_id', 'procedure_uuid',
+                                        'total', 'completed', 'active', 'last_completed_at')
+        }
+
+        empty = (0, 0, 0, None)
+        return [
+            (key[0], key[1], stored.get(key, empty), expected.get(key, empty))
+            for key in sorted(set(expected) | set(stored), key=str)
+            if stored.get(key, empty) != expected.get(key, empty)
+        ]
+
+
+class TaskListCounter(models.Model):
+    """
+    Denormalized task counts per task list and procedure, kept in sync by task saves and deletes
+    and by bulk completion changes. Rebuild or verify with the `task_list_counters` command.
+    """
+
+    task_list = models.ForeignKey(TaskList, verbose_name=_('task list'), related_name='counters',
+                                  on_delete=models.CASCADE)
+    procedure_uuid = models.CharField(max_length=36, null=True, blank=True)
+
+    total = models.IntegerField(verbose_name=_('total'), default=0)
+    completed = models.IntegerField(verbose_name=_('completed'), default=0)
+    active = models.IntegerField(verbose_name=_('active'), default=0)
+
+    last_completed_at = models.DateTimeField(verbose_name=_('last completed at'), null=True, blank=True)
+
+    objects = TaskListCounterQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task_list', 'procedure_uuid'],
+                                    name='todo_tasklistcounter_unique'),
+            models.UniqueConstraint(fields=['task_list'], condition=Q(procedure_uuid__isnull=True),
+                                    name='todo_tasklistcounter_unique_no_procedure'),
+        ]
+
+    def __str__(self):
+        return f"{self.task_list_id} {self.procedure_uuid}: {self.completed}/{self.total}"
+
+
+class TaskQuerySet(models.QuerySet):
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False):
+        """
+        Inserts tasks in bulk, keeping task counters, the change log and search documents in sync
+        (no signals are sent). Backends that can't return inserted primary keys read them back in one query.
+        """
+        if ignore_conflicts:
+            raise ValueError("ignore_conflicts would leave task counters out of sync")
+
+        objs = list(objs)
+        if len(objs) == 0:
+            return objs
+
+        for obj in objs:
+            obj.title_index = normalize_title(obj.title)
+
+        with transaction.atomic(using=self.db):
+            if connections[self.db].features.can_return_rows_from_bulk_insert:
+                objs = super(TaskQuerySet, self).bulk_create(objs, batch_size=batch_size)
+            else:
+                last_pk = self.model.objects.using(self.db).aggregate(last_pk=Max('pk'))['last_pk'] or 0
+                super(TaskQuerySet, self).bulk_create(objs, batch_size=batch_size)
+                self._set_inserted_pks(objs, last_pk)
+
+            counts = {}
+            for obj in objs:
+                obj._counted_state = obj.get_counted_state()
+                task_list_id, procedure_uuid, completed, is_active, completed_date = obj._counted_state
+                total, completed_count, active, completed_at = counts.get((task_list_id, procedure_uuid),
+                                                                          (0, 0, 0, None))
+                if completed and completed_date is not None:
+                    completed_at = max(completed_at or completed_date, completed_date)
+                counts[task_list_id, procedure_uuid] = (total + 1, completed_count + int(completed),
+                                                        active + int(is_active), completed_at)
+
+            for (task_list_id, procedure_uuid), (total, completed, active, completed_at) in counts.items():
+                TaskListCounter.objects.add(task_list_id, procedure_uuid, total=total, completed=completed,
+                                            active=active, completed_at=completed_at)
+            ChangeLog.objects.log(ChangeLog.TASK, objs)
+            TaskSearchDocument.objects.index_tasks([obj.pk for obj in objs])
+
+        task_lists_changed.send(sender=self.model, task_list_ids={obj.task_list_id for obj in objs})
+
+        return objs
+
+    def _set_inserted_pks(self, objs, last_pk):
+        """
+        Sets the primary keys of objs, inserted after last_pk, matching rows on (created_by, task_list, title)
+        in insertion order
+        """
+        pks = {}
+        for pk, *key in self.model.objects.using(self.db).filter(pk__gt=last_pk).order_by('pk') \
+                .values_list('pk', 'created_by_id', 'task_list_id', 'title'):
+            pks.setdefault(tuple(key), []).append(pk)
+
+        for obj in reversed(objs):
+            obj.pk = pks[obj.created_by_id, obj.task_list_id, obj.title].pop()
+            obj._state.adding = False
+            obj._state.db = self.db
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        """
+        Updates fields of tasks in bulk, keeping task counters, the change log and search documents in sync
+        (no signals are sent). Counters are moved from the tasks' loaded state, read in one query when missing.
+        """
+        objs = list(objs)
+        fields = set(fields) | {'updated_at'}
+        if 'title' in fields:
+            fields.add('title_index')
+
+        if len(objs) == 0:
+            return
+
+        missing = [obj.pk for obj in objs if getattr(obj, '_counted_state', None) is None]
+        stored_states = {row[0]: row[1:] for row in self.model.objects.filter(pk__in=missing).values_list(
+            'pk', 'task_list_id', 'procedure_uuid', 'completed', 'is_active', 'completed_date')}
+
+        updated_at = now()
+        for obj in objs:
+            obj.updated_at = updated_at
+            obj.title_index = normalize_title(obj.title)
+
+        with transaction.atomic(using=self.db):
+            ret = super(TaskQuerySet, self).bulk_update(objs, list(fields), batch_size=batch_size)
+
+            # net (total, completed, active, completed_at) change of each counter
+            deltas, reopened, task_list_ids = {}, set(), set()
+            for obj in objs:
+                previous = getattr(obj, '_counted_state', None) or stored_states.get(obj.pk)
+                obj._counted_state = current = obj.get_counted_state()
+                task_list_ids.update([obj.task_list_id, previous and previous[0]])
+                if previous == current or previous is None or current is None:
+                    continue
+
+                for state, sign in ((previous, -1), (current, 1)):
+                    task_list_id, procedure_uuid, completed, is_active, completed_date = state
+                    total, completed_count, active, completed_at = deltas.get((task_list_id, procedure_uuid),
+                                                                              (0, 0, 0, None))
+                    if completed and sign > 0 and completed_date is not None:
+                        completed_at = max(completed_at or completed_date, completed_date)
+                    if completed and sign < 0 and (not current[2] or current[:2] != previous[:2]):
+                        reopened.add((task_list_id, procedure_uuid))
+                    deltas[task_list_id, procedure_uuid] = (total + sign, completed_count + sign * int(completed),
+                                                            active + sign * int(is_active), completed_at)
+
+            for (task_list_id, procedure_uuid), (total, completed, active, completed_at) in deltas.items():
+                TaskListCounter.objects.add(task_list_id, procedure_uuid, total=total, completed=completed,
+                                            active=active, completed_at=completed_at)
+            TaskListCounter.objects.refresh_last_completed(reopened)
+
+            ChangeLog.objects.log(ChangeLog.TASK, objs)
+            if {'title', 'note'} & fields:
+                TaskSearchDocument.objects.index_tasks([obj.pk for obj in objs])
+
+        task_lists_changed.send(sender=self.model, task_list_ids=task_list_ids - {None})
+
+        return ret
+
+    def title_startswith(self, prefix):
+        """
+        Tasks whose normalized title starts with prefix, served by the (task_list, title_index) index
+        """
+        prefix = normalize_title(prefix)
+        if prefix == '':
+            return self
+
+        tasks = self.filter(title_index__startswith=prefix)
+        if connections[self.db].vendor == 'sqlite':
+            # SQLite's LIKE is case insensitive and can't use the index, a range on the binary collation can
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            tasks = tasks.filter(title_index__gte=prefix, title_index__lt=upper)
+
+        return tasks
+
+    def set_completed(self, completed=True, user=None):
+        """
+        Set completion status for all tasks with a single UPDATE.
+
+        Only tasks actually changing status are touched; completing also sets `completed_date`
+        and, when given, `completed_by` (reopening keeps both to keep track). Listeners are
+        notified once through `tasks_completion_toggled` with all affected task ids.
+        """
+        task_ids = list(self.filter(completed=not completed).values_list("pk", flat=True))
+
+        if len(task_ids) == 0:
+            return task_ids
+
+        timestamp = now()
+        values = {"completed": completed, "updated_at": timestamp}
+
+        if completed:
+            values["completed_date"] = timestamp
+
+            if user is not None:
+                values["completed_by"] = user
+
+        with transaction.atomic():
+            self.model.objects.filter(pk__in=task_ids, completed=not completed).update(**values)
+            TaskListCounter.objects.tasks_completion_changed(task_ids, completed,
+                                                             completed_at=timestamp if completed else None)
+            ChangeLog.objects.log_tasks(task_ids)
+
+        # sending events
+        tasks_completion_toggled.send(sender=self.model, task_ids=task_ids, completed=completed)
+
+        return task_ids
+
+
 class Task(models.Model):
     title = models.CharField(max_length=255, verbose_name=_('title'))
+    # normalize_title(title), for indexed prefix matching
+    title_index = models.CharField(max_length=255, verbose_name=_('title index'), blank=True, default='',
+                                   editable=False)
     task_list = models.ForeignKey(TaskList, verbose_name=_('task list'), on_delete=models.CASCADE, null=True)
     created_at = models.DateTimeField(verbose_name=_('created at'), default=now, editable=False)  # pai
-    updated_at = models.DateTimeField(verbose_name=_('updated at'), null=True, blank=True, editable=False)  # pai
+    updated_at = models.DateTimeField(verbose_name=_('updated at'), null=True, blank=True, editable=False,
+                                      db_index=True)  # pai
     due_date = models.DateTimeField(verbose_name=_('due date'), blank=True, null=True)  # pai
     completed = models.BooleanField(verbose_name=_('completed'), default=False)
     completed_date = models.DateTimeField(verbose_name=_('completed date'), blank=True, null=True)  # pai
@@ -189,8 +637,15 @@ class Task(models.Model):
 
     # on_complete_notify = models ...
 
+    objects = TaskQuerySet.as_manager()
+
     class Meta:
         ordering = ["procedure_uuid", "priority", "created_at"]
+        indexes = [
+            # varchar_pattern_ops lets PostgreSQL use it for LIKE prefix matches, other backends ignore it
+            models.Index(fields=['task_list', 'title_index'], name='todo_task_title_index',
+                         opclasses=['int4_ops', 'varchar_pattern_ops']),
+        ]
 
     # Has due date for an instance of this object passed?
     def overdue_status(self):
@@ -206,17 +661,73 @@ class Task(models.Model):
 
         return ret
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Task, cls).from_db(db, field_names, values)
+        instance._counted_state = instance.get_counted_state()
+        instance._logged_owners = instance.get_owners()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super(Task, self).refresh_from_db(*args, **kwargs)
+        self._counted_state = self.get_counted_state()
+        self._logged_owners = self.get_owners()
+
+    def get_owners(self):
+        """
+        Returns the (created_by_id, assigned_to_id) the change log is seen by, or None if not loaded
+        """
+        if 'created_by_id' not in self.__dict__ or 'assigned_to_id' not in self.__dict__:
+            return None
+
+        return self.created_by_id, self.assigned_to_id
+
+    def get_counted_state(self):
+        """
+        Returns the values TaskListCounter depends on, or None if some are not loaded
+        """
+        fields = ('task_list_id', 'procedure_uuid', 'completed', 'is_active', 'completed_date')
+        if any(field not in self.__dict__ for field in fields):
+            return None
+
+        return tuple(self.__dict__[field] for field in fields)
+
     def save(self, *args, **kwargs):
+        self.title_index = normalize_title(self.title)
+
         if not self._state.adding:
             self.updated_at = now()
-        return super(Task, self).save(*args, **kwargs)
+
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'updated_at'}
+                if 'title' in kwargs['update_fields']:
+                    kwargs['update_fields'].add('title_index')
+
+        previous_state = None
+        if not self._state.adding:
+            previous_state = getattr(self, '_counted_state', None) or self._get_stored_counted_state()
+
+        with transaction.atomic(using=kwargs.get('using')):
+            ret = super(Task, self).save(*args, **kwargs)
+
+            self._counted_state = self.get_counted_state() or self._get_stored_counted_state()
+            TaskListCounter.objects.task_changed(previous_state, self._counted_state)
+
+        return ret
+
+    def _get_stored_counted_state(self):
+        return Task.objects.filter(pk=self.pk) \
+            .values_list('task_list_id', 'procedure_uuid', 'completed', 'is_active', 'completed_date') \
+            .first()
 
     def get_relative_url(self):
         return reverse("todo:task_detail", kwargs={"task_id": self.id})
 
     # pai
+    rest_url_name = "todo_api:task_detail"
+
     def get_relative_rest_url(self):
-        return reverse("todo_api:task_detail", args=[self.pk])
+        return reverse(self.rest_url_name, args=[self.pk])
 
     # pai
     """
@@ -229,15 +740,62 @@ class Task(models.Model):
     """
 
     def merge_into(self, merge_target):
-        if merge_target.pk == self.pk:
+        Task.merge_many([self], merge_target)
+
+    @classmethod
+    def merge_many(cls, sources, merge_target):
+        """
+        Moves comments and attachments of sources (tasks or task ids) to merge_target,
+        then deletes sources, in one short transaction.
+        """
+        source_ids = {getattr(source, 'pk', source) for source in sources}
+
+        if merge_target.pk in source_ids:
             raise ValueError("can't merge a task with self")
 
-        # lock the comments to avoid concurrent additions of comments after the
-        # update request. these comments would be irremediably lost because of
-        # the cascade clause
-        with LockedAtomicTransaction(Comment):
-            Comment.objects.filter(task=self).update(task=merge_target)
-            self.delete()
+        if len(source_ids) == 0:
+            return
+
+        with transaction.atomic():
+            # lock the source and target rows (in pk order, to avoid deadlocks) instead of the whole
+            # comment table: concurrent comment inserts on these tasks wait for the merge to end,
+            # rather than being irremediably lost because of the cascade clause
+            task_ids = source_ids | {merge_target.pk}
+            list(cls.objects.select_for_update().filter(pk__in=task_ids).order_by('pk').values_list('pk', flat=True))
+
+            # an email should only appear once per task: keep one comment per message id,
+            # the target's one if any
+            duplicated_message_ids = Comment.objects.filter(task__in=task_ids, email_message_id__isnull=False) \
+                .values('email_message_id') \
+                .annotate(count=Count('pk')) \
+                .filter(count__gt=1) \
+                .values('email_message_id')
+            duplicates = Comment.objects.filter(task__in=task_ids, email_message_id__in=duplicated_message_ids) \
+                .order_by('pk') \
+                .values_list('pk', 'task_id', 'email_message_id')
+
+            kept = {}
+            for pk, task_id, email_message_id in duplicates:
+                if email_message_id not in kept or task_id == merge_target.pk:
+                    kept[email_message_id] = pk
+            redundant_ids = [pk for pk, _task_id, email_message_id in duplicates if kept[email_message_id] != pk]
+            if len(redundant_ids) > 0:
+                Comment.objects.filter(pk__in=redundant_ids).delete()
+
+            moved_comments = list(Comment.objects.filter(task__in=source_ids).only('pk'))
+            moved_attachments = list(Attachment.objects.filter(task__in=source_ids).only('pk'))
+            Comment.objects.filter(task__in=source_ids).update(task=merge_target)
+            Attachment.objects.filter(task__in=source_ids).update(task=merge_target)
+
+            for moved in moved_comments + moved_attachments:
+                moved.task_id = merge_target.pk
+            ChangeLog.objects.log(ChangeLog.COMMENT, moved_comments)
+            ChangeLog.objects.log(ChangeLog.ATTACHMENT, moved_attachments)
+
+            cls.objects.filter(pk__in=source_ids).delete()
+            TaskSearchDocument.objects.index_tasks([merge_target.pk])
+
+        task_lists_changed.send(sender=cls, task_list_ids={merge_target.task_list_id})
 
 
 class Comment(models.Model):
@@ -305,3 +863,234 @@ class Attachment(models.Model):
 
     def __str__(self):
         return f"{self.task.id} - {self.file.name}"
+
+
+class AttachmentUpload(models.Model):
+    """
+    An attachment uploaded in chunks. Chunks are appended to a staged file in custom_fs,
+    the Attachment is created when the upload is finalized.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    task = models.ForeignKey(Task, verbose_name=_('task'), on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('user'), on_delete=models.CASCADE)
+    filename = models.CharField(verbose_name=_('filename'), max_length=255)
+    size = models.PositiveBigIntegerField(verbose_name=_('size'))
+    offset = models.PositiveBigIntegerField(verbose_name=_('offset'), default=0)
+    staged_file = models.CharField(verbose_name=_('staged file'), max_length=255, editable=False)
+    created_at = models.DateTimeField(verbose_name=_('created at'), default=now, editable=False)
+
+    def save(self, *args, **kwargs):
+        if not self.staged_file:
+            self.staged_file = custom_fs.save(get_attachment_upload_dir(self, f"{self.pk}.part"), ContentFile(b""))
+
+        super(AttachmentUpload, self).save(*args, **kwargs)
+
+    def write_chunk(self, stream, length, buffer_size=64 * 1024):
+        """
+        Writes length bytes read from stream at the current offset, a buffer at a time. Bytes past
+        the offset, left by an interrupted chunk, are overwritten.
+        """
+        if self.offset + length > self.size:
+            raise ValueError(_("Chunk exceeds upload size."))
+
+        written = 0
+        with open(custom_fs.path(self.staged_file), "r+b") as staged_file:
+            staged_file.seek(self.offset)
+            while written < length:
+                data = stream.read(min(buffer_size, length - written))
+                if not data:
+                    break
+                staged_file.write(data)
+                written += len(data)
+            staged_file.truncate()
+
+        self.offset += written
+        self.save(update_fields=['offset'])
+
+        return written
+
+    def get_staged_file(self):
+        return File(open(custom_fs.path(self.staged_file), "rb"))
+
+    def __str__(self):
+        return f"{self.task_id} - {self.filename} ({self.offset}/{self.size})"
+
+
+class ChangeLogQuerySet(models.QuerySet):
+    def log(self, kind, objects, deleted=False):
+        """
+        Appends a change of task, comment or attachment objects. Users who could see a task and no longer
+        can (it was reassigned since it was loaded) also get a tombstone. Superseded entries are deleted
+        by compact(), not here.
+        """
+        objects = list(objects)
+        if len(objects) == 0:
+            return
+
+        if kind == ChangeLog.TASK:
+            tasks = {obj.pk: obj for obj in objects}
+        else:
+            tasks = {obj.task_id: obj.task for obj in objects if type(obj).task.is_cached(obj)}
+            missing = {obj.task_id for obj in objects} - set(tasks)
+            if missing:
+                tasks.update((task.pk, task) for task in Task.objects.filter(pk__in=missing)
+                             .only('task_list_id', 'created_by_id', 'assigned_to_id'))
+
+        entries = []
+        for obj in objects:
+            task = tasks.get(obj.pk if kind == ChangeLog.TASK else obj.task_id)
+            owners = (getattr(task, 'created_by_id', None), getattr(task, 'assigned_to_id', None))
+
+            if kind == ChangeLog.TASK:
+                # owners when the task was loaded or last logged, who no longer see it
+                lost = [owner for owner in getattr(obj, '_logged_owners', None) or ()
+                        if owner not in (None,) + owners]
+                if lost:
+                    entries.append(ChangeLog(kind=kind, object_id=obj.pk, deleted=True, task_id=obj.pk,
+                                             task_list_id=obj.task_list_id,
+                                             created_by_id=lost[0], assigned_to_id=lost[-1]))
+                obj._logged_owners = owners
+
+            entries.append(ChangeLog(
+                kind=kind, object_id=obj.pk, deleted=deleted,
+                task_id=getattr(task, 'pk', None),
+                task_list_id=getattr(task, 'task_list_id', None),
+                created_by_id=owners[0], assigned_to_id=owners[1]))
+
+        self.bulk_create(entries)
+
+    def compact(self, chunk_size=1000):
+        """
+        Deletes the entries superseded by later entries of the same object, seen by the same users.
+        Returns the number of deleted entries.
+        """
+        objects = list(self.order_by().values_list('kind', 'object_id')
+                       .annotate(entry_count=Count('pk')).filter(entry_count__gt=1))
+
+        count = 0
+        for start in range(0, len(objects), chunk_size):
+            chunk = objects[start:start + chunk_size]
+            superseded, seen = [], {}
+            for kind in {row[0] for row in chunk}:
+                object_ids = [object_id for object_kind, object_id, _count in chunk if object_kind == kind]
+                # newest first, an entry is superseded when its users all see a later one (staff see all)
+                for pk, object_id, created_by_id, assigned_to_id in self.filter(
+                        kind=kind, object_id__in=object_ids).order_by('-pk') \
+                        .values_list('pk', 'object_id', 'created_by_id', 'assigned_to_id'):
+                    owners = {created_by_id, assigned_to_id} - {None}
+                    later_owners = seen.get((kind, object_id))
+                    if later_owners is None:
+                        seen[kind, object_id] = owners
+                    elif owners <= later_owners:
+                        superseded.append(pk)
+                    else:
+                        later_owners |= owners
+
+            count += self.filter(pk__in=superseded).delete()[0]
+
+        return count
+
+    def log_tasks(self, task_ids):
+        self.log(ChangeLog.TASK, Task.objects.filter(pk__in=task_ids)
+                 .only('task_list_id', 'created_by_id', 'assigned_to_id'))
+
+    def visible_to(self, user, is_staff):
+        """
+        Changes of the tasks user can see through the API (created or assigned when not staff),
+        as they were when the change happened
+        """
+        if is_staff:
+            return self.all()
+        return self.filter(Q(created_by_id=user.pk) | Q(assigned_to_id=user.pk))
+
+
+class ChangeLog(models.Model):
+    """
+    Changes of tasks, comments and attachments, deletes included (tombstones), appended on write and
+    compacted periodically (`compact_change_log` command).
+    Ids are the sync cursor. Task visibility fields are snapshots, as tasks may be gone.
+    Ids are allocated when rows are inserted, not when transactions commit: a client reading while
+    an earlier id is not yet committed moves its cursor past it and misses that change.
+    """
+
+    TASK = 'task'
+    COMMENT = 'comment'
+    ATTACHMENT = 'attachment'
+    KIND_CHOICES = ((TASK, _('task')), (COMMENT, _('comment')), (ATTACHMENT, _('attachment')))
+
+    kind = models.CharField(verbose_name=_('kind'), max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField(verbose_name=_('object id'))
+    deleted = models.BooleanField(verbose_name=_('deleted'), default=False)
+    changed_at = models.DateTimeField(verbose_name=_('changed at'), default=now, editable=False)
+
+    task_id = models.IntegerField(verbose_name=_('task id'), null=True, blank=True)
+    task_list_id = models.IntegerField(verbose_name=_('task list id'), null=True, blank=True)
+    created_by_id = models.IntegerField(verbose_name=_('created by id'), null=True, blank=True)
+    assigned_to_id = models.IntegerField(verbose_name=_('assigned to id'), null=True, blank=True)
+
+    objects = ChangeLogQuerySet.as_manager()
+
+    class Meta:
+        index_together = [('kind', 'object_id')]
+
+    def __str__(self):
+        return f"{self.pk} {self.kind} {self.object_id}{' deleted' if self.deleted else ''}"
+
+
+class TaskSearchDocumentQuerySet(models.QuerySet):
+    def index_tasks(self, task_ids):
+        """
+        Rebuilds the documents of task_ids from their title, note, comments (sender and body)
+        and attachment filenames
+        """
+        task_ids = set(task_ids)
+        if len(task_ids) == 0:
+            return
+
+        documents = {pk: [title, note or ''] for pk, title, note in
+                     Task.objects.filter(pk__in=task_ids).values_list('pk', 'title', 'note')}
+        for task_id, email_from, body in Comment.objects.filter(task_id__in=documents).order_by('pk') \
+                .values_list('task_id', 'email_from', 'body'):
+            documents[task_id].extend([email_from or '', body])
+        for task_id, file_name in Attachment.objects.filter(task_id__in=documents).order_by('pk') \
+                .values_list('task_id', 'file'):
+            documents[task_id].append(os.path.basename(file_name))
+
+        # delete and insert, the index is maintained by triggers on some backends
+        with transaction.atomic(using=self.db):
+            self.filter(task_id__in=task_ids).delete()
+            self.bulk_create([TaskSearchDocument(task_id=pk, document='\n'.join(parts))
+                              for pk, parts in documents.items()])
+
+    def rebuild(self, chunk_size=1000):
+        """
+        Rebuilds all documents, chunk_size tasks at a time. Returns the number of indexed tasks.
+        """
+        self.all().delete()
+
+        count, last_pk = 0, 0
+        while True:
+            task_ids = list(Task.objects.filter(pk__gt=last_pk).order_by('pk')
+                            .values_list('pk', flat=True)[:chunk_size])
+            if len(task_ids) == 0:
+                return count
+
+            self.index_tasks(task_ids)
+            count, last_pk = count + len(task_ids), task_ids[-1]
+
+
+class TaskSearchDocument(models.Model):
+    """
+    Searchable text of a task: title, note, comments and attachment filenames, kept up to date on save.
+    Full-text indexed by the search backend (see todo.search).
+    """
+
+    task = models.OneToOneField(Task, verbose_name=_('task'), primary_key=True, related_name='search_document',
+                                on_delete=models.CASCADE)
+    document = models.TextField(verbose_name=_('document'))
+
+    objects = TaskSearchDocumentQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.task_id} - {textwrap.shorten(self.document, 40)}"
@@ -5,6 +5,7 @@ import logging
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.db import transaction
 
 from todo.models import Task, TaskList
 
@@ -14,15 +15,30 @@ log = logging.getLogger(__name__)
 class CSVImporter:
     """Core upsert functionality for CSV import, for re-use by `import_csv` management command, web UI and tests.
     Supplies a detailed log of what was and was not imported at the end. See README for usage notes.
+
+    In bulk mode rows are processed in chunks of batch_size: users, groups, memberships and lists are read
+    into dictionaries once per file, existing tasks are matched with one query per chunk, and tasks are
+    written with bulk_create / bulk_update.
     """
 
-    def __init__(self):
+    # task fields set from a row, besides the (created_by, task_list, title) key
+    TASK_FIELDS = ["assigned_to", "completed", "created_at", "due_date", "note", "priority"]
+
+    def __init__(self, bulk=False, batch_size=1000):
         self.errors = []
         self.upserts = []
         self.summaries = []
         self.line_count = 0
         self.upsert_count = 0
 
+        self.bulk = bulk
+        self.batch_size = batch_size
+        # bulk mode lookups
+        self._users = {}
+        self._memberships = set()
+        self._groups = None
+        self._task_lists = None
+
     def upsert(self, fileobj, as_string_obj=False):
         """Expects a file *object*, not a file path. This is important because this has to work for both
         the management command and the web uploader; the web uploader will pass in in-memory file
@@ -59,41 +75,23 @@ class CSVImporter:
             )
             return
 
-        for row in csv_reader:
-            self.line_count += 1
+        if self.bulk:
+            self.upsert_bulk(csv_reader)
+        else:
+            for row in csv_reader:
+                self.line_count += 1
 
-            newrow = self.validate_row(row)
-            if newrow:
-                # newrow at this point is fully validated, and all FK relations exist,
-                # e.g. `newrow.get("Assigned To")`, is a Django User instance.
-                assignee = newrow.get("Assigned To") if newrow.get("Assigned To") else None
-                created_at = (
-                    newrow.get("Created Date")
-                    if newrow.get("Created Date")
-                    else datetime.datetime.today()
-                )
-                due_date = newrow.get("Due Date") if newrow.get("Due Date") else None
-                priority = newrow.get("Priority") if newrow.get("Priority") else None
-
-                obj, created = Task.objects.update_or_create(
-                    created_by=newrow.get("Created By"),
-                    task_list=newrow.get("Task List"),
-                    title=newrow.get("Title"),
-                    defaults={
-                        "assigned_to": assignee,
-                        "completed": newrow.get("Completed"),
-                        "created_at": created_at,
-                        "due_date": due_date,
-                        "note": newrow.get("Note"),
-                        "priority": priority,
-                    },
-                )
-                self.upsert_count += 1
-                msg = (
-                    f'Upserted task {obj.id}: "{obj.title}"'
-                    f' in list "{obj.task_list}" (group "{obj.task_list.group}")'
-                )
-                self.upserts.append(msg)
+                newrow = self.validate_row(row)
+                if newrow:
+                    # newrow at this point is fully validated, and all FK relations exist,
+                    # e.g. `newrow.get("Assigned To")`, is a Django User instance.
+                    obj, created = Task.objects.update_or_create(
+                        created_by=newrow.get("Created By"),
+                        task_list=newrow.get("Task List"),
+                        title=newrow.get("Title"),
+                        defaults=self.get_task_values(newrow),
+                    )
+                    self.add_upsert(obj)
 
         self.summaries.append(f"Processed {self.line_count} CSV rows")
         self.summaries.append(f"Upserted {self.upsert_count} rows")
@@ -101,6 +99,125 @@ class CSVImporter:
 
         return {"summaries": self.summaries, "upserts": self.upserts, "errors": self.errors}
 
+    def get_task_values(self, row):
+        """Task field values of a validated row."""
+        return {
+            "assigned_to": row.get("Assigned To") if row.get("Assigned To") else None,
+            "completed": row.get("Completed"),
+            "created_at": row.get("Created Date") if row.get("Created Date") else datetime.datetime.today(),
+            "due_date": row.get("Due Date") if row.get("Due Date") else None,
+            "note": row.get("Note"),
+            "priority": row.get("Priority") if row.get("Priority") else None,
+        }
+
+    def add_upsert(self, obj):
+        self.upsert_count += 1
+        msg = (
+            f'Upserted task {obj.id}: "{obj.title}"'
+            f' in list "{obj.task_list}" (group "{obj.task_list.group}")'
+        )
+        self.upserts.append(msg)
+
+    def upsert_bulk(self, csv_reader):
+        chunk = []
+        for row in csv_reader:
+            chunk.append(row)
+            if len(chunk) >= self.batch_size:
+                self.upsert_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            self.upsert_chunk(chunk)
+
+    def load_lookups(self, rows):
+        """Reads groups and task lists once, then the users (and their groups) not seen yet in rows."""
+        if self._groups is None:
+            self._groups = {group.name: group for group in Group.objects.all()}
+            self._task_lists = {}
+            for task_list in TaskList.objects.select_related("group").order_by("-pk"):
+                # the oldest one when names repeat in a group
+                self._task_lists[task_list.name, task_list.group_id] = task_list
+
+        usernames = {row.get(column) for row in rows for column in ("Created By", "Assigned To") if row.get(column)}
+        usernames -= set(self._users)
+        if usernames:
+            User = get_user_model()
+            users = {user.username: user for user in User.objects.filter(username__in=usernames)}
+            self._memberships.update(
+                User.groups.through.objects.filter(user__in=users.values()).values_list("user_id", "group_id")
+            )
+            # unknown ones are remembered too
+            self._users.update({username: users.get(username) for username in usernames})
+
+    def upsert_chunk(self, rows):
+        self.load_lookups(rows)
+
+        valid = []
+        for row in rows:
+            self.line_count += 1
+            newrow = self.validate_row(row)
+            if newrow:
+                valid.append(newrow)
+
+        if not valid:
+            return
+
+        # one query matches the chunk's existing tasks, on a superset of the keys
+        tasks = {}
+        for task in Task.objects.filter(
+            created_by__in={row["Created By"].pk for row in valid},
+            task_list__in={row["Task List"].pk for row in valid},
+            title__in={row["Title"] for row in valid},
+        ).order_by("-pk"):
+            tasks[task.created_by_id, task.task_list_id, task.title] = task
+
+        created, updated, upserted = [], {}, []
+        for row in valid:
+            key = (row["Created By"].pk, row["Task List"].pk, row["Title"])
+            values = self.get_task_values(row)
+
+            task = tasks.get(key)
+            if task is None:
+                # later rows with the same key update this one
+                task = tasks[key] = Task(created_by=row["Created By"], task_list=row["Task List"],
+                                         title=row["Title"], **values)
+                created.append(task)
+            else:
+                task.task_list = row["Task List"]
+                for name, value in values.items():
+                    setattr(task, name, value)
+                if task.pk is not None:
+                    updated[task.pk] = task
+
+            upserted.append(task)
+
+        with transaction.atomic():
+            Task.objects.bulk_create(created, batch_size=self.batch_size)
+            Task.objects.bulk_update(updated.values(), self.TASK_FIELDS, batch_size=self.batch_size)
+
+        for task in upserted:
+            self.add_upsert(task)
+
+    def get_user(self, username):
+        if self.bulk:
+            return self._users.get(username)
+        return get_user_model().objects.filter(username=username).first()
+
+    def get_group(self, name):
+        if self.bulk:
+            return self._groups.get(name)
+        return Group.objects.filter(name=name).first()
+
+    def in_group(self, user, group):
+        if self.bulk:
+            return group is not None and (user.pk, group.pk) in self._memberships
+        return group in user.groups.all()
+
+    def get_task_list(self, name, group):
+        if self.bulk:
+            return self._task_lists.get((name, getattr(group, "pk", None)))
+        return TaskList.objects.filter(name=name, group=group).first()
+
     def validate_row(self, row):
         """Perform data integrity checks and set default values. Returns a valid object for insertion, or False.
         Errors are stored for later display. Intentionally not broken up into separate validator functions because
@@ -115,7 +232,7 @@ class CSVImporter:
             msg = f"Missing required task creator."
             row_errors.append(msg)
 
-        creator = get_user_model().objects.filter(username=row.get("Created By")).first()
+        creator = self.get_user(row.get("Created By"))
         if not creator:
             msg = f"Invalid task creator {row.get('Created By')}"
             row_errors.append(msg)
@@ -124,40 +241,36 @@ class CSVImporter:
         # If specified, Assignee must exist
         assignee = None  # Perfectly valid
         if row.get("Assigned To"):
-            assigned = get_user_model().objects.filter(username=row.get("Assigned To"))
-            if assigned.exists():
-                assignee = assigned.first()
-            else:
+            assignee = self.get_user(row.get("Assigned To"))
+            if not assignee:
                 msg = f"Missing or invalid task assignee {row.get('Assigned To')}"
                 row_errors.append(msg)
 
         # #######################
         # Group must exist
-        try:
-            target_group = Group.objects.get(name=row.get("Group"))
-        except Group.DoesNotExist:
+        target_group = self.get_group(row.get("Group"))
+        if target_group is None:
             msg = f"Could not find group {row.get('Group')}."
             row_errors.append(msg)
-            target_group = None
 
         # #######################
         # Task creator must be in the target group
-        if creator and target_group not in creator.groups.all():
+        if creator and not self.in_group(creator, target_group):
             msg = f"{creator} is not in group {target_group}"
             row_errors.append(msg)
 
         # #######################
         # Assignee must be in the target group
-        if assignee and target_group not in assignee.groups.all():
+        if assignee and not self.in_group(assignee, target_group):
             msg = f"{assignee} is not in group {target_group}"
             row_errors.append(msg)
 
         # #######################
         # Task list must exist in the target group
-        try:
-            tasklist = TaskList.objects.get(name=row.get("Task List"), group=target_group)
+        tasklist = self.get_task_list(row.get("Task List"), target_group)
+        if tasklist is not None:
             row["Task List"] = tasklist
-        except TaskList.DoesNotExist:
+        else:
             msg = f"Task list {row.get('Task List')} in group {target_group} does not exist"
             row_errors.append(msg)
 
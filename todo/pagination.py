@@ -0,0 +1,132 @@
+import base64
+import json
+
+from django.db.models import F, Q, Sum
+
+from todo.defaults import defaults
+
+
+class KeysetPage:
+    """
+    One page of a KeysetPaginator, cursors point to its first and last rows
+    """
+
+    def __init__(self, paginator, object_list, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    @property
+    def next_cursor(self):
+        if self.has_next_page:
+            return self.paginator.encode_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous_page:
+            return self.paginator.encode_cursor(self.object_list[0])
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by seeking past the ordering values of the last row seen, instead of
+    OFFSET and COUNT. Ordering fields sort nulls last, the last one must be unique.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('priority', 'created_at', 'id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+
+    def _field(self, name):
+        return self.queryset.model._meta.get_field('id' if name == 'pk' else name)
+
+    def encode_cursor(self, obj):
+        # value_to_string keeps datetime microseconds, unlike DjangoJSONEncoder
+        values = [None if getattr(obj, name) is None else self._field(name).value_to_string(obj)
+                  for name in self.ordering]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """
+        Returns the ordering values of cursor, None if it is malformed
+        """
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            if len(values) != len(self.ordering):
+                return None
+            return [None if value is None else self._field(name).to_python(value)
+                    for name, value in zip(self.ordering, values)]
+        except Exception:
+            return None
+
+    def _seek_q(self, values, forward):
+        seek = Q(pk__in=[])
+        for i, (name, value) in enumerate(zip(self.ordering, values)):
+            if forward:
+                # nothing sorts after null
+                step = Q(pk__in=[]) if value is None else \
+                    Q(**{name + '__gt': value}) | Q(**{name + '__isnull': True})
+            else:
+                step = Q(**{name + '__isnull': False}) if value is None else Q(**{name + '__lt': value})
+
+            for previous_name, previous_value in zip(self.ordering[:i], values[:i]):
+                step &= Q(**{previous_name + '__isnull': True}) if previous_value is None else \
+                    Q(**{previous_name: previous_value})
+            seek |= step
+        return seek
+
+    def get_page(self, after=None, before=None):
+        """
+        Returns the page following the `after` cursor, or preceding the `before` cursor, or the first one
+        """
+        after = self.decode_cursor(after) if after else None
+        before = self.decode_cursor(before) if before else None
+
+        if before is not None:
+            ordering = [F(name).desc(nulls_first=True) for name in self.ordering]
+            rows = list(self.queryset.filter(self._seek_q(before, False)).order_by(*ordering)[:self.per_page + 1])
+            object_list = rows[:self.per_page][::-1]
+            return KeysetPage(self, object_list, True, len(rows) > self.per_page)
+
+        queryset = self.queryset
+        if after is not None:
+            queryset = queryset.filter(self._seek_q(after, True))
+        ordering = [F(name).asc(nulls_last=True) for name in self.ordering]
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        return KeysetPage(self, rows[:self.per_page], len(rows) > self.per_page, after is not None)
+
+
+def count_tasks(tasks, task_list=None, completed=False):
+    """
+    Returns (count, estimated). With TODO_ESTIMATED_COUNT_THRESHOLD set, lists whose counters exceed it
+    report the counters' total instead of running an exact COUNT. The counters count every task of the list:
+    pass task_list only when tasks are all of them (of the completed state), not the ones a user can see.
+    """
+    threshold = defaults('TODO_ESTIMATED_COUNT_THRESHOLD')
+    if threshold is not None and task_list is not None:
+        counts = task_list.counters.aggregate(total=Sum('total'), completed=Sum('completed'))
+        estimate = (counts['completed'] or 0) if completed else (counts['total'] or 0) - (counts['completed'] or 0)
+        if estimate > threshold:
+            return estimate, True
+
+    return tasks.count(), False
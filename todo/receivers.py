@@ -0,0 +1,118 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import (Attachment, AttachmentUpload, ChangeLog, Comment, Task, TaskList, TaskListClosure, TaskListCounter,
+                     TaskSearchDocument)
+from .cache import get_response_cache, invalidate_task_autocomplete, invalidate_task_lists
+from .signals import task_completion_toggled, task_lists_changed, tasks_completion_toggled
+from .storage import custom_fs
+from .utils import clear_permission_context
+
+
+@receiver(pre_delete, sender=TaskList)
+def unlink_task_list(sender, instance, **kwargs):
+    TaskListClosure.objects.unlink(instance)
+
+
+@receiver(post_delete, sender=Task)
+def uncount_task(sender, instance, **kwargs):
+    TaskListCounter.objects.task_changed(getattr(instance, '_counted_state', None) or instance.get_counted_state(), None)
+
+
+@receiver(post_delete, sender=AttachmentUpload)
+def delete_staged_file(sender, instance, **kwargs):
+    # kept until commit, a rolled back finalize leaves the upload resumable
+    transaction.on_commit(lambda: custom_fs.delete(instance.staged_file))
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def reset_permission_context(sender, instance, action, **kwargs):
+    if action.startswith('post_') and isinstance(instance, get_user_model()):
+        clear_permission_context(instance)
+
+
+@receiver(post_save, sender=get_user_model())
+def reset_saved_user_permission_context(sender, instance, **kwargs):
+    # the staff flag may have changed
+    clear_permission_context(instance)
+
+
+_CHANGE_LOG_KINDS = {Task: ChangeLog.TASK, Comment: ChangeLog.COMMENT, Attachment: ChangeLog.ATTACHMENT}
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Attachment)
+def log_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ChangeLog.objects.log(_CHANGE_LOG_KINDS[sender], [instance])
+
+
+@receiver(post_delete, sender=Task)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Attachment)
+def log_delete(sender, instance, **kwargs):
+    ChangeLog.objects.log(_CHANGE_LOG_KINDS[sender], [instance], deleted=True)
+
+
+@receiver(post_save, sender=TaskList)
+@receiver(post_delete, sender=TaskList)
+def invalidate_task_list_responses(sender, instance, **kwargs):
+    invalidate_task_lists([instance.pk], lists=True)
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def invalidate_task_responses(sender, instance, **kwargs):
+    # _counted_state is still the one loaded, the task may come from another list
+    previous_state = getattr(instance, '_counted_state', None)
+    invalidate_task_lists([instance.task_list_id, previous_state and previous_state[0]])
+    invalidate_task_autocomplete([instance.task_list_id, previous_state and previous_state[0]])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def invalidate_task_object_responses(sender, instance, **kwargs):
+    if get_response_cache() is not None:
+        invalidate_task_lists(Task.objects.filter(pk=instance.task_id).values_list('task_list_id', flat=True))
+
+
+@receiver(task_completion_toggled)
+def invalidate_toggled_task_responses(sender, task, **kwargs):
+    invalidate_task_lists([task.task_list_id])
+
+
+@receiver(tasks_completion_toggled)
+def invalidate_toggled_tasks_responses(sender, task_ids, **kwargs):
+    if get_response_cache() is not None:
+        invalidate_task_lists(Task.objects.filter(pk__in=task_ids).values_list('task_list_id', flat=True).distinct())
+
+
+@receiver(task_lists_changed)
+def invalidate_changed_task_lists_responses(sender, task_list_ids, **kwargs):
+    invalidate_task_lists(task_list_ids)
+    invalidate_task_autocomplete(task_list_ids)
+
+
+@receiver(post_save, sender=Task)
+def index_task(sender, instance, raw=False, update_fields=None, **kwargs):
+    if not raw and (update_fields is None or {'title', 'note'} & set(update_fields)):
+        TaskSearchDocument.objects.index_tasks([instance.pk])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Attachment)
+def index_task_object(sender, instance, raw=False, **kwargs):
+    if not raw:
+        TaskSearchDocument.objects.index_tasks([instance.task_id])
+
+
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Attachment)
+def unindex_task_object(sender, instance, **kwargs):
+    # after commit, the task itself may be being deleted
+    transaction.on_commit(lambda: TaskSearchDocument.objects.index_tasks([instance.task_id]))
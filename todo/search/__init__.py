@@ -0,0 +1,30 @@
+from django.db import connections
+
+from ..defaults import defaults
+from ..utils import import_from
+from .backends import SearchBackend, PostgresSearchBackend, SqliteSearchBackend, get_search_terms  # noqa F401
+from .facets import SearchFacets, get_facet_filters  # noqa F401
+
+
+_VENDOR_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SqliteSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    """
+    Returns the TODO_SEARCH_BACKEND (a SearchBackend class path), by default the one of the database vendor
+    """
+    backend_class = defaults('TODO_SEARCH_BACKEND')
+    if backend_class is not None:
+        return import_from(backend_class)()
+
+    return _VENDOR_BACKENDS.get(connections[using].vendor, SearchBackend)()
+
+
+def search_tasks(tasks, query):
+    """
+    Returns tasks matching query, most relevant first
+    """
+    return get_search_backend(tasks.db).search(tasks, query)
@@ -0,0 +1,124 @@
+import re
+
+
+_TERM = re.compile(r'\w+')
+
+TASK_TABLE = 'todo_task'
+DOCUMENT_TABLE = 'todo_tasksearchdocument'
+
+
+def get_search_terms(query):
+    """
+    Returns the words of a search query, lowercased. Words only, safe in any full-text query syntax.
+    """
+    return _TERM.findall(query.lower())
+
+
+class SearchBackend:
+    """
+    Matches tasks whose document contains every query term, newest first. No index: backends
+    create theirs in install(), which must be idempotent, and use it in search().
+    install() and uninstall() execute SQL with a schema editor (in migrations) or a cursor.
+    """
+
+    def install(self, executor):
+        pass
+
+    def uninstall(self, executor):
+        pass
+
+    def rebuild(self, connection):
+        """
+        Called once all documents are rebuilt
+        """
+        pass
+
+    def search(self, tasks, query):
+        terms = get_search_terms(query)
+        if len(terms) == 0:
+            return tasks.none()
+
+        for term in terms:
+            tasks = tasks.filter(search_document__document__icontains=term)
+
+        return tasks.order_by('-created_at', '-pk')
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    GIN index on the documents tsvector, terms are prefix matched and results ranked with ts_rank
+    """
+    config = 'simple'
+    index_name = 'todo_tasksearchdocument_fts'
+
+    @property
+    def vector(self):
+        # must match the indexed expression
+        return f"to_tsvector('{self.config}', {DOCUMENT_TABLE}.document)"
+
+    def install(self, executor):
+        executor.execute(f"CREATE INDEX IF NOT EXISTS {self.index_name} ON {DOCUMENT_TABLE} "
+                         f"USING gin (to_tsvector('{self.config}', document))")
+
+    def uninstall(self, executor):
+        executor.execute(f"DROP INDEX IF EXISTS {self.index_name}")
+
+    def search(self, tasks, query):
+        terms = get_search_terms(query)
+        if len(terms) == 0:
+            return tasks.none()
+
+        ts_query = ' & '.join(f'{term}:*' for term in terms)
+        return tasks.extra(
+            tables=[DOCUMENT_TABLE],
+            where=[f"{DOCUMENT_TABLE}.task_id = {TASK_TABLE}.id",
+                   f"{self.vector} @@ to_tsquery('{self.config}', %s)"],
+            params=[ts_query],
+            select={'search_rank': f"ts_rank({self.vector}, to_tsquery('{self.config}', %s))"},
+            select_params=[ts_query],
+            order_by=['-search_rank', '-id'])
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    FTS5 table over the documents (external content, kept in sync by triggers),
+    terms are prefix matched and results ranked with bm25
+    """
+    fts_table = 'todo_tasksearchdocument_fts'
+
+    def install(self, executor):
+        fts = self.fts_table
+        executor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} "
+                         f"USING fts5(document, content='{DOCUMENT_TABLE}', content_rowid='task_id')")
+        executor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {DOCUMENT_TABLE} BEGIN "
+                         f"INSERT INTO {fts} (rowid, document) VALUES (new.task_id, new.document); END")
+        executor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {DOCUMENT_TABLE} BEGIN "
+                         f"INSERT INTO {fts} ({fts}, rowid, document) "
+                         f"VALUES ('delete', old.task_id, old.document); END")
+        executor.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE ON {DOCUMENT_TABLE} BEGIN "
+                         f"INSERT INTO {fts} ({fts}, rowid, document) "
+                         f"VALUES ('delete', old.task_id, old.document); "
+                         f"INSERT INTO {fts} (rowid, document) VALUES (new.task_id, new.document); END")
+
+    def uninstall(self, executor):
+        for trigger in ('insert', 'delete', 'update'):
+            executor.execute(f"DROP TRIGGER IF EXISTS {self.fts_table}_{trigger}")
+        executor.execute(f"DROP TABLE IF EXISTS {self.fts_table}")
+
+    def rebuild(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.fts_table} ({self.fts_table}) VALUES ('rebuild')")
+
+    def search(self, tasks, query):
+        terms = get_search_terms(query)
+        if len(terms) == 0:
+            return tasks.none()
+
+        fts = self.fts_table
+        return tasks.extra(
+            tables=[fts],
+            where=[f"{fts}.rowid = {TASK_TABLE}.id", f"{fts} MATCH %s"],
+            params=[' '.join(f'"{term}"*' for term in terms)],
+            # bm25, lower is better
+            select={'search_rank': f"{fts}.rank"},
+            order_by=['search_rank', '-id'])
@@ -0,0 +1,77 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count
+from django.utils.functional import cached_property
+
+
+# ?assigned_to= value of unassigned tasks
+UNASSIGNED = 'none'
+
+
+def get_facet_filters(params):
+    """
+    Returns the task filters selected by ?task_list=, ?completed= (1 or 0) and ?assigned_to= (id or "none"),
+    malformed values are ignored
+    """
+    filters = {}
+
+    if params.get('task_list', '').isdigit():
+        filters['task_list_id'] = int(params['task_list'])
+
+    if params.get('completed') in ('0', '1'):
+        filters['completed'] = params['completed'] == '1'
+
+    assigned_to = params.get('assigned_to', '')
+    if assigned_to == UNASSIGNED:
+        filters['assigned_to_id'] = None
+    elif assigned_to.isdigit():
+        filters['assigned_to_id'] = int(assigned_to)
+
+    return filters
+
+
+class SearchFacets:
+    """
+    Counts of tasks per task list, completed state and assignee, from one query grouped by all three.
+    Counts of any combination of facet filters are summed from the same groups.
+    """
+
+    _FILTERS = ('task_list_id', 'completed', 'assigned_to_id')
+
+    def __init__(self, tasks):
+        username = 'assigned_to__' + get_user_model().USERNAME_FIELD
+
+        # order_by() drops the ranking, which would be grouped by too
+        self.groups = [
+            {'task_list_id': task_list_id, 'task_list': task_list, 'completed': completed,
+             'assigned_to_id': assigned_to_id, 'assigned_to': assigned_to, 'count': count}
+            for task_list_id, task_list, completed, assigned_to_id, assigned_to, count in tasks.order_by()
+            .values_list('task_list_id', 'task_list__name', 'completed', 'assigned_to_id', username)
+            .annotate(task_count=Count('pk'))
+        ]
+
+    def count(self, filters=None):
+        filters = filters or {}
+        return sum(group['count'] for group in self.groups
+                   if all(group[name] == filters[name] for name in self._FILTERS if name in filters))
+
+    def _facet(self, key, label):
+        counts, labels = {}, {}
+        for group in self.groups:
+            counts[group[key]] = counts.get(group[key], 0) + group['count']
+            labels[group[key]] = group[label]
+
+        return sorted(({'value': value, 'label': labels[value], 'count': count} for value, count in counts.items()),
+                      key=lambda facet: -facet['count'])
+
+    @cached_property
+    def task_lists(self):
+        return self._facet('task_list_id', 'task_list')
+
+    @cached_property
+    def completed(self):
+        return self._facet('completed', 'completed')
+
+    @cached_property
+    def assignees(self):
+        return [dict(facet, value=UNASSIGNED if facet['value'] is None else facet['value'])
+                for facet in self._facet('assigned_to_id', 'assigned_to')]
@@ -2,3 +2,9 @@ from django import dispatch
 
 
 task_completion_toggled = dispatch.Signal(providing_args=["task"])
+
+# sent once by bulk completion changes, with the ids of all affected tasks
+tasks_completion_toggled = dispatch.Signal(providing_args=["task_ids", "completed"])
+
+# sent by bulk task changes that bypass post_save, with the ids of the affected task lists
+task_lists_changed = dispatch.Signal(providing_args=["task_list_ids"])
@@ -1,16 +1,25 @@
 from django import template
+from django.db.models import Sum
 
-from ..utils import get_task_list_tasks
+from ..utils import get_task_list_tasks, staff_check
 
 register = template.Library()
 
 
 @register.simple_tag
 def todo_task_list_percentage(task_list, user):
-    user_tasks = get_task_list_tasks(task_list, user).count()
+    if user is None or staff_check(user):
+        # every task of the list is visible, read denormalized counters
+        counts = task_list.counters.aggregate(total=Sum('total'), completed=Sum('completed'))
+        user_tasks = counts['total'] or 0
+        completed_user_tasks = counts['completed'] or 0
+    else:
+        user_tasks = get_task_list_tasks(task_list, user).count()
+        completed_user_tasks = None
 
     if user_tasks == 0:
         return 0
     else:
-        completed_user_tasks = get_task_list_tasks(task_list, user, True).count()
+        if completed_user_tasks is None:
+            completed_user_tasks = get_task_list_tasks(task_list, user, True).count()
         return int((completed_user_tasks * 100) / user_tasks)
@@ -7,4 +7,10 @@ register = template.Library()
 
 @register.simple_tag
 def todo_user_can_toggle_task_done(user, task):
+    """
+    Uses the can_toggle flag set by annotate_task_permissions when present
+    """
+    can_toggle = getattr(task, 'can_toggle', None)
+    if can_toggle is not None:
+        return can_toggle
     return user_can_toggle_task_done(user, task)
@@ -1,7 +1,7 @@
 from django import template
 
 from ..models import TaskList
-from ..utils import staff_check, get_user_groups
+from ..utils import staff_check, get_permission_context
 
 register = template.Library()
 
@@ -14,5 +14,6 @@ def todo_user_task_lists(user):
     if staff_check(user):
         return TaskList.objects.filter(is_active=True).order_by('group__name', 'created_at')
     else:
-        return TaskList.objects.filter(is_active=True).filter(group__in=get_user_groups(user)).order_by('group__name',
-                                                                                                        'created_at')
+        group_ids = get_permission_context(user).group_ids
+        return TaskList.objects.filter(is_active=True).filter(group__in=group_ids).order_by('group__name',
+                                                                                            'created_at')
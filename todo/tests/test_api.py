@@ -0,0 +1,493 @@
+import base64
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, include, path, reverse
+from rest_framework.test import APIClient
+
+from todo.api import url_builder
+from todo.api.url_builder import get_url_builder
+from todo.models import AttachmentUpload, ChangeLog, Comment, Task, TaskList
+from todo.storage import custom_fs
+
+"""
+REST API endpoints, as seen by staff (u1) and non staff (ux) users.
+"""
+
+
+@pytest.fixture
+def api_client():
+    return APIClient()
+
+
+def _login(api_client, username):
+    api_client.force_authenticate(user=get_user_model().objects.get(username=username))
+    return api_client
+
+
+@pytest.mark.django_db
+def test_bulk_mark_done(todo_setup, api_client):
+    _login(api_client, "u1")
+    task_list = TaskList.objects.get(slug="zip")
+    first, second, third, blocker = (
+        Task.objects.create(title=title, task_list=task_list, priority=priority, procedure_uuid="p1",
+                            respects_priority=title != "blocker")
+        for title, priority in (("first", 10), ("second", 20), ("third", 30), ("blocker", 25))
+    )
+    done = Task.objects.get(title="Task 2", task_list=task_list)
+
+    url = reverse("todo_api:task_bulk_mark")
+    response = api_client.post(
+        url, {"ids": [first.id, second.id, third.id, done.id, 0], "completed": True}, format="json"
+    )
+    assert response.status_code == 200
+
+    results = {result["id"]: result for result in response.data["results"]}
+    assert results[first.id]["changed"]
+    assert results[second.id]["changed"]
+    # priority 25 is still pending
+    assert not results[third.id]["changed"]
+    assert results[third.id]["error"] == "Must complete previous tasks."
+    assert results[done.id]["error"] == "Task already done."
+    assert results[0]["error"] == "Not found."
+
+    assert Task.objects.filter(pk__in=[first.id, second.id], completed=True).count() == 2
+    assert not Task.objects.get(pk=third.id).completed
+
+    # reopening the first task reopens the following ones
+    blocker.completed = True
+    blocker.save()
+    response = api_client.post(url, {"ids": [third.id], "completed": True}, format="json")
+    assert response.data["results"][0]["changed"]
+
+    response = api_client.post(url, {"ids": [first.id], "completed": False}, format="json")
+    assert response.data["results"][0]["changed"]
+    assert not Task.objects.filter(pk__in=[first.id, second.id, third.id], completed=True).exists()
+
+
+@pytest.mark.django_db
+def test_bulk_mark_permissions(todo_setup, api_client):
+    _login(api_client, "ux")
+    not_mine = Task.objects.filter(task_list__slug="zip", completed=False).first()
+    mine = Task.objects.filter(task_list__slug="zep", completed=False).first()
+
+    response = api_client.post(
+        reverse("todo_api:task_bulk_mark"), {"ids": [not_mine.id, mine.id], "completed": True}, format="json"
+    )
+    results = {result["id"]: result for result in response.data["results"]}
+    assert results[mine.id]["changed"]
+    assert results[not_mine.id]["error"] == "Can not change task completion status."
+
+
+@pytest.mark.django_db
+def test_task_collection(todo_setup, api_client, django_user_model):
+    u1 = get_user_model().objects.get(username="u1")
+    _login(api_client, "u1")
+    task_list = TaskList.objects.get(slug="zip")
+    for i in range(12):
+        task = Task.objects.create(title="Paged %d" % i, task_list=task_list, procedure_uuid="p1",
+                                   assigned_to=u1 if i % 2 else None)
+        Comment.objects.create(task=task, author=u1, body="comment")
+    url = reverse("todo_api:tasks")
+
+    # the number of queries doesn't depend on page size
+    with CaptureQueriesContext(connection) as small_page:
+        response = api_client.get(url, {"procedure_uuid": "p1", "limit": 2})
+    with CaptureQueriesContext(connection) as large_page:
+        response = api_client.get(url, {"procedure_uuid": "p1", "limit": 10})
+    assert len(small_page) == len(large_page)
+    assert len(response.data["results"]) == 10
+    assert response.data["results"][0]["comments"][0]["author"] == "u1"
+
+    titles = [task["title"] for task in response.data["results"]]
+    response = api_client.get(response.data["next"])
+    titles += [task["title"] for task in response.data["results"]]
+    assert sorted(titles) == sorted("Paged %d" % i for i in range(12))
+    assert response.data["next"] is None
+
+    response = api_client.get(url, {"procedure_uuid": "p1", "assigned_to": u1.pk, "completed": "false"})
+    assert len(response.data["results"]) == 6
+
+    response = api_client.get(url, {"due_after": "not a date"})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+def test_list_detail_tasks(todo_setup, api_client):
+    _login(api_client, "u1")
+    task_list = TaskList.objects.get(slug="zip")
+    for i in range(5):
+        Task.objects.create(title="Paged %d" % i, task_list=task_list, priority=10 + i)
+
+    response = api_client.get(reverse("todo_api:list_detail", args=[task_list.pk]))
+    assert "tasks" not in response.data
+    assert response.data["counts"] == {"total": 8, "completed": 1, "open": 7}
+
+    response = api_client.get(response.data["tasks_url"], {"limit": 5})
+    assert [task["title"] for task in response.data["results"]][:3] == ["Task 1", "Task 2", "Task 3"]
+    response = api_client.get(response.data["next"])
+    assert len(response.data["results"]) == 3
+    assert response.data["next"] is None
+
+    response = api_client.get(reverse("todo_api:list_detail", args=[task_list.pk]), {"embed": "tasks", "limit": 2})
+    assert [task["title"] for task in response.data["tasks"]] == ["Task 1", "Task 2"]
+
+    # non staff users don't see the lists of other groups
+    _login(api_client, "ux")
+    response = api_client.get(reverse("todo_api:list_tasks", args=[task_list.pk]))
+    assert response.status_code == 404
+
+    # and only see the tasks they created or are assigned to in their group's lists
+    ux_list = TaskList.objects.get(slug="zep")
+    u1 = get_user_model().objects.get(username="u1")
+    Task.objects.create(title="Not mine", task_list=ux_list, created_by=u1)
+    Task.objects.create(title="Assigned", task_list=ux_list, created_by=u1,
+                        assigned_to=get_user_model().objects.get(username="ux"))
+    response = api_client.get(reverse("todo_api:list_tasks", args=[ux_list.pk]))
+    assert sorted(task["title"] for task in response.data["results"]) == ["Assigned", "Task 1", "Task 2", "Task 3"]
+
+
+@pytest.mark.django_db
+def test_url_builder_matches_reverse(todo_setup, rf):
+    request = rf.get("/api/task/", secure=True)
+    builder = get_url_builder(request)
+    assert get_url_builder(request) is builder
+
+    for name in ("todo_api:task_detail", "todo_api:task_mark_done", "todo_api:list_detail", "todo_api:list_tasks"):
+        for arg in (1, 42, "abc_1", "abc", "ABC"):
+            try:
+                expected = request.build_absolute_uri(reverse(name, args=[arg]))
+            except NoReverseMatch:
+                # args the route's converter doesn't accept are not built either
+                with pytest.raises(NoReverseMatch):
+                    builder.build(name, arg)
+                continue
+            assert builder.build(name, arg) == expected
+        assert builder.build(name, None) is None
+
+    # args needing quoting take the slow path
+    assert builder.build("todo_api:list_detail", "é") == request.build_absolute_uri(
+        reverse("todo_api:list_detail", args=["é"]))
+
+
+# django_sso_app's user route, the app isn't installed here
+urlpatterns = [
+    path("sso/", include(([path("users/<uuid:sso_id>/", lambda request, sso_id: None, name="rest-detail")],
+                          "django_sso_app_user"))),
+]
+
+
+@pytest.mark.urls(__name__)
+def test_url_builder_sso_user_route(rf, monkeypatch):
+    request = rf.get("/api/task/", secure=True)
+    builder = get_url_builder(request)
+    sso_ids = ["0f8fad5b-d9cb-469f-a165-70867728950e", "7c9e6679-7425-40de-944b-e07fc1f90ae7"]
+    builder.build("django_sso_app_user:rest-detail", sso_ids[0])
+
+    # once the route is reversed, SSO user ids are concatenated
+    monkeypatch.setattr(url_builder, "reverse", lambda *args, **kwargs: pytest.fail("reversed again"))
+    for sso_id in sso_ids:
+        assert builder.build("django_sso_app_user:rest-detail", sso_id) == \
+            f"https://testserver/sso/users/{sso_id}/"
+
+
+@pytest.mark.django_db
+def test_conditional_get(todo_setup, api_client):
+    _login(api_client, "u1")
+    task_list = TaskList.objects.get(slug="zip")
+    task = Task.objects.filter(task_list=task_list).first()
+
+    for url in (reverse("todo_api:task_detail", args=[task.pk]),
+                reverse("todo_api:list_detail", args=[task_list.pk]),
+                reverse("todo_api:lists")):
+        response = api_client.get(url)
+        assert response.status_code == 200
+        etag = response["ETag"]
+        assert response["Last-Modified"]
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response["ETag"] == etag
+
+        # any change to the resource changes the ETag
+        task_list.name = task_list.name + "!"
+        task_list.save()
+        Comment.objects.create(task=task, author=task.created_by, body="new comment")
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+
+    # other users don't share ETags
+    _login(api_client, "u2")
+    response = api_client.get(reverse("todo_api:lists"), HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+    # deletes don't move Last-Modified, If-Modified-Since alone is not answered with 304
+    url = reverse("todo_api:list_detail", args=[task_list.pk])
+    last_modified = api_client.get(url)["Last-Modified"]
+    Task.objects.filter(task_list=task_list).exclude(pk=task.pk).first().delete()
+    response = api_client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == 200
+    assert response.data["counts"]["total"] == 2
+
+
+@pytest.mark.django_db
+def test_response_cache(todo_setup, api_client, settings, django_capture_on_commit_callbacks):
+    settings.TODO_API_CACHE = "default"
+    _login(api_client, "u1")
+    task_list = TaskList.objects.get(slug="zip")
+    url = reverse("todo_api:list_detail", args=[task_list.pk])
+
+    with CaptureQueriesContext(connection) as uncached:
+        first = api_client.get(url, {"expand": "tasks"})
+    with CaptureQueriesContext(connection) as cached:
+        assert api_client.get(url, {"expand": "tasks"}).data == first.data
+    # only the conditional GET stamp is read
+    assert len(cached) < len(uncached)
+
+    # tasks added, toggled in bulk or deleted are seen at once
+    with django_capture_on_commit_callbacks(execute=True):
+        Task.objects.create(created_by=task_list.group.user_set.first(), title="Task 4", task_list=task_list)
+    assert api_client.get(url).data["counts"]["total"] == first.data["counts"]["total"] + 1
+
+    with django_capture_on_commit_callbacks(execute=True):
+        task_list.task_set.all().set_completed(True)
+    assert api_client.get(url).data["counts"]["open"] == 0
+
+    with django_capture_on_commit_callbacks(execute=True):
+        task_list.name = "Renamed"
+        task_list.save()
+    assert api_client.get(url).data["name"] == "Renamed"
+    assert "Renamed" in [item["name"] for item in api_client.get(reverse("todo_api:lists")).data]
+
+    # entries are per user
+    _login(api_client, "u2")
+    assert api_client.get(reverse("todo_api:lists")).data != []
+
+
+@pytest.mark.django_db
+def test_sparse_fieldsets(todo_setup, api_client):
+    _login(api_client, "u1")
+    task_list = TaskList.objects.get(slug="zip")
+    task = Task.objects.filter(task_list=task_list).first()
+    Comment.objects.create(task=task, author=task.created_by, body="comment")
+
+    url = reverse("todo_api:task_detail", args=[task.pk])
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.get(url, {"fields": "title,completed"})
+    assert set(response.data) == {"title", "completed"}
+    assert not any('FROM "todo_comment"' in query["sql"] for query in queries)
+
+    response = api_client.get(url)
+    assert response.data["comments"][0]["body"] == "comment"
+
+    url = reverse("todo_api:list_detail", args=[task_list.pk])
+    response = api_client.get(url, {"fields": "name,tasks", "expand": "tasks"})
+    assert set(response.data) == {"name", "tasks"}
+    # nested tasks keep their fields
+    assert "created_by" in response.data["tasks"][0]
+
+    response = api_client.get(reverse("todo_api:list_tasks", args=[task_list.pk]), {"fields": "title"})
+    assert set(response.data["results"][0]) == {"title"}
+
+
+@pytest.mark.django_db
+def test_changes_since_cursor(todo_setup, api_client, django_user_model):
+    u1 = django_user_model.objects.get(username="u1")
+    _login(api_client, "u1")
+    url = reverse("todo_api:changes")
+    cursor = api_client.get(url).data["cursor"]
+
+    task_list = TaskList.objects.get(slug="zip")
+    task, other, merged = (Task.objects.create(title=title, task_list=task_list, created_by=u1)
+                           for title in ("changed", "deleted", "merged"))
+    comment = Comment.objects.create(task=merged, author=u1, body="moved")
+    task.title = "changed twice"
+    task.save()
+    other_pk = other.pk
+    other.delete()
+    merged.merge_into(task)
+    Task.objects.filter(pk=task.pk).set_completed(True)
+
+    response = api_client.get(url, {"since": cursor})
+    changes = {(change["kind"], change["id"]): change for change in response.data["changes"]}
+    # one entry per object, its last change
+    assert len(changes) == len(response.data["changes"]) == 4
+    assert changes["task", task.pk]["data"]["title"] == "changed twice"
+    assert changes["task", task.pk]["data"]["completed"]
+    assert changes["task", other_pk]["deleted"]
+    assert changes["task", merged.pk]["deleted"]
+    assert changes["comment", comment.pk]["data"]["task"] == task.pk
+
+    # nothing new after the returned cursor
+    response = api_client.get(url, {"since": response.data["cursor"]})
+    assert response.data["changes"] == []
+
+    # users only get the changes of tasks they can see
+    _login(api_client, "ux")
+    response = api_client.get(url, {"since": cursor})
+    assert response.data["changes"] == []
+
+    assert api_client.get(url, {"since": "x"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_changes_reassigned_task(todo_setup, api_client, django_user_model):
+    u1 = django_user_model.objects.get(username="u1")
+    ux = django_user_model.objects.get(username="ux")
+    url = reverse("todo_api:changes")
+    _login(api_client, "ux")
+    cursor = api_client.get(url).data["cursor"]
+
+    task = Task.objects.create(title="reassigned", task_list=TaskList.objects.get(slug="zip"),
+                               created_by=u1, assigned_to=ux)
+    response = api_client.get(url, {"since": cursor})
+    assert [(change["id"], change["deleted"]) for change in response.data["changes"]] == [(task.pk, False)]
+
+    # the previous assignee gets a tombstone, even after further changes
+    task.assigned_to = u1
+    task.save()
+    task.title = "reassigned twice"
+    task.save()
+    response = api_client.get(url, {"since": response.data["cursor"]})
+    assert [(change["id"], change["deleted"]) for change in response.data["changes"]] == [(task.pk, True)]
+
+    # staff users get the task once
+    _login(api_client, "u1")
+    response = api_client.get(url, {"since": cursor})
+    assert [(change["id"], change["deleted"]) for change in response.data["changes"]] == [(task.pk, False)]
+
+    # compacting keeps the tombstone while the previous assignee doesn't see a later entry
+    assert ChangeLog.objects.compact() == 2
+    assert ChangeLog.objects.filter(kind=ChangeLog.TASK, object_id=task.pk, deleted=True).count() == 1
+    task.assigned_to = ux
+    task.save()
+    assert ChangeLog.objects.compact() == 2
+    assert ChangeLog.objects.filter(kind=ChangeLog.TASK, object_id=task.pk).count() == 1
+
+    # compacting doesn't change what clients get
+    response = api_client.get(url, {"since": cursor})
+    assert [(change["id"], change["deleted"]) for change in response.data["changes"]] == [(task.pk, False)]
+
+
+@pytest.mark.django_db
+def test_task_export(todo_setup, api_client):
+    _login(api_client, "u1")
+    url = reverse("todo_api:task_export")
+
+    response = api_client.get(url, {"list": TaskList.objects.get(slug="zip").pk})
+    assert response["Content-Type"] == "text/csv"
+    rows = list(csv.DictReader(io.StringIO(b"".join(response.streaming_content).decode())))
+    assert [row["title"] for row in rows] == ["Task 1", "Task 2", "Task 3"]
+    assert rows[0]["group"] == "Workgroup One"
+    assert rows[0]["created_by"] == "u1"
+
+    response = api_client.get(url, {"export_format": "ndjson"}, HTTP_ACCEPT_ENCODING="gzip")
+    assert response["Content-Encoding"] == "gzip"
+    lines = gzip.decompress(b"".join(response.streaming_content)).decode().splitlines()
+    assert len(lines) == Task.objects.filter(is_active=True).count()
+    assert json.loads(lines[0])["task_list"] == "zip"
+    assert "Accept-Encoding" in response["Vary"]
+
+    for accept_encoding in ("gzip;q=0", "br, *;q=0", "*;q=1, gzip;q=0.0", "x-gzip"):
+        response = api_client.get(url, HTTP_ACCEPT_ENCODING=accept_encoding)
+        assert not response.has_header("Content-Encoding")
+        assert "Accept-Encoding" in response["Vary"]
+    assert api_client.get(url, HTTP_ACCEPT_ENCODING="br;q=1.0, *;q=0.5")["Content-Encoding"] == "gzip"
+
+    assert api_client.get(url, {"export_format": "xml"}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_ticket_add_with_fields(todo_setup, api_client, settings):
+    settings.TODO_DEFAULT_LIST_SLUG = "zip"
+    settings.TODO_DEFAULT_ASSIGNEE = "u2"
+    _login(api_client, "u1")
+
+    # ?fields= restricts read responses, not the input of writes
+    response = api_client.post(reverse("todo_api:external_add") + "?fields=title",
+                               {"title": "ticket", "note": "kept"}, format="json")
+    assert response.status_code == 201
+    assert Task.objects.get(title="ticket").note == "kept"
+
+
+@pytest.mark.django_db
+def test_bulk_ticket_add(todo_setup, api_client, settings, tmp_path):
+    # attachments are written under MEDIA_ROOT, the storage drops its cached location on change
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.TODO_DEFAULT_LIST_SLUG = "zip"
+    settings.TODO_DEFAULT_ASSIGNEE = "u2"
+    _login(api_client, "u1")
+    url = reverse("todo_api:external_bulk_add")
+    attachment = "data:application/pdf;base64," + base64.b64encode(b"%PDF-1.4 " * 20000).decode()
+
+    response = api_client.post(url, [{"title": "first", "attachment": attachment}, {"note": "no title"},
+                                     {"title": "second", "note": "note"}], format="json")
+    assert response.status_code == 201
+    results = response.data["results"]
+    assert results[0]["error"] is None and results[2]["error"] is None
+    assert "title" in results[1]["error"]
+
+    first = Task.objects.get(title="first")
+    assert first.assigned_to.username == "u2"
+    assert first.task_list.slug == "zip"
+    assert results[0]["url"].endswith(reverse("todo_api:task_detail", args=[first.pk]))
+    assert first.attachment_set.get().file.size == len(b"%PDF-1.4 " * 20000)
+    assert TaskList.objects.get(slug="zip").get_counter().total == 5
+
+    body = b"\n".join(json.dumps({"title": "ndjson %d" % i}).encode() for i in range(3))
+    response = api_client.post(url, body, content_type="application/x-ndjson")
+    assert response.status_code == 201
+    assert Task.objects.filter(title__startswith="ndjson").count() == 3
+
+    assert api_client.post(url, {"title": "not a list"}, format="json").status_code == 400
+
+
+def test_chunked_attachment_upload(todo_setup, api_client, settings, tmp_path, django_capture_on_commit_callbacks):
+    # staged and attached files are written under MEDIA_ROOT
+    settings.MEDIA_ROOT = str(tmp_path)
+    _login(api_client, "u1")
+    task = Task.objects.filter(created_by__username="u1").first()
+    content = b"%PDF-1.4 " * 10000
+
+    response = api_client.post(reverse("todo_api:attachment_upload", args=[task.pk]),
+                               {"filename": "report.pdf", "size": len(content)}, format="json")
+    assert response.status_code == 201
+    url = reverse("todo_api:attachment_upload_detail", args=[response.data["id"]])
+    assert response.data["url"].endswith(url)
+    assert api_client.post(reverse("todo_api:attachment_upload", args=[task.pk]),
+                           {"filename": "script.exe", "size": 10}, format="json").status_code == 400
+
+    response = api_client.put(url + "?offset=0", content[:30000], content_type="application/octet-stream")
+    assert response.status_code == 200 and response.data["offset"] == 30000
+
+    # a chunk sent again after a lost response, the client resumes from the returned offset
+    response = api_client.put(url + "?offset=0", content[:30000], content_type="application/octet-stream")
+    assert response.status_code == 409 and response.data["offset"] == 30000
+
+    finalize_url = reverse("todo_api:attachment_upload_finalize", args=[response.data["id"]])
+    assert api_client.post(finalize_url).status_code == 400
+    assert task.attachment_set.count() == 0
+
+    response = api_client.put(url + "?offset=30000", content[30000:], content_type="application/octet-stream")
+    assert response.data["offset"] == len(content)
+
+    staged_file = AttachmentUpload.objects.get().staged_file
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.post(finalize_url)
+        # the staged file is only deleted once the finalize is committed
+        assert custom_fs.exists(staged_file)
+    assert response.status_code == 201
+    assert not custom_fs.exists(staged_file)
+    attachment = task.attachment_set.get()
+    assert attachment.filename() == "report.pdf"
+    assert attachment.file.read() == content
+    assert attachment.filer_file is not None
+    assert api_client.get(url).status_code == 404
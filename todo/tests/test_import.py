@@ -1,10 +1,13 @@
 import datetime
+import io
 from pathlib import Path
 
 import pytest
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from todo.models import Task, TaskList
+from todo.models import Task, TaskList, TaskListCounter
 from todo.operations.csv_importer import CSVImporter
 
 
@@ -15,12 +18,12 @@ both the `import_csv` management command and the "Import CSV" web interface.
 
 
 @pytest.mark.django_db
-@pytest.fixture
-def import_setup(todo_setup):
+@pytest.fixture(params=[False, True], ids=["rows", "bulk"])
+def import_setup(todo_setup, request):
     app_path = Path(__file__).resolve().parent.parent
     filepath = Path(app_path, "tests/data/csv_import_data.csv")
     with filepath.open(mode="r", encoding="utf-8-sig") as fileobj:
-        importer = CSVImporter()
+        importer = CSVImporter(bulk=request.param, batch_size=2)
         results = importer.upsert(fileobj, as_string_obj=True)
         assert results
     return {"results": results}
@@ -74,3 +77,43 @@ def test_inserted_row(import_setup):
     assert task.note == "This is note one"
     assert task.priority == 3
     assert task.created_at.date() == datetime.datetime.today().date()  # pai
+
+
+@pytest.mark.django_db
+def test_bulk_upsert(todo_setup):
+    """Bulk mode updates matched tasks, in a number of queries independent of the row count."""
+    header = "Title,Group,Task List,Created By,Created Date,Due Date,Completed,Assigned To,Note,Priority\n"
+    rows = "".join(f"Row {i},Workgroup One,Zip,u1,,,No,,,\n" for i in range(50))
+    rows += "Task 1,Workgroup One,Zip,u1,,,Yes,u1,Imported note,5\n"
+    rows += "Task 2,Workgroup One,Zip,u1,,,No,,,\n"
+    rows += "Row 0,Workgroup One,Zip,u1,,,No,,Repeated,\n"
+    rows += "Task 3,Workgroup One,Zip,nobody,,,No,,,\n"
+
+    with CaptureQueriesContext(connection) as queries:
+        results = CSVImporter(bulk=True).upsert(io.StringIO(header + rows), as_string_obj=True)
+    # users, memberships, groups and lists are read once
+    lookup_queries = [query for query in queries.captured_queries
+                      if any(table in query["sql"] for table in ('"auth_user"', '"auth_group"', '"todo_tasklist"'))]
+    assert len(lookup_queries) <= 5
+
+    assert "Upserted 53 rows" in results["summaries"]
+    assert results["errors"] == [{54: ["Invalid task creator nobody"]}]
+
+    task_list = TaskList.objects.get(slug="zip")
+    assert task_list.task_set.count() == 3 + 50
+    assert task_list.task_set.get(title="Row 0").note == "Repeated"
+    task = task_list.task_set.get(title="Task 1")
+    assert task.completed and task.note == "Imported note" and task.priority == 5
+    assert not task_list.task_set.get(title="Task 2").completed
+    assert TaskListCounter.objects.verify() == []
+
+    # inserting, then updating, 5 or 40 rows (one batch) takes the same queries
+    query_counts = {}
+    for count in (5, 40):
+        rows = "".join(f"Flat {count} {i},Workgroup One,Zip,u1,,,No,,,\n" for i in range(count))
+        for mode in ("insert", "update"):
+            with CaptureQueriesContext(connection) as queries:
+                CSVImporter(bulk=True).upsert(io.StringIO(header + rows), as_string_obj=True)
+            query_counts.setdefault(mode, set()).add(len(queries))
+    assert all(len(counts) == 1 for counts in query_counts.values())
+    assert TaskListCounter.objects.verify() == []
@@ -58,3 +58,26 @@ def test_tracker_task_creation(todo_setup, django_user_model):
     Comment.objects.get(
         task=task, body__contains="test3 content", email_message_id="<c@example.com>"
     )
+
+
+def test_tracker_merge_tickets(todo_setup):
+    """Duplicated mail tickets get merged in one go, keeping each email once."""
+    for subject, message_id in (("one", "<a@example.com>"), ("two", "<b@example.com>"), ("three", "<c@example.com>")):
+        msg = make_message(subject, subject + " content")
+        msg["From"] = "test1@example.com"
+        msg["Message-ID"] = message_id
+        consumer([msg])
+
+    target, *sources = Task.objects.filter(title__startswith="[TEST]").order_by("pk")
+    # the same email got attached to a source and to the target
+    Comment.objects.create(task=sources[0], email_message_id="<c@example.com>", body="three content")
+
+    Task.merge_many(sources, target)
+
+    assert not Task.objects.filter(pk__in=[source.pk for source in sources]).exists()
+    assert sorted(target.comment_set.values_list("email_message_id", flat=True)) == [
+        "<a@example.com>", "<b@example.com>", "<c@example.com>"
+    ]
+
+    with pytest.raises(ValueError):
+        target.merge_into(target)
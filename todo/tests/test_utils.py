@@ -1,8 +1,35 @@
+import io
+
+import pytest
 from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from todo.defaults import defaults
-from todo.models import Comment, Task
-from todo.utils import send_email_to_thread_participants, send_notify_mail
+from todo.models import Attachment, AttachmentUpload, ChangeLog, Comment, Task, TaskList, TaskListClosure, TaskListCounter, TaskSearchDocument
+from todo.search import search_tasks
+from todo.signals import tasks_completion_toggled
+from todo.storage import custom_fs
+from todo.utils import (
+    annotate_task_list_task_counts,
+    annotate_task_permissions,
+    _get_next_task_list_ids_closure,
+    check_previous_task_lists_completeness,
+    finalize_attachment_upload,
+    get_next_task_list_ids,
+    get_permission_context,
+    send_email_to_thread_participants,
+    send_notify_mail,
+    set_all_next_task_lists_not_completed,
+    staff_check,
+    toggle_task_completed,
+    user_can_delete_task,
+    user_can_read_task,
+    user_can_toggle_task_done,
+    user_can_view_task_list,
+)
 
 
 def test_send_notify_mail_not_me(todo_setup, django_user_model, email_backend_setup):
@@ -76,5 +103,310 @@ def test_defaults(settings):
     assert not defaults(key)
 
 
+def test_set_all_tasks_completed(todo_setup, django_user_model):
+    """Completing a whole list flips pending tasks only, with a single batched signal."""
+
+    u1 = django_user_model.objects.get(username="u1")
+    task_list = TaskList.objects.get(slug="zip")
+    pending_ids = set(task_list.task_set.filter(completed=False).values_list("pk", flat=True))
+
+    received = []
+
+    def receiver(sender, task_ids, completed, **kwargs):
+        received.append((set(task_ids), completed))
+
+    tasks_completion_toggled.connect(receiver)
+    try:
+        assert set(task_list.set_all_tasks_completed(user=u1)) == pending_ids
+    finally:
+        tasks_completion_toggled.disconnect(receiver)
+
+    assert received == [(pending_ids, True)]
+    assert task_list.all_tasks_completed()
+    for task in Task.objects.filter(pk__in=pending_ids):
+        assert task.completed_by == u1
+        assert task.completed_date is not None
+        assert task.updated_at is not None
+
+
+def test_set_all_tasks_not_completed(todo_setup):
+    task_list = TaskList.objects.get(slug="zip")
+    completed_task = task_list.task_set.get(completed=True)
+
+    assert task_list.set_all_tasks_not_completed() == [completed_task.pk]
+    assert not task_list.task_set.filter(completed=True).exists()
+
+    # nothing left to reopen
+    assert task_list.set_all_tasks_not_completed() == []
+
+
+def test_set_all_next_task_lists_not_completed(todo_setup):
+    """Reopening cascades down the whole chain of active lists, for the given procedure only."""
+
+    first = TaskList.objects.get(slug="zip")
+    group = first.group
+    second = TaskList.objects.create(group=group, name="Second", slug="second", previous_task_list=first)
+    third = TaskList.objects.create(group=group, name="Third", slug="third", previous_task_list=second)
+    inactive = TaskList.objects.create(
+        group=group, name="Inactive", slug="inactive", previous_task_list=third, is_active=False
+    )
+    after_inactive = TaskList.objects.create(
+        group=group, name="After", slug="after", previous_task_list=inactive
+    )
+
+    expected = {second.pk, third.pk}
+    assert set(get_next_task_list_ids(first)) == expected
+    assert set(_get_next_task_list_ids_closure(first)) == expected
+
+    reopened = []
+    for task_list in (second, third, after_inactive):
+        reopened.append(Task.objects.create(title="p", task_list=task_list, procedure_uuid="p1", completed=True))
+    other_procedure = Task.objects.create(title="q", task_list=third, procedure_uuid="p2", completed=True)
+
+    assert set(set_all_next_task_lists_not_completed(first, "p1")) == {reopened[0].pk, reopened[1].pk}
+
+    assert not Task.objects.get(pk=reopened[0].pk).completed
+    assert not Task.objects.get(pk=reopened[1].pk).completed
+    assert Task.objects.get(pk=reopened[2].pk).completed
+    assert Task.objects.get(pk=other_procedure.pk).completed
+
+
+def _closure_links():
+    return set(TaskListClosure.objects.filter(depth__gt=0).values_list("ancestor__slug", "descendant__slug", "depth"))
+
+
+def test_task_list_closure(todo_setup):
+    """The closure follows task lists being chained, moved and deleted."""
+
+    first = TaskList.objects.get(slug="zip")
+    second = TaskList.objects.create(group=first.group, name="Second", slug="second", previous_task_list=first)
+    third = TaskList.objects.create(group=first.group, name="Third", slug="third", previous_task_list=second)
+    assert _closure_links() == {("zip", "second", 1), ("second", "third", 1), ("zip", "third", 2)}
+
+    # move the second list (and the third along with it) after "zap"
+    second.previous_task_list = TaskList.objects.get(slug="zap")
+    second.save()
+    assert _closure_links() == {("zap", "second", 1), ("second", "third", 1), ("zap", "third", 2)}
+
+    # cycles are refused
+    second.previous_task_list = third
+    with pytest.raises(ValueError):
+        second.save()
+
+    second.refresh_from_db()
+    second.delete()
+    assert _closure_links() == set()
+
+    third.refresh_from_db()
+    assert third.previous_task_list is None
+
+
+def test_check_previous_task_lists_completeness(todo_setup):
+    first = TaskList.objects.get(slug="zip")
+    second = TaskList.objects.create(group=first.group, name="Second", slug="second", previous_task_list=first)
+    third = TaskList.objects.create(group=first.group, name="Third", slug="third", previous_task_list=second)
+    pending = Task.objects.create(title="p", task_list=first, procedure_uuid="p1")
+    Task.objects.create(title="p", task_list=second, procedure_uuid="p1", completed=True)
+
+    assert check_previous_task_lists_completeness(first, "p1")
+    assert not check_previous_task_lists_completeness(third, "p1")
+    assert check_previous_task_lists_completeness(third, "p2")
+
+    pending.completed = True
+    pending.save()
+    assert check_previous_task_lists_completeness(third, "p1")
+
+
+def test_task_list_counters(todo_setup):
+    """Counters stay in sync through creation, saves, bulk completion, moves and deletion."""
+
+    first = TaskList.objects.get(slug="zip")
+    second = TaskList.objects.get(slug="zap")
+    assert TaskListCounter.objects.verify() == []
+
+    counter = first.get_counter()
+    assert (counter.total, counter.completed, counter.active) == (3, 1, 3)
+    assert not first.all_tasks_completed()
+
+    task = Task.objects.create(title="p", task_list=first, procedure_uuid="p1")
+    assert first.get_counter("p1").total == 1
+
+    task.completed = True
+    task.completed_date = task.created_at
+    task.save()
+    assert first.get_counter("p1").last_completed_at == task.created_at
+    assert first.all_tasks_completed("p1")
+    assert first.get_last_completed_task("p1") == task
+
+    task.task_list = second
+    task.is_active = False
+    task.save()
+    assert first.get_counter("p1").total == 0
+    assert second.get_counter("p1").active == 0
+
+    first.set_all_tasks_completed()
+    assert first.all_tasks_completed()
+    second.set_all_tasks_not_completed("p1")
+    assert second.get_counter("p1").last_completed_at is None
+
+    Task.objects.filter(task_list=first).first().delete()
+    assert first.get_counter().total == 2
+
+    assert TaskListCounter.objects.verify() == []
+
+    # deleting a list drops its counters along with its tasks
+    first.delete()
+    assert not TaskListCounter.objects.filter(task_list_id=first.pk).exists()
+    assert TaskListCounter.objects.verify() == []
+
+
+def test_task_bulk_create(todo_setup, django_user_model):
+    """Tasks are inserted in bulk, their ids set, counters, change log and search documents kept in sync."""
+    u1 = django_user_model.objects.get(username="u1")
+    task_list = TaskList.objects.get(slug="zip")
+
+    query_counts = []
+    for rows in (5, 50):
+        tasks = [Task(title="Bulk %d" % (i % 3), task_list=task_list, created_by=u1, completed=i % 2 == 0)
+                 for i in range(rows)]
+        with CaptureQueriesContext(connection) as queries:
+            assert Task.objects.bulk_create(tasks) == tasks
+        query_counts.append(len(queries))
+
+        assert [task.pk for task in tasks] == sorted(task.pk for task in tasks)
+        stored = dict(Task.objects.filter(pk__in=[task.pk for task in tasks]).values_list("pk", "completed"))
+        assert [stored[task.pk] for task in tasks] == [task.completed for task in tasks]
+        assert ChangeLog.objects.filter(kind=ChangeLog.TASK, object_id__in=stored).count() == rows
+
+    # the same queries whatever the number of tasks
+    assert query_counts[0] == query_counts[1]
+    assert TaskListCounter.objects.verify() == []
+    assert len(search_tasks(Task.objects.all(), "bulk")) == 55
+
+
+def test_toggle_task_completed_respects_priority(todo_setup, django_user_model):
+    u1 = django_user_model.objects.get(username="u1")
+    task_list = TaskList.objects.get(slug="zip")
+    first, second = (
+        Task.objects.create(title=str(priority), task_list=task_list, priority=priority,
+                            procedure_uuid="p1", respects_priority=True)
+        for priority in (1, 2)
+    )
+
+    with pytest.raises(Exception):
+        toggle_task_completed(second.id, user=u1)
+
+    assert toggle_task_completed(first.id, user=u1)
+    assert toggle_task_completed(second.id, user=u1)
+    second.refresh_from_db()
+    assert second.completed
+    assert second.completed_by == u1
+
+    # reopening the first task reopens the next ones
+    assert toggle_task_completed(first.id, user=u1)
+    second.refresh_from_db()
+    assert not second.completed
+    assert TaskListCounter.objects.verify() == []
+
+
+def test_permission_context_loads_groups_once(todo_setup, django_user_model, settings,
+                                              django_assert_num_queries):
+    settings.TODO_STAFF_ONLY = True
+    ux = django_user_model.objects.get(username="ux")
+    tasks = list(Task.objects.select_related("task_list"))
+
+    with django_assert_num_queries(1):
+        for task in tasks:
+            user_can_read_task(task, ux)
+            user_can_toggle_task_done(ux, task)
+            user_can_view_task_list(ux, task.task_list)
+
+    assert get_permission_context(ux) is get_permission_context(ux)
+    assert not user_can_view_task_list(ux, tasks[0].task_list)
+
+    # changing the user's groups drops the cached context
+    ux.groups.add(tasks[0].task_list.group)
+    assert user_can_view_task_list(ux, tasks[0].task_list)
+
+    # and so does saving it, its staff flag may have changed
+    assert not staff_check(ux)
+    ux.is_staff = True
+    ux.save()
+    assert staff_check(ux)
+
+
+@pytest.mark.parametrize("username", ["u1", "ux"])
+def test_annotate_task_permissions(todo_setup, django_user_model, settings, username):
+    settings.TODO_STAFF_ONLY = True
+    user = django_user_model.objects.get(username=username)
+
+    tasks = list(annotate_task_permissions(Task.objects.select_related("task_list"), user))
+    assert tasks
+    for task in tasks:
+        assert task.can_read == user_can_read_task(task, user)
+        assert task.can_toggle == user_can_toggle_task_done(user, task)
+        assert task.can_delete == user_can_delete_task(user, task)
+
+
+def test_annotate_task_list_task_counts_without_q_function(todo_setup, django_user_model, monkeypatch):
+    # a custom read predicate without a queryset form can't be counted in SQL
+    monkeypatch.setattr("todo.utils.user_can_read_task_q", None)
+    ux = django_user_model.objects.get(username="ux")
+
+    with pytest.raises(ImproperlyConfigured):
+        annotate_task_list_task_counts(TaskList.objects.all(), ux)
+
+
 # FIXME: Add tests for:
 # Attachments: Test whether allowed, test multiple, test extensions
+
+
+@pytest.mark.parametrize("backend", [None, "todo.search.SearchBackend"])
+def test_search_tasks(todo_setup, settings, backend, django_capture_on_commit_callbacks):
+    settings.TODO_SEARCH_BACKEND = backend
+    tasks = Task.objects.filter(task_list__slug="zip")
+    first, second, third = tasks.order_by("priority")
+
+    first.note = "Printer jammed, the printer needs paper"
+    first.save()
+    Comment.objects.create(task=second, author=second.created_by, body="Printer is out of toner")
+
+    found = list(search_tasks(tasks, "print"))
+    assert set(found) == {first, second}
+    if backend is None:
+        # ranked, more occurrences first
+        assert found[0] == first
+
+    assert list(search_tasks(tasks, "printer toner")) == [second]
+    assert list(search_tasks(tasks, '"; DROP TABLE todo_task; --')) == []
+    assert list(search_tasks(tasks, "")) == []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        second.comment_set.all().delete()
+    assert list(search_tasks(tasks, "toner")) == []
+
+    TaskSearchDocument.objects.all().delete()
+    call_command("rebuild_search_index")
+    assert list(search_tasks(tasks, "jammed")) == [first]
+
+
+def test_finalize_attachment_upload_rollback(todo_setup, settings, tmp_path, monkeypatch):
+    settings.MEDIA_ROOT = str(tmp_path)
+    task = Task.objects.filter(created_by__username="u1").first()
+    content = b"%PDF-1.4 " * 100
+    upload = AttachmentUpload.objects.create(task=task, user=task.created_by, filename="report.pdf", size=len(content))
+    upload.write_chunk(io.BytesIO(content), len(content))
+
+    def fail(attachment, user):
+        raise RuntimeError("filer is down")
+
+    monkeypatch.setattr("todo.utils.add_attachment_filer_file", fail)
+    with pytest.raises(RuntimeError):
+        finalize_attachment_upload(upload)
+
+    # the upload can be finalized again, its staged file is untouched and no copy is left behind
+    assert AttachmentUpload.objects.filter(pk=upload.pk).exists()
+    assert Attachment.objects.count() == 0
+    with custom_fs.open(upload.staged_file) as staged_file:
+        assert staged_file.read() == content
+    assert [str(path) for path in tmp_path.rglob("*") if path.is_file()] == [custom_fs.path(upload.staged_file)]
@@ -3,12 +3,15 @@ import pytest
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from filer.models import File as FilerFile
 
-from todo.models import Task, TaskList, Attachment
+from todo.models import Comment, Task, TaskList, Attachment
 
 """
 First the "smoketests" - do they respond at all for a logged in admin user?
@@ -28,6 +31,21 @@ def test_view_list_lists(todo_setup, admin_client):
     assert response.status_code == 200
 
 
+def test_view_list_lists_counts(todo_setup, client, django_assert_max_num_queries):
+    for i in range(10):
+        TaskList.objects.create(group=Group.objects.get(name="Workgroup Three"), name="List %d" % i, slug="l%d" % i)
+
+    client.login(username="ux", password="password")
+    with django_assert_max_num_queries(6):
+        response = client.get(reverse("todo:lists"))
+    assert response.status_code == 200
+
+    assert response.context["list_count"] == 11
+    assert response.context["task_count"] == 2
+    zep = [task_list for task_list in response.context["lists"] if task_list.slug == "zep"][0]
+    assert (zep.open_count, zep.done_count, zep.total_count) == (2, 1, 3)
+
+
 def test_view_reorder(todo_setup, admin_client):
     url = reverse("todo:reorder_tasks")
     response = admin_client.get(url)
@@ -109,6 +127,46 @@ def test_view_search(todo_setup, admin_client):
     response = admin_client.get(url)
     assert response.status_code == 200
 
+    task = Task.objects.get(title="Task 3", task_list__slug="zip")
+    Comment.objects.create(task=task, author=task.created_by, body="The printer is on fire")
+    response = admin_client.get(url, {"q": "printer"})
+    assert [found.pk for found in response.context["page_obj"]] == [task.pk]
+
+    response = admin_client.get(url, {"q": "task"})
+    assert response.context["page_obj"].paginator.count == Task.objects.filter(title__icontains="task").count()
+
+
+def test_view_search_facets(todo_setup, admin_client, django_user_model, settings, tmp_path):
+    # the attachment is written under MEDIA_ROOT
+    settings.MEDIA_ROOT = str(tmp_path)
+    url = reverse("todo:search")
+    task = Task.objects.get(title="Task 1", task_list__slug="zap")
+    task.assigned_to = django_user_model.objects.get(username="u2")
+    task.save()
+    Comment.objects.create(task=task, email_from="Printer Support <help@example.com>", body="Ticket received")
+    Attachment.objects.create(task=Task.objects.get(title="Task 3", task_list__slug="zip"),
+                              added_by=task.created_by, file=SimpleUploadedFile("invoice-2024.pdf", b"%PDF"))
+
+    response = admin_client.get(url, {"q": "example.com"})
+    assert [found.pk for found in response.context["page_obj"]] == [task.pk]
+    response = admin_client.get(url, {"q": "invoice"})
+    assert [found.title for found in response.context["page_obj"]] == ["Task 3"]
+
+    with CaptureQueriesContext(connection) as queries:
+        response = admin_client.get(url, {"q": "task"})
+    assert not any("COUNT(*)" in query["sql"] for query in queries.captured_queries)
+    groups = dict(response.context["facet_groups"])
+    assert {facet["label"]: facet["count"] for facet in groups["In list"]} == {"Zip": 3, "Zap": 3, "Zep": 3}
+    assert {facet["label"]: facet["count"] for facet in groups["Complete"]} == {"Yes": 3, "No": 6}
+    assert {facet["label"]: facet["count"] for facet in groups["Assigned to"]} == {"u2": 1, "Anyone": 8}
+
+    # facets narrow results, counts stay those of the whole search
+    response = admin_client.get(url, {"q": "task", "completed": "0", "assigned_to": "none"})
+    assert response.context["page_obj"].paginator.count == 5
+    assert all(not found.completed and found.assigned_to is None for found in response.context["page_obj"])
+    groups = dict(response.context["facet_groups"])
+    assert [facet["selected"] for facet in groups["Assigned to"] if facet["label"] == "Anyone"] == [True]
+
 
 @pytest.mark.django_db
 def test_no_javascript_in_task_note(todo_setup, client):
@@ -285,6 +343,47 @@ def test_view_list_mine(todo_setup, client):
     assert response.status_code == 200
 
 
+def test_view_list_detail_keyset_pages(todo_setup, admin_client, settings):
+    tlist = TaskList.objects.get(slug="zip")
+    created_at = Task.objects.first().created_at
+    for i in range(45):
+        Task.objects.create(title="Paged %d" % i, task_list=tlist, created_at=created_at,
+                            priority=None if i % 3 == 0 else i % 5)
+    expected = list(Task.objects.filter(task_list=tlist, completed=False, is_active=True)
+                    .order_by(F("priority").asc(nulls_last=True), "created_at", "id"))
+    url = reverse("todo:list_detail", kwargs={"list_id": tlist.id, "list_slug": tlist.slug})
+
+    pages, params = [], {}
+    while True:
+        response = admin_client.get(url, params)
+        page = response.context["tasks"]
+        pages.append(list(page))
+        if not page.has_next():
+            break
+        params = {"after": page.next_cursor}
+    assert [len(p) for p in pages] == [20, 20, 7]
+    assert [task for p in pages for task in p] == expected
+    assert response.context["task_count"] == 47
+
+    response = admin_client.get(url, {"before": page.previous_cursor})
+    assert list(response.context["tasks"]) == pages[1]
+
+    settings.TODO_ESTIMATED_COUNT_THRESHOLD = 10
+    response = admin_client.get(url)
+    assert response.context["task_count_estimated"]
+    assert response.context["task_count"] == 47
+
+
+def test_view_list_detail_count_not_estimated(todo_setup, client, settings):
+    # the list counters count tasks non staff users may not see
+    settings.TODO_ESTIMATED_COUNT_THRESHOLD = 1
+    tlist = TaskList.objects.get(slug="zep")
+    client.login(username="ux", password="password")
+    response = client.get(reverse("todo:list_detail", kwargs={"list_id": tlist.id, "list_slug": tlist.slug}))
+    assert not response.context["task_count_estimated"]
+    assert response.context["task_count"] == len(response.context["tasks"])
+
+
 def test_view_list_not_mine(todo_setup, client):
     """View a list in a group I don't belong to.
     """
@@ -398,3 +497,39 @@ def test_download_attachment_permission(todo_setup, client):
     client.login(username="ux", password="password")
     response = client.get(url)
     assert response.status_code == 403  # Utente senza permesso ottiene accesso negato
+
+
+def test_task_autocomplete(todo_setup, admin_client, django_user_model):
+    task = Task.objects.get(title="Task 1", task_list__slug="zip")
+    user = django_user_model.objects.get(username="u1")
+    Task.objects.bulk_create([Task(title=f"Épée {i:02}", task_list=task.task_list, created_by=user)
+                              for i in range(12)])
+    url = reverse("todo:task_autocomplete", args=[task.pk])
+
+    response = admin_client.get(url, {"q": "EPEE  0"})
+    assert [result["text"] for result in response.json()["results"]] == [f"Épée {i:02}" for i in range(10)]
+    assert response.json()["pagination"]["more"] is False
+
+    response = admin_client.get(url, {"q": "epée"})
+    assert len(response.json()["results"]) == 10
+    assert response.json()["pagination"]["more"] is True
+
+    # the task itself is left out
+    response = admin_client.get(url, {"q": "task"})
+    assert [result["text"] for result in response.json()["results"]] == ["Task 2", "Task 3"]
+    assert Task.objects.filter(task_list=task.task_list).title_startswith("TASK 1").get() == task
+
+
+def test_task_autocomplete_invalidation(todo_setup, admin_client, django_capture_on_commit_callbacks):
+    task = Task.objects.get(title="Task 1", task_list__slug="zip")
+    url = reverse("todo:task_autocomplete", args=[task.pk])
+    response = admin_client.get(url, {"q": "task"})
+    assert [result["text"] for result in response.json()["results"]] == ["Task 2", "Task 3"]
+
+    # cached matches are not served once a task of the list changes
+    renamed = Task.objects.get(title="Task 3", task_list=task.task_list)
+    with django_capture_on_commit_callbacks(execute=True):
+        renamed.title = "Renamed"
+        renamed.save()
+    response = admin_client.get(url, {"q": "task"})
+    assert [result["text"] for result in response.json()["results"]] == ["Task 2"]
@@ -1,4 +1,5 @@
 import email.utils
+import hashlib
 import logging
 import os
 import time
@@ -6,15 +7,17 @@ import time
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
 from django.template.loader import render_to_string
 from django.utils import timezone  # pai
-from django.db.models import Q  # pai
-from django.db import transaction  # pai
+from django.utils.functional import cached_property
+from django.db.models import BooleanField, Case, Count, Min, Q, Value, When  # pai
+from django.db import connection, transaction  # pai
 from django.utils.translation import gettext_lazy as _  # pai
 from django.contrib.auth import get_user_model
 
 from todo.defaults import defaults
-from todo.models import Attachment, Comment, Task
+from todo.models import Attachment, Comment, Task, TaskListClosure
 
 from filer.models import File as FilerFile, Folder as FilerFolder  # pai
 
@@ -50,9 +53,9 @@ def _staff_check(user):
 
 _staff_check_function = getattr(settings, 'TODO_STAFF_CHECK_FUNCTION', None)
 if _staff_check_function is None:
-    staff_check = _staff_check
+    _staff_check_hook = _staff_check
 else:
-    staff_check = import_from(_staff_check_function)
+    _staff_check_hook = import_from(_staff_check_function)
 
 
 def _get_user_groups(user):
@@ -66,17 +69,71 @@ else:
     get_user_groups = import_from(_get_user_groups_function)
 
 
+class PermissionContext:
+    """
+    Staff flag and group ids of a user, evaluated once through the configured hooks
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def is_staff(self):
+        return bool(_staff_check_hook(self.user))
+
+    @cached_property
+    def group_ids(self):
+        groups = get_user_groups(self.user)
+        if hasattr(groups, 'values_list'):
+            return frozenset(groups.values_list('pk', flat=True))
+        return frozenset(group.pk for group in groups)
+
+    @cached_property
+    def fingerprint(self):
+        """
+        Changes whenever what the user can see may change
+        """
+        key = '{}:{}:{}'.format(self.user.pk, self.is_staff, ','.join(map(str, sorted(self.group_ids))))
+        return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_permission_context(user):
+    """
+    Returns the permission context cached on the user object, request.user lives as long as the request
+    """
+    context = getattr(user, '_todo_permission_context', None)
+    if context is None:
+        context = PermissionContext(user)
+        try:
+            user._todo_permission_context = context
+        except AttributeError:
+            pass
+    return context
+
+
+def clear_permission_context(user):
+    """
+    Drops the cached permission context, next check reloads staff flag and groups
+    """
+    user.__dict__.pop('_todo_permission_context', None)
+
+
+def staff_check(user):
+    return get_permission_context(user).is_staff
+
+
 def _user_can_read_task(task, user):
     """
     Staff, creator, assignee or same group users
     """
     # return task.task_list.group in get_user_groups(user) or user.is_superuser
     # pai
-    if staff_check(user):
+    context = get_permission_context(user)
+    if context.is_staff:
         return True
     else:
-        return task.created_by == user or task.assigned_to == user or (task.assigned_to is None and
-                                                                       task.task_list.group in get_user_groups(user))
+        return task.created_by_id == user.pk or task.assigned_to_id == user.pk or (
+            task.assigned_to_id is None and task.task_list.group_id in context.group_ids)
 
 
 _get_user_can_read_task_function = getattr(settings, 'TODO_USER_CAN_READ_TASK_FUNCTION', None)
@@ -86,6 +143,34 @@ else:
     user_can_read_task = import_from(_get_user_can_read_task_function)
 
 
+def _user_can_read_task_q(user):
+    """
+    Queryset form of _user_can_read_task
+    """
+    context = get_permission_context(user)
+    if context.is_staff:
+        return Q(pk__isnull=False)
+    else:
+        return Q(created_by=user) | Q(assigned_to=user) | Q(assigned_to__isnull=True,
+                                                              task_list__group__in=context.group_ids)
+
+
+def _get_permission_q_function(function_setting, q_function_setting, default):
+    """
+    A custom predicate without a custom queryset form has no queryset form
+    """
+    q_function = getattr(settings, q_function_setting, None)
+    if q_function is not None:
+        return import_from(q_function)
+    elif getattr(settings, function_setting, None) is None:
+        return default
+
+
+user_can_read_task_q = _get_permission_q_function('TODO_USER_CAN_READ_TASK_FUNCTION',
+                                                  'TODO_USER_CAN_READ_TASK_Q_FUNCTION',
+                                                  _user_can_read_task_q)
+
+
 def todo_get_backend(task):
     """Returns a mail backend for some task"""
     mail_backends = getattr(settings, "TODO_MAIL_BACKENDS", None)
@@ -223,23 +308,76 @@ else:
 
 def check_previous_task_lists_completeness(task_list, procedure_uuid=None):
     """
-    Checks previous task list completion status
+    Checks previous task lists completion status with one query over the task list chain closure
     """
-    if task_list is not None and task_list.previous_task_list is not None:
-        return task_list.previous_task_list.all_tasks_completed(procedure_uuid) and \
-            check_previous_task_lists_completeness(task_list.previous_task_list, procedure_uuid=procedure_uuid)
+    if task_list is not None and task_list.previous_task_list_id is not None:
+        return not Task.objects.filter(procedure_uuid=procedure_uuid, completed=False) \
+            .filter(task_list__descendant_links__descendant=task_list,
+                    task_list__descendant_links__depth__gt=0) \
+            .exists()
     else:
         return True
 
 
+def _get_next_task_list_ids_cte(task_list):
+    """
+    Resolves the whole downstream chain with a single recursive query
+    """
+    opts = task_list._meta
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    pk = qn(opts.pk.column)
+    previous = qn(opts.get_field('previous_task_list').column)
+    is_active = qn(opts.get_field('is_active').column)
+
+    # UNION (not UNION ALL) also protects against cyclic chains
+    sql = (
+        "WITH RECURSIVE next_task_lists (id) AS ("
+        "SELECT {pk} FROM {table} WHERE {previous} = %s AND {is_active} = %s "
+        "UNION "
+        "SELECT tl.{pk} FROM {table} tl INNER JOIN next_task_lists ntl ON tl.{previous} = ntl.id "
+        "WHERE tl.{is_active} = %s"
+        ") SELECT id FROM next_task_lists"
+    ).format(pk=pk, table=table, previous=previous, is_active=is_active)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [task_list.pk, True, True])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _get_next_task_list_ids_closure(task_list):
+    """
+    Resolves the whole downstream chain from the task list chain closure, skipping lists
+    reachable only through inactive ones
+    """
+    next_links = TaskListClosure.objects.filter(ancestor=task_list, depth__gt=0)
+    inactive_ids = next_links.filter(descendant__is_active=False).values('descendant_id')
+    hidden_ids = TaskListClosure.objects.filter(ancestor_id__in=inactive_ids).values('descendant_id')
+
+    return list(next_links.exclude(descendant_id__in=hidden_ids).values_list('descendant_id', flat=True))
+
+
+def get_next_task_list_ids(task_list):
+    """
+    Returns the ids of all active task lists following task_list (recursively)
+    """
+    if connection.vendor in ('postgresql', 'sqlite'):
+        return _get_next_task_list_ids_cte(task_list)
+    else:
+        return _get_next_task_list_ids_closure(task_list)
+
+
 def set_all_next_task_lists_not_completed(task_list, procedure_uuid=None):
     """
-    Set completion status False for next task lists
+    Set completion status False for next task lists, returns affected task ids
     """
-    for tl in task_list.__class__.objects.filter(is_active=True).filter(previous_task_list=task_list):
-        tl.set_all_tasks_not_completed(procedure_uuid)
+    next_task_list_ids = get_next_task_list_ids(task_list)
+
+    if len(next_task_list_ids) == 0:
+        return []
 
-        set_all_next_task_lists_not_completed(tl, procedure_uuid)
+    return Task.objects.filter(task_list__in=next_task_list_ids, procedure_uuid=procedure_uuid) \
+        .set_completed(False)
 
 
 @transaction.atomic
@@ -248,18 +386,28 @@ def toggle_task_completed(task_id: int, user=None) -> bool:
     try:
         task = Task.objects.get(id=task_id)
 
+        # Lock the task row, and its sibling priority window when priority is enforced, so that
+        # concurrent toggles are serialized. Rows are locked in pk order to avoid deadlocks, then
+        # state is read again under the lock.
+        locked_tasks = Task.objects.filter(pk=task.pk)
+        if task.respects_priority:
+            locked_tasks = Task.objects.filter(Q(pk=task.pk) |
+                                               Q(is_active=True,
+                                                 task_list=task.task_list_id,
+                                                 procedure_uuid=task.procedure_uuid))
+        list(locked_tasks.select_for_update().order_by('pk').values_list('pk', flat=True))
+
+        task.refresh_from_db()
+
         # task respects_priority checks
         if task.completed:
             if task.respects_priority:
-                next_completed_tasks = Task.objects.filter(is_active=True) \
-                    .filter(task_list=task.task_list) \
+                # reopen next tasks (completed_by is kept to keep track)
+                Task.objects.filter(is_active=True) \
+                    .filter(task_list=task.task_list_id) \
                     .filter(procedure_uuid=task.procedure_uuid) \
-                    .filter(priority__gt=task.priority, completed=True)
-                for t in next_completed_tasks:
-                    # reopen next tasks
-                    # t.completed_by = None  # keep track
-                    t.completed = False
-                    t.save()
+                    .filter(priority__gt=task.priority) \
+                    .set_completed(False)
 
                 # toggle next task_list's completion status
                 set_all_next_task_lists_not_completed(task.task_list, task.procedure_uuid)
@@ -267,7 +415,7 @@ def toggle_task_completed(task_id: int, user=None) -> bool:
         else:
             if task.respects_priority:
                 previous_incomplete_tasks_count = Task.objects.filter(is_active=True) \
-                    .filter(task_list=task.task_list) \
+                    .filter(task_list=task.task_list_id) \
                     .filter(procedure_uuid=task.procedure_uuid) \
                     .filter(priority__lt=task.priority, completed=False) \
                     .count()
@@ -294,7 +442,8 @@ def toggle_task_completed(task_id: int, user=None) -> bool:
         # else:
         #     task.completed_by = None
 
-        task.save()
+        # only write the completion fields, not a stale copy of the whole row
+        task.save(update_fields=['completed', 'completed_date', 'completed_by'])
 
         # sending events
         task_completion_toggled.send(sender=Task, task=task)
@@ -307,6 +456,126 @@ def toggle_task_completed(task_id: int, user=None) -> bool:
         raise Exception(_('Not found.'))
 
 
+def _task_groups_q(keys):
+    """
+    Q object matching tasks of (task_list_id, procedure_uuid) keys
+    """
+    q = Q(pk__in=[])
+    for task_list_id, procedure_uuid in keys:
+        q |= Q(task_list=task_list_id, procedure_uuid=procedure_uuid)
+    return q
+
+
+@transaction.atomic
+def set_tasks_completed(task_ids, completed, user=None):
+    """
+    Set completion status of many tasks at once, enforcing the `toggle_task_completed` rules
+    (permissions, priorities and previous task lists) for the whole batch with set-based queries.
+
+    Returns a {task_id: error} dict, error being None for changed tasks.
+    """
+    task_ids = set(task_ids)
+    results = dict.fromkeys(task_ids, _('Not found.'))
+
+    # lock tasks and, for those respecting priority, their sibling priority windows
+    tasks = list(Task.objects.filter(pk__in=task_ids).select_related('task_list'))
+    windows = {(t.task_list_id, t.procedure_uuid) for t in tasks if t.respects_priority}
+    list(Task.objects.filter(Q(pk__in=task_ids) | (Q(is_active=True) & _task_groups_q(windows)))
+         .select_for_update().order_by('pk').values_list('pk', flat=True))
+
+    candidates = {}
+    tasks = Task.objects.filter(pk__in=task_ids).select_related('task_list')
+    allowed_ids = user_can_toggle_tasks_done(user, tasks) if user is not None else {t.pk for t in tasks}
+    for task in tasks:
+        if task.pk not in allowed_ids:
+            results[task.pk] = _("Can not change task completion status.")
+        elif task.completed == completed:
+            results[task.pk] = _("Task already done.") if completed else _("Task not done.")
+        else:
+            candidates[task.pk] = task
+
+    if completed:
+        # a task may be blocked by batch tasks that are blocked themselves, iterate until stable
+        blocked_ids = set()
+        while True:
+            completing_ids = set(candidates) - blocked_ids
+            gated = [t for t in candidates.values() if t.pk in completing_ids and t.respects_priority]
+            groups = {(t.task_list_id, t.procedure_uuid) for t in gated}
+
+            # lowest priority still pending in each group, besides tasks being completed
+            min_priorities = {
+                (task_list_id, procedure_uuid): min_priority
+                for task_list_id, procedure_uuid, min_priority in Task.objects.filter(is_active=True, completed=False)
+                .filter(_task_groups_q(groups))
+                .exclude(pk__in=completing_ids)
+                .values_list('task_list_id', 'procedure_uuid')
+                .annotate(min_priority=Min('priority'))
+                .order_by()
+            }
+
+            # groups having pending tasks in previous task lists, besides tasks being completed
+            incomplete_previous = set()
+            chained = {key for key in groups if key[0] is not None}
+            if len(chained) > 0:
+                procedure_uuids = {procedure_uuid for _task_list_id, procedure_uuid in chained}
+                procedures_q = Q(procedure_uuid__in=procedure_uuids - {None})
+                if None in procedure_uuids:
+                    procedures_q |= Q(procedure_uuid__isnull=True)
+
+                incomplete_previous = set(
+                    Task.objects.filter(completed=False)
+                    .filter(procedures_q)
+                    .filter(task_list__descendant_links__descendant__in={key[0] for key in chained},
+                            task_list__descendant_links__depth__gt=0)
+                    .exclude(pk__in=completing_ids)
+                    .values_list('task_list__descendant_links__descendant', 'procedure_uuid')
+                    .distinct()
+                ) & chained
+
+            newly_blocked = set()
+            for t in gated:
+                key = (t.task_list_id, t.procedure_uuid)
+                min_priority = min_priorities.get(key)
+                if (min_priority is not None and t.priority is not None and min_priority < t.priority) or \
+                        key in incomplete_previous:
+                    newly_blocked.add(t.pk)
+
+            if len(newly_blocked) == 0:
+                break
+            blocked_ids |= newly_blocked
+
+        for pk in blocked_ids:
+            results[pk] = _('Must complete previous tasks.')
+
+        changed_ids = Task.objects.filter(pk__in=set(candidates) - blocked_ids).set_completed(True, user=user)
+
+    else:
+        changed_ids = Task.objects.filter(pk__in=candidates).set_completed(False)
+
+        # reopen tasks following reopened ones, and next task lists
+        min_priorities = {}
+        for t in candidates.values():
+            if t.respects_priority and t.priority is not None:
+                key = (t.task_list_id, t.procedure_uuid)
+                min_priorities[key] = min(t.priority, min_priorities.get(key, t.priority))
+
+        if len(min_priorities) > 0:
+            next_tasks_q = Q(pk__in=[])
+            for (task_list_id, procedure_uuid), min_priority in min_priorities.items():
+                next_tasks_q |= Q(task_list=task_list_id, procedure_uuid=procedure_uuid, priority__gt=min_priority)
+            Task.objects.filter(is_active=True).filter(next_tasks_q).set_completed(False)
+
+        for task_list in {t.task_list for t in candidates.values() if t.respects_priority and t.task_list}:
+            for procedure_uuid in {t.procedure_uuid for t in candidates.values()
+                                   if t.respects_priority and t.task_list_id == task_list.pk}:
+                set_all_next_task_lists_not_completed(task_list, procedure_uuid)
+
+    for pk in changed_ids:
+        results[pk] = None
+
+    return results
+
+
 def remove_attachment_file(attachment_id: int) -> bool:
     """Delete an Attachment object and its corresponding files (file and filer_file) from the filesystem."""
     try:
@@ -334,30 +603,30 @@ def remove_attachment_file(attachment_id: int) -> bool:
         return False
 
 
-# pai
-@transaction.atomic
-def add_attachment_file(request, file_data, task):
-    if file_data.size > defaults("TODO_MAXIMUM_ATTACHMENT_SIZE"):
+def validate_attachment_file(filename, size):
+    """
+    Raises if a file of this name and size can not be attached
+    """
+    if size > defaults("TODO_MAXIMUM_ATTACHMENT_SIZE"):
         raise Exception(_("File exceeds maximum attachment size."))
 
-    name, extension = os.path.splitext(file_data.name)
+    name, extension = os.path.splitext(filename)
 
     if extension.lower() not in defaults("TODO_LIMIT_FILE_ATTACHMENTS"):
         raise Exception(_("This site does not allow upload of '{}' files.").format(extension))
 
-    user = request.user  # !!
 
+def add_attachment_filer_file(attachment, user):
+    """
+    Files an attachment in the user's filer folder, users/<user>/tasks/<list slug>/<task id>
+    """
     if 'django_sso_app' in settings.INSTALLED_APPS:
         user_id = user.sso_id
     else:
         user_id = user.username
 
-    created_attachment = Attachment.objects.create(
-        task=task, added_by=user, created_at=timezone.now(), file=file_data
-    )
-
-    created_attachment_task = created_attachment.task
-    created_attachment_task_list = created_attachment_task.task_list
+    attachment_task = attachment.task
+    attachment_task_list = attachment_task.task_list
 
     # creating filer folders
     users_folder, _created = FilerFolder.objects.get_or_create(name='users')
@@ -366,23 +635,63 @@ def add_attachment_file(request, file_data, task):
                                                               owner=user)
     user_tasks_folder, _created = FilerFolder.objects.get_or_create(name='tasks',
                                                                     parent=user_folder)
-    user_tasklist_folder, _created = FilerFolder.objects.get_or_create(name=created_attachment_task_list.slug,
+    user_tasklist_folder, _created = FilerFolder.objects.get_or_create(name=attachment_task_list.slug,
                                                                        parent=user_tasks_folder)
-    user_tasklist_task_folder, _created = FilerFolder.objects.get_or_create(name=str(created_attachment_task.id),
+    user_tasklist_task_folder, _created = FilerFolder.objects.get_or_create(name=str(attachment_task.id),
                                                                             parent=user_tasklist_folder)
 
     # creating filer file
     filer_file = FilerFile()
-    filer_file.file = created_attachment.file
+    filer_file.file = attachment.file
     filer_file.owner = user
-    filer_file.original_filename = os.path.basename(created_attachment.file.name)
+    filer_file.original_filename = os.path.basename(attachment.file.name)
     filer_file.folder = user_tasklist_task_folder
 
     filer_file.save()
 
     # update attachment
-    created_attachment.filer_file = filer_file
-    created_attachment.save()
+    attachment.filer_file = filer_file
+    attachment.save()
+
+
+# pai
+@transaction.atomic
+def add_attachment_file(request, file_data, task):
+    validate_attachment_file(file_data.name, file_data.size)
+
+    user = request.user  # !!
+
+    created_attachment = Attachment.objects.create(
+        task=task, added_by=user, created_at=timezone.now(), file=file_data
+    )
+
+    add_attachment_filer_file(created_attachment, user)
+
+
+@transaction.atomic
+def finalize_attachment_upload(upload):
+    """
+    Turns a completely received AttachmentUpload into an Attachment. The staged file is copied in place
+    and only deleted once committed, so a rolled back finalize can be retried.
+    """
+    if upload.offset != upload.size:
+        raise Exception(_("Upload is incomplete."))
+
+    validate_attachment_file(upload.filename, upload.size)
+
+    attachment = Attachment(task=upload.task, added_by=upload.user, created_at=timezone.now())
+    with upload.get_staged_file() as staged_file:
+        attachment.file.save(upload.filename, staged_file, save=False)
+
+    try:
+        attachment.save()
+        add_attachment_filer_file(attachment, upload.user)
+        upload.delete()
+    except Exception:
+        attachment.file.delete(save=False)
+        raise
+
+    return attachment
 
 
 def todo_get_task_assignees(task):
@@ -410,7 +719,7 @@ def get_user_task_list_tasks(task_list, user, completed=None):
         .filter(is_active=True) \
         .filter(Q(created_by=user) |
                 Q(assigned_to=user) |
-                Q(assigned_to__isnull=True, task_list__group__in=get_user_groups(user))) \
+                Q(assigned_to__isnull=True, task_list__group__in=get_permission_context(user).group_ids)) \
         .prefetch_related('created_by', 'assigned_to')
 
     if completed is not None:
@@ -435,16 +744,17 @@ def get_task_list_tasks(task_list, user=None, completed=None):
 
 
 def todo_user_can_toggle_task_done(user, task):
-    if staff_check(user):
+    context = get_permission_context(user)
+    if context.is_staff:
         return True
     else:
-        if task.assigned_to is None:
-            if task.task_list.group in get_user_groups(user):
+        if task.assigned_to_id is None:
+            if task.task_list.group_id in context.group_ids:
                 return True
             else:
                 return False
         else:
-            return task.assigned_to == user
+            return task.assigned_to_id == user.pk
 
 
 _user_can_toggle_task_done_function = getattr(settings, 'TODO_USER_CAN_TOGGLE_TASK_DONE_FUNCTION', None)
@@ -454,11 +764,47 @@ else:
     user_can_toggle_task_done = import_from(_user_can_toggle_task_done_function)
 
 
+def todo_user_can_toggle_task_done_q(user):
+    """
+    Queryset form of todo_user_can_toggle_task_done
+    """
+    context = get_permission_context(user)
+    if context.is_staff:
+        return Q(pk__isnull=False)
+    else:
+        return Q(assigned_to=user) | Q(assigned_to__isnull=True, task_list__group__in=context.group_ids)
+
+
+user_can_toggle_task_done_q = _get_permission_q_function('TODO_USER_CAN_TOGGLE_TASK_DONE_FUNCTION',
+                                                         'TODO_USER_CAN_TOGGLE_TASK_DONE_Q_FUNCTION',
+                                                         todo_user_can_toggle_task_done_q)
+
+
+def user_can_toggle_tasks_done(user, tasks):
+    """
+    Batch form of user_can_toggle_task_done, returns the ids of tasks user can toggle
+    """
+    if _user_can_toggle_task_done_function is not None:
+        return {task.pk for task in tasks if user_can_toggle_task_done(user, task)}
+
+    context = get_permission_context(user)
+    if context.is_staff:
+        return {task.pk for task in tasks}
+
+    group_ids = context.group_ids
+    return {
+        task.pk for task in tasks
+        if (task.assigned_to_id is None and task.task_list is not None and task.task_list.group_id in group_ids) or
+        task.assigned_to_id == user.pk
+    }
+
+
 def user_can_view_task_list(user, task_list):
-    if staff_check(user):
+    context = get_permission_context(user)
+    if context.is_staff:
         return True
     else:
-        return task_list.group in get_user_groups(user)
+        return task_list.group_id in context.group_ids
 
 
 def user_can_delete_task(user, task):
@@ -470,6 +816,71 @@ def user_can_delete_task(user, task):
             task.created_by == user
 
 
+def user_can_view_task_list_q(user):
+    """
+    Queryset form of user_can_view_task_list, filters TaskList querysets
+    """
+    context = get_permission_context(user)
+    if context.is_staff:
+        return Q(pk__isnull=False)
+    else:
+        return Q(group__in=context.group_ids)
+
+
+def user_can_delete_task_q(user):
+    """
+    Queryset form of user_can_delete_task
+    """
+    if staff_check(user):
+        return Q(pk__isnull=False)
+    else:
+        return Q(procedure_uuid__isnull=True, created_by=user)
+
+
+def _prefix_q(q, prefix):
+    """
+    Rewrites the lookups of q to follow the prefix relation
+    """
+    prefixed = Q()
+    prefixed.connector = q.connector
+    prefixed.negated = q.negated
+    prefixed.children = [_prefix_q(child, prefix) if isinstance(child, Q) else ('{}__{}'.format(prefix, child[0]),
+                                                                                  child[1])
+                         for child in q.children]
+    return prefixed
+
+
+def annotate_task_list_task_counts(task_lists, user):
+    """
+    Annotates open_count, done_count and total_count of the active tasks user can read on a TaskList queryset.
+    Counting needs the queryset form of the read predicate, a custom one must come with it.
+    """
+    if user_can_read_task_q is None:
+        raise ImproperlyConfigured("Counting tasks requires TODO_USER_CAN_READ_TASK_Q_FUNCTION along with "
+                                   "TODO_USER_CAN_READ_TASK_FUNCTION")
+    visible = Q(task__is_active=True) & _prefix_q(user_can_read_task_q(user), 'task')
+
+    return task_lists.annotate(open_count=Count('task', filter=visible & Q(task__completed=False)),
+                               done_count=Count('task', filter=visible & Q(task__completed=True)),
+                               total_count=Count('task', filter=visible))
+
+
+def annotate_task_permissions(tasks, user):
+    """
+    Annotates can_read, can_toggle and can_delete flags for user on a Task queryset.
+    Flags whose predicate has no queryset form are left out and checked per task.
+    """
+    annotations = {}
+    for name, q_function in (('can_read', user_can_read_task_q),
+                             ('can_toggle', user_can_toggle_task_done_q),
+                             ('can_delete', user_can_delete_task_q)):
+        if q_function is not None:
+            annotations[name] = Case(When(q_function(user), then=Value(True)),
+                                     default=Value(False), output_field=BooleanField())
+
+    return tasks.annotate(**annotations)
+
+
 def _user_can_download_attachment(attachment, user):
     # Verifica se l'utente è il creatore dell'allegato o l'assegnatario o staff
     if attachment.added_by == user or staff_check(
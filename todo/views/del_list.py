@@ -1,11 +1,12 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.exceptions import PermissionDenied
+from django.db.models import Sum
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils.translation import gettext_lazy as _  # pai
 
-from todo.models import Task, TaskList
+from todo.models import TaskList
 from todo.utils import staff_check
 
 
@@ -33,9 +34,10 @@ def del_list(request, list_id: int, list_slug: str) -> HttpResponse:
             messages.success(request, _("{list_name} is gone.").format(list_name=task_list.name))
             return redirect("todo:lists")
         else:
-            task_count_done = Task.objects.filter(task_list=task_list.id, completed=True).count()
-            task_count_undone = Task.objects.filter(task_list=task_list.id, completed=False).count()
-            task_count_total = Task.objects.filter(task_list=task_list.id).count()
+            counts = task_list.counters.aggregate(total=Sum('total'), completed=Sum('completed'))
+            task_count_total = counts['total'] or 0
+            task_count_done = counts['completed'] or 0
+            task_count_undone = task_count_total - task_count_done
 
         context = {
             "task_list": task_list,
@@ -6,11 +6,12 @@ from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
 from django.db.models import Q  # pai
-from django.core.paginator import Paginator
 
 from todo.forms import AddEditTaskForm
 from todo.models import Task, TaskList
-from todo.utils import send_notify_mail, staff_check, get_task_list_tasks, get_user_groups
+from todo.pagination import KeysetPaginator, count_tasks
+from todo.utils import (send_notify_mail, staff_check, get_task_list_tasks, get_permission_context,
+                        annotate_task_permissions)
 
 
 @login_required
@@ -25,9 +26,10 @@ def list_detail(request, list_id=None, list_slug=None, view_completed=False) ->
 
     # Which tasks to show on this list view?
     if list_slug == "mine":
+        group_ids = get_permission_context(request.user).group_ids
         tasks = Task.objects.filter(is_active=True).filter(Q(assigned_to=request.user) |
                                                            Q(assigned_to__isnull=True,
-                                                           task_list__group__in=get_user_groups(request.user)))
+                                                             task_list__group__in=group_ids))
     else:
         # pai
         #if task_list.group not in get_user_groups(request.user) and not request.user.is_superuser:
@@ -39,7 +41,8 @@ def list_detail(request, list_id=None, list_slug=None, view_completed=False) ->
                                       .prefetch_related('created_by', 'assigned_to')
         else:
             # Show a specific list, ensuring permissions.
-            task_list = get_object_or_404(TaskList, id=list_id, group__in=get_user_groups(request.user))
+            task_list = get_object_or_404(TaskList, id=list_id,
+                                          group__in=get_permission_context(request.user).group_ids)
 
             tasks = get_task_list_tasks(task_list, request.user)
 
@@ -49,6 +52,9 @@ def list_detail(request, list_id=None, list_slug=None, view_completed=False) ->
     else:
         tasks = tasks.filter(completed=False)
 
+    # Toggle permission of every row comes with the tasks query
+    tasks = annotate_task_permissions(tasks, request.user)
+
     # ######################
     #  Add New Task Form
     # ######################
@@ -87,18 +93,21 @@ def list_detail(request, list_id=None, list_slug=None, view_completed=False) ->
                 initial={"assigned_to": request.user.id, "priority": 999, "task_list": task_list},
             )
 
-    # Pagination
-    paginator = Paginator(tasks, 20)
-
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Pagination, only the current page is loaded and rendered
+    paginator = KeysetPaginator(tasks.select_related('created_by', 'assigned_to'), 20)
+    page_obj = paginator.get_page(after=request.GET.get('after'), before=request.GET.get('before'))
+    # staff see all the tasks of the list, as counted by its counters
+    task_count, task_count_estimated = count_tasks(tasks, task_list=task_list if staff_check(request.user) else None,
+                                                   completed=view_completed)
 
     context = {
         "list_id": list_id,
         "list_slug": list_slug,
         "task_list": task_list,
         "form": form,
-        "tasks": tasks,
+        "tasks": page_obj,
+        "task_count": task_count,
+        "task_count_estimated": task_count_estimated,
         "view_completed": view_completed,
         'page_obj': page_obj
     }
@@ -4,13 +4,13 @@ from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.http import HttpResponse
 from django.shortcuts import render
-from django.db.models import Q  # pai
+from django.db.models import Count, Sum  # pai
 from django.utils import timezone  # pai
 from django.core.paginator import Paginator  # pai
 
 from todo.forms import SearchForm
-from todo.models import Task, TaskList
-from todo.utils import staff_check, get_user_groups
+from todo.models import TaskList
+from todo.utils import annotate_task_list_task_counts, get_permission_context, user_can_view_task_list_q
 
 
 @login_required
@@ -24,40 +24,33 @@ def list_lists(request) -> HttpResponse:
 
     # Make sure user belongs to at least one group.
     if not request.user.is_superuser:  # pai
-        if not get_user_groups(request.user).exists():
+        if not get_permission_context(request.user).group_ids:
             messages.warning(
                 request,
                 "You do not yet belong to any groups. Ask your administrator to add you to one.",
             )
 
-    lists = TaskList.objects.filter(is_active=True).order_by("group__name", "name")
+    lists = TaskList.objects.filter(is_active=True).filter(user_can_view_task_list_q(request.user))
 
-    # superusers see all lists, so count shouldn't filter by just lists the admin belongs to  # pai disabled
-    if not staff_check(request.user):
-        task_count = (
-            Task.objects.filter(is_active=True).filter(completed=False)
-                .filter(task_list__group__in=get_user_groups(request.user)).filter(
-                            Q(created_by=request.user) | Q(assigned_to=request.user))  # pai
-                .count()
-        )
+    # List and open task totals in one query, per list counts come with the page query
+    totals = annotate_task_list_task_counts(lists.order_by(), request.user).aggregate(
+        list_count=Count('pk'), task_count=Sum('open_count'))
+    list_count = totals['list_count']
+    task_count = totals['task_count'] or 0
 
-        lists = lists.filter(group__in=get_user_groups(request.user))
-    else:
-        task_count = (
-            Task.objects.filter(is_active=True).filter(completed=False)
-            .count()
-        )
-
-    list_count = lists.count()
+    lists = annotate_task_list_task_counts(lists, request.user) \
+        .select_related('group') \
+        .order_by("group__name", "name")
 
     # Pagination
     paginator = Paginator(lists, 20)
+    paginator.count = list_count
 
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
 
     context = {
-        "lists": lists,
+        "lists": page_obj,
         "thedate": thedate,
         "searchform": searchform,
         "list_count": list_count,
@@ -1,14 +1,33 @@
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import HttpResponse, QueryDict
 from django.shortcuts import render
+from django.utils.translation import gettext_lazy as _
 from django.core.paginator import Paginator  # pai
 
 from todo.models import Task
-from todo.utils import staff_check, get_user_groups
+from todo.search import SearchFacets, get_facet_filters, search_tasks
+from todo.utils import staff_check, get_permission_context
 from todo.forms import SearchForm
 
 
+def _get_facet_links(facets, name, query_string, params):
+    """
+    Adds the url selecting (or unselecting, when selected) each facet value, to facets
+    """
+    for facet in facets:
+        link_params = QueryDict(mutable=True)
+        link_params.update({key: value for key, value in params.items() if key not in ('page', name)})
+        link_params['q'] = query_string
+
+        facet['selected'] = params.get(name) == str(facet['value'])
+        if not facet['selected']:
+            link_params[name] = facet['value']
+        facet['url'] = '?' + link_params.urlencode()
+
+    return facets
+
+
 @login_required
 # @user_passes_test(staff_check)  # pai
 def search(request) -> HttpResponse:
@@ -33,9 +52,8 @@ def search(request) -> HttpResponse:
     context = {"form": form}
 
     if query_string != '':
-        found_tasks = Task.objects.filter(is_active=True).filter(
-            Q(title__icontains=query_string) | Q(note__icontains=query_string)
-        )
+        # ranked by the full-text index of title, note and comments
+        found_tasks = search_tasks(Task.objects.filter(is_active=True), query_string)
 
     else:
         found_tasks = None
@@ -47,10 +65,31 @@ def search(request) -> HttpResponse:
             found_tasks = found_tasks.filter(Q(created_by=request.user) |
                                              Q(assigned_to=request.user) |
                                              Q(assigned_to__isnull=True,
-                                               task_list__group__in=get_user_groups(request.user)))
+                                               task_list__group__in=get_permission_context(request.user).group_ids))
 
-    # Pagination
+    facets = None
+    if found_tasks is not None:
+        # one grouped query gives the facet counts and the results count
+        facets = SearchFacets(found_tasks)
+        facet_filters = get_facet_filters(request.GET)
+        found_tasks = found_tasks.filter(**facet_filters)
+
+        params = {key: value for key, value in request.GET.items() if key != 'q'}
+        completed = [dict(facet, value=int(facet['value']), label=_("Yes") if facet['value'] else _("No"))
+                     for facet in facets.completed]
+        assignees = [dict(facet, label=facet['label'] or _("Anyone")) for facet in facets.assignees]
+        context["facet_groups"] = [
+            (_("In list"), _get_facet_links(facets.task_lists, 'task_list', query_string, params)),
+            (_("Complete"), _get_facet_links(completed, 'completed', query_string, params)),
+            (_("Assigned to"), _get_facet_links(assignees, 'assigned_to', query_string, params)),
+        ]
+
+    # Pagination, only the page's tasks are loaded
+    if found_tasks is not None:
+        found_tasks = found_tasks.select_related('task_list', 'assigned_to')
     paginator = Paginator(found_tasks if found_tasks is not None else [], 10)
+    if facets is not None:
+        paginator.count = facets.count(facet_filters)
 
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
@@ -58,6 +97,10 @@ def search(request) -> HttpResponse:
     context["page_obj"] = page_obj
 
     context["query_string"] = query_string
+    page_params = request.GET.copy()
+    page_params.pop('page', None)
+    page_params['q'] = query_string
+    context["page_query"] = page_params.urlencode()
     context["found_tasks"] = found_tasks
 
     return render(request, "todo/search_results.html", context)
@@ -1,13 +1,37 @@
+import hashlib
+
 from dal import autocomplete
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
-from todo.models import Task
+from todo.cache import get_versions, task_autocomplete_version_key
+from todo.models import Task, normalize_title
 from todo.utils import user_can_read_task
 
 
+class _Result:
+    """
+    An autocomplete result, as cached
+    """
+
+    def __init__(self, pk, label):
+        self.pk = pk
+        self.label = label
+
+    def __str__(self):
+        return self.label
+
+
 class TaskAutocomplete(autocomplete.Select2QuerySetView):
+    # the first `limit` matches only, no COUNT
+    paginate_by = None
+    limit = 10
+    # seconds the matches of a list and prefix are cached, typing repeats the same prefixes
+    cache_timeout = 30
+    more = False
+
     @method_decorator(login_required)
     def dispatch(self, request, task_id, *args, **kwargs):
         self.task = get_object_or_404(Task, pk=task_id)
@@ -16,14 +40,37 @@ class TaskAutocomplete(autocomplete.Select2QuerySetView):
 
         return super().dispatch(request, task_id, *args, **kwargs)
 
+    def get_matches(self):
+        """
+        Returns (pk, label) of the active tasks of the list whose title starts with q, by title
+        """
+        prefix = normalize_title(self.q or '')
+        # task saves and deletes renew the list version, leaving previous matches behind
+        version, = get_versions(cache, [task_autocomplete_version_key(self.task.task_list_id)])
+        key = 'todo:task_autocomplete:{}:{}:{}'.format(self.task.task_list_id, version,
+                                                       hashlib.sha1(prefix.encode()).hexdigest())
+
+        matches = cache.get(key)
+        if matches is None:
+            # one more than shown, plus the task itself which is left out afterwards
+            tasks = Task.objects.filter(is_active=True).filter(task_list=self.task.task_list_id) \
+                .title_startswith(prefix) \
+                .only('pk', 'title', 'is_active') \
+                .order_by('title_index', 'pk')[:self.limit + 2]
+            matches = [(task.pk, str(task)) for task in tasks]
+            cache.set(key, matches, self.cache_timeout)
+
+        return matches
+
     def get_queryset(self):
         # Don't forget to filter out results depending on the visitor !
         if not self.request.user.is_authenticated:
             return Task.objects.none()
 
-        qs = Task.objects.filter(is_active=True).filter(task_list=self.task.task_list).exclude(pk=self.task.pk)
+        results = [_Result(pk, label) for pk, label in self.get_matches() if pk != self.task.pk]
+        self.more = len(results) > self.limit
 
-        if self.q:
-            qs = qs.filter(title__istartswith=self.q)
+        return results[:self.limit]
 
-        return qs
+    def has_more(self, context):
+        return self.more